@@ -0,0 +1,257 @@
+"""
+Retention for attendance history: old events move to monthly archive files.
+
+archive_attendance() moves the events of every month lying wholly before the
+retention horizon out of attendance_events into one read-only SQLite file
+per month:
+
+    <archive dir>/attendance-YYYY-MM.db    attendance_events(id, prn, ts) with
+                                           the live table's indexes
+
+A file is written under a temporary name, vacuumed and renamed into place.
+It is then listed in attendance_archive, and its events are deleted from the
+live table, in one transaction. Back-dated events that reach the live table
+after their month was archived (a central store merging a late batch) are
+merged into the month's file on the next run. attendance.py's range, count
+and page queries span the live table and the files transparently, and the
+daily and monthly rollups are never archived.
+
+Two kinds of events stay live whatever their age:
+
+    - the newest event, so SQLite never hands out an archived id again
+      (sync selects events by id)
+    - on a kiosk that syncs, events the central store has not acknowledged
+
+compact_database() then gives the freed pages back to the file system with
+PRAGMA incremental_vacuum (switching an older database to incremental
+auto-vacuum costs one full VACUUM) and truncates the write-ahead log.
+
+Kiosks archive on their own when FINGERPRINT_RETENTION_DAYS is set, see
+start_retention(), or from a scheduled task:
+
+    python archive.py --db fingerprint_data.db --days 365 [--archive-dir DIR] [--vacuum]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+from attendance import TIMESTAMP_FORMAT
+from db import DB_PATH, Database
+from metrics import DB_QUERY_SECONDS, REGISTRY
+from sync import acknowledged_events
+
+ARCHIVE_DIR = "attendance_archive"  # next to the database unless configured
+RETENTION_INTERVAL = 24 * 60 * 60
+# Seconds before a kiosk's first run, so a syncing kiosk pushes before anything is archived
+RETENTION_DELAY = 300
+
+PARTITION_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS attendance_events (id INTEGER PRIMARY KEY, prn TEXT NOT NULL, ts TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_attendance_events_ts ON attendance_events(ts)",
+    "CREATE INDEX IF NOT EXISTS idx_attendance_events_prn_ts ON attendance_events(prn, ts)",
+)
+
+
+def default_archive_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_DIR)
+
+
+def retention_cutoff(days, today=None):
+    """Start of the month holding the day `days` before today; events before it are archived."""
+    horizon = (today or date.today()) - timedelta(days=days)
+    return horizon.replace(day=1).strftime(TIMESTAMP_FORMAT)
+
+
+def _next_month(month):
+    year, month = map(int, month.split("-"))
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}-01 00:00:00"
+
+
+def _write_partition(path, existing, rows):
+    # Returns (events, first ts, last ts) of the partition as written
+    temp_path = path + ".partial"
+    if existing is not None and os.path.exists(existing):
+        shutil.copyfile(existing, temp_path)
+    elif os.path.exists(temp_path):
+        os.remove(temp_path)
+    partition = sqlite3.connect(temp_path)
+    try:
+        for statement in PARTITION_SCHEMA:
+            partition.execute(statement)
+        with partition:
+            # Rows from an interrupted run may already be in the file
+            partition.executemany("INSERT OR IGNORE INTO attendance_events (id, prn, ts) VALUES (?, ?, ?)", rows)
+        partition.execute("VACUUM")
+        summary = partition.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM attendance_events").fetchone()
+    finally:
+        partition.close()
+    os.replace(temp_path, path)
+    return summary
+
+
+def _archive_month(db, directory, month, cutoff, bound):
+    start, end = f"{month}-01 00:00:00", min(_next_month(month), cutoff)
+    selection = "FROM attendance_events WHERE ts >= ? AND ts < ? AND id <= ?"
+    with db.pool.connection() as conn:
+        rows = conn.execute(f"SELECT id, prn, ts {selection} ORDER BY ts, id", (start, end, bound)).fetchall()
+        existing = conn.execute("SELECT path FROM attendance_archive WHERE month = ?", (month,)).fetchone()
+    if not rows:
+        return 0
+    base = os.path.dirname(os.path.abspath(db.path))
+    existing = os.path.join(base, existing[0]) if existing else None
+    path = existing or os.path.join(directory, f"attendance-{month}.db")
+    events, first_ts, last_ts = _write_partition(path, existing, rows)
+    try:
+        stored = os.path.relpath(path, base)
+    except ValueError:
+        stored = os.path.abspath(path)  # Another drive
+
+    # Events are never updated and new ones get ids above `bound`, so this
+    # deletes exactly the rows just written
+    with db.pool.transaction() as conn:
+        conn.execute(
+            "INSERT INTO attendance_archive (month, path, events, first_ts, last_ts) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (month) DO UPDATE SET path = excluded.path, events = excluded.events, "
+            "first_ts = excluded.first_ts, last_ts = excluded.last_ts",
+            (month, stored, events, first_ts, last_ts)
+        )
+        conn.execute(f"DELETE {selection}", (start, end, bound))
+    return len(rows)
+
+
+def archive_attendance(db, days, directory=None, today=None):
+    """
+    Move attendance events of months wholly older than `days` into monthly archive files.
+
+    Args:
+        db: db.Database to archive.
+        days: Retention horizon; a month is archived once its last day is at
+            least this many days old.
+        directory: Where to write the files; defaults to ARCHIVE_DIR next to the database.
+
+    Returns:
+        {"months": files written, "events": events moved}.
+    """
+    if days < 1:
+        raise ValueError("The retention horizon must be at least one day.")
+    directory = directory or default_archive_dir(db.path)
+    os.makedirs(directory, exist_ok=True)
+    cutoff = retention_cutoff(days, today)
+    stats = {"months": 0, "events": 0}
+    db.attendance_writer.flush()
+    with db.pool.connection() as conn:
+        newest = conn.execute("SELECT MAX(id) FROM attendance_events").fetchone()[0]
+        acknowledged = acknowledged_events(conn)
+    if newest is None:
+        return stats
+    bound = newest - 1 if acknowledged is None else min(newest - 1, acknowledged)
+
+    # One index seek per month instead of a scan over every archivable event
+    start = ""
+    while True:
+        with db.pool.connection() as conn:
+            first = conn.execute(
+                "SELECT MIN(ts) FROM attendance_events WHERE ts >= ? AND ts < ?", (start, cutoff)
+            ).fetchone()[0]
+        if first is None:
+            return stats
+        month = first[:7]
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="archive_month"):
+            moved = _archive_month(db, directory, month, cutoff, bound)
+        if moved:
+            stats["months"] += 1
+            stats["events"] += moved
+        start = _next_month(month)
+
+
+def _database_bytes(path):
+    # Under WAL, recent pages may live only in the -wal file until a checkpoint
+    wal = path + "-wal"
+    return os.path.getsize(path) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+
+def compact_database(db, full=False):
+    """
+    Return free pages to the file system and truncate the write-ahead log.
+
+    Args:
+        full: Run a full VACUUM, which also defragments, instead of an
+            incremental one. The first compaction of a database not yet in
+            incremental auto-vacuum mode is always full.
+
+    Returns:
+        {"bytes_before": size, "bytes_after": size} of the database file and
+        its write-ahead log together.
+    """
+    db.attendance_writer.flush()
+    with REGISTRY.timer(DB_QUERY_SECONDS, query="compact"), db.pool.connection() as conn:
+        before = _database_bytes(db.path)
+        if full or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            # execute() would step the pragma once, freeing a single page
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return {"bytes_before": before, "bytes_after": _database_bytes(db.path)}
+
+
+def start_retention(db):
+    """
+    Archive and compact periodically if FINGERPRINT_RETENTION_DAYS is set.
+
+    Runs RETENTION_DELAY seconds after startup and then every
+    FINGERPRINT_RETENTION_INTERVAL seconds (default one day), writing to
+    FINGERPRINT_ARCHIVE_DIR (default ARCHIVE_DIR next to the database).
+
+    Returns:
+        The stop event, or None when retention is not configured.
+    """
+    days = int(os.environ.get("FINGERPRINT_RETENTION_DAYS", "0"))
+    if days <= 0:
+        return None
+    directory = os.environ.get("FINGERPRINT_ARCHIVE_DIR")
+    interval = float(os.environ.get("FINGERPRINT_RETENTION_INTERVAL", RETENTION_INTERVAL))
+    stopped = threading.Event()
+
+    def run():
+        delay = min(interval, RETENTION_DELAY)
+        while not stopped.wait(delay):
+            delay = interval
+            try:
+                if archive_attendance(db, days, directory)["events"]:
+                    compact_database(db)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Attendance archiving failed: {e}")
+
+    threading.Thread(target=run, name="retention", daemon=True).start()
+    return stopped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old attendance events and compact the database.")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--days", type=int, required=True, help="keep events of the last DAYS days live")
+    parser.add_argument("--archive-dir", help=f"where to write monthly files (default: {ARCHIVE_DIR} next to the db)")
+    parser.add_argument("--vacuum", action="store_true", help="run a full VACUUM instead of an incremental one")
+    args = parser.parse_args(argv)
+    if args.days < 1:
+        parser.error("--days must be at least 1")
+
+    db = Database(args.db, pool_size=1)
+    try:
+        db.initialize()
+        stats = archive_attendance(db, args.days, args.archive_dir)
+        stats.update(compact_database(db, args.vacuum))
+    finally:
+        db.close()
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
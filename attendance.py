@@ -0,0 +1,463 @@
+"""
+Append-only attendance storage.
+
+Each successful verification is one row in attendance_events(prn, ts). ts uses
+the "%Y-%m-%d %H:%M:%S" format, which sorts lexicographically, so date-time
+range filters run as an indexed BETWEEN inside SQLite.
+
+Three rollups are kept up to date in the same transaction that appends the
+events, so reports never re-read raw scans:
+
+    attendance_daily       one row per student per day present, with scans and
+                           first-in/last-out timestamps
+    attendance_monthly     one row per student per month, with days present
+    attendance_day_totals  students present and scans per day
+
+attendance_daily is upserted from each batch of events; triggers on it
+maintain the other two. A semester summary reads whole months from
+attendance_monthly plus student-days only for partial months at its ends.
+
+Events older than the retention horizon move out of attendance_events into
+read-only monthly partition files (see archive.py), listed in
+attendance_archive. The range, count and page queries read the live table
+plus only the partitions whose events overlap the requested range. The
+rollups keep archived days, so summaries never open a partition.
+"""
+import calendar
+import heapq
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, timedelta
+from itertools import islice
+from urllib.request import pathname2url
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Join order, name column and ORDER BY keys for each sortable results column,
+# as one or more arms merged with UNION ALL. Every key ends in e.id, so sort
+# keys are unique and pages can resume after the last key seen (keyset
+# pagination) instead of using OFFSET. Timestamp order walks the ts index. PRN
+# and Name orders walk users in index order (CROSS JOIN pins the loop order)
+# and seek each user's events on (prn, ts). A page then costs at most one index
+# probe per user and never sorts the whole range. Events of PRNs that are not
+# enrolled are listed by a second arm walking attendance_unenrolled, with no
+# name (sorted first, as '', in Name order), so every order lists exactly the
+# events count_attendance_range() counts.
+SORT_PLANS = {
+    "Timestamp": (
+        ("attendance_events e LEFT JOIN users u ON u.prn = e.prn", "u.name", ("e.ts", "e.id")),
+    ),
+    "PRN": (
+        ("users u CROSS JOIN attendance_events e ON e.prn = u.prn", "u.name", ("u.prn", "e.ts", "e.id")),
+        ("attendance_unenrolled o CROSS JOIN attendance_events e ON e.prn = o.prn", "NULL", ("o.prn", "e.ts", "e.id")),
+    ),
+    "Name": (
+        (
+            "users u INDEXED BY idx_users_name CROSS JOIN attendance_events e ON e.prn = u.prn",
+            "u.name",
+            ("u.name", "u.prn", "e.ts", "e.id"),
+        ),
+        (
+            "attendance_unenrolled o CROSS JOIN attendance_events e ON e.prn = o.prn",
+            "NULL",
+            ("''", "o.prn", "e.ts", "e.id"),
+        ),
+    ),
+}
+
+
+ROLL_UP_DAY = (
+    "INSERT INTO attendance_daily (day, prn, scans, first_in, last_out) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (day, prn) DO UPDATE SET scans = scans + excluded.scans, "
+    "first_in = MIN(first_in, excluded.first_in), last_out = MAX(last_out, excluded.last_out)"
+)
+
+
+def create_attendance_schema(conn):
+    """Create the attendance tables and indexes if missing, backfilling a new rollup table."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_events (
+            id INTEGER PRIMARY KEY,
+            prn TEXT NOT NULL,
+            ts TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_events_ts ON attendance_events(ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_events_prn_ts ON attendance_events(prn, ts)")
+    # Archived partitions: path is relative to the database's directory unless absolute
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_archive (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            first_ts TEXT NOT NULL,
+            last_ts TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_daily'")
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            CREATE TABLE attendance_daily (
+                day TEXT NOT NULL,
+                prn TEXT NOT NULL,
+                scans INTEGER NOT NULL,
+                first_in TEXT NOT NULL,
+                last_out TEXT NOT NULL,
+                PRIMARY KEY (day, prn)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE attendance_monthly (
+                month TEXT NOT NULL,
+                prn TEXT NOT NULL,
+                days_present INTEGER NOT NULL,
+                scans INTEGER NOT NULL,
+                first_day TEXT NOT NULL,
+                last_day TEXT NOT NULL,
+                PRIMARY KEY (month, prn)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE attendance_day_totals (
+                day TEXT PRIMARY KEY,
+                students INTEGER NOT NULL,
+                scans INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        # Databases that already hold events get their rollups built once, here,
+        # before the triggers below exist
+        cursor.execute(
+            "INSERT INTO attendance_daily (day, prn, scans, first_in, last_out) "
+            "SELECT substr(ts, 1, 10), prn, COUNT(*), MIN(ts), MAX(ts) FROM attendance_events "
+            "GROUP BY substr(ts, 1, 10), prn"
+        )
+        cursor.execute(
+            "INSERT INTO attendance_monthly (month, prn, days_present, scans, first_day, last_day) "
+            "SELECT substr(day, 1, 7), prn, COUNT(*), SUM(scans), MIN(day), MAX(day) FROM attendance_daily "
+            "GROUP BY substr(day, 1, 7), prn"
+        )
+        cursor.execute(
+            "INSERT INTO attendance_day_totals (day, students, scans) "
+            "SELECT day, COUNT(*), SUM(scans) FROM attendance_daily GROUP BY day"
+        )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_daily_prn_day ON attendance_daily(prn, day)")
+
+    # PRNs with attendance but no users row (e.g. merged from another site
+    # before their enrollment), so the PRN and Name orders can list them
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_unenrolled'")
+    if cursor.fetchone() is None:
+        cursor.execute("CREATE TABLE attendance_unenrolled (prn TEXT PRIMARY KEY) WITHOUT ROWID")
+        cursor.execute(
+            "INSERT INTO attendance_unenrolled (prn) SELECT DISTINCT prn FROM attendance_daily "
+            "WHERE prn NOT IN (SELECT prn FROM users)"
+        )
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_unenrolled_event AFTER INSERT ON attendance_daily
+        WHEN NOT EXISTS (SELECT 1 FROM users WHERE prn = NEW.prn) BEGIN
+            INSERT OR IGNORE INTO attendance_unenrolled (prn) VALUES (NEW.prn);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_unenrolled_enroll AFTER INSERT ON users BEGIN
+            DELETE FROM attendance_unenrolled WHERE prn = NEW.prn;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_unenrolled_unenroll AFTER DELETE ON users
+        WHEN EXISTS (SELECT 1 FROM attendance_daily WHERE prn = OLD.prn) BEGIN
+            INSERT OR IGNORE INTO attendance_unenrolled (prn) VALUES (OLD.prn);
+        END
+    ''')
+
+    # A new student-day counts towards days present; a later scan that day only adds to scans
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_insert AFTER INSERT ON attendance_daily BEGIN
+            INSERT INTO attendance_monthly (month, prn, days_present, scans, first_day, last_day)
+            VALUES (substr(NEW.day, 1, 7), NEW.prn, 1, NEW.scans, NEW.day, NEW.day)
+            ON CONFLICT (month, prn) DO UPDATE SET
+                days_present = days_present + 1, scans = scans + excluded.scans,
+                first_day = MIN(first_day, excluded.first_day), last_day = MAX(last_day, excluded.last_day);
+            INSERT INTO attendance_day_totals (day, students, scans) VALUES (NEW.day, 1, NEW.scans)
+            ON CONFLICT (day) DO UPDATE SET students = students + 1, scans = scans + excluded.scans;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_update AFTER UPDATE OF scans ON attendance_daily BEGIN
+            UPDATE attendance_monthly SET scans = scans + NEW.scans - OLD.scans
+            WHERE month = substr(NEW.day, 1, 7) AND prn = NEW.prn;
+            UPDATE attendance_day_totals SET scans = scans + NEW.scans - OLD.scans WHERE day = NEW.day;
+        END
+    ''')
+
+
+def migrate_verification_timestamps(conn):
+    """
+    Move legacy users.verification_timestamps JSON arrays into attendance_events.
+
+    Migrated arrays are reset to '[]' in the same transaction, so running this
+    again is a no-op. A value that is not a JSON array of timestamp strings is
+    left as it is rather than cleared, so no history is thrown away.
+
+    Returns:
+        The number of events migrated.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT prn, verification_timestamps FROM users "
+        "WHERE verification_timestamps IS NOT NULL AND verification_timestamps != '[]'"
+    )
+    events = []
+    migrated = []
+    for prn, timestamps_json in cursor.fetchall():
+        try:
+            timestamps = json.loads(timestamps_json) if timestamps_json.strip() else []
+        except (ValueError, AttributeError):
+            continue
+        if not isinstance(timestamps, list) or not all(isinstance(ts, str) for ts in timestamps):
+            continue
+        events.extend((prn, ts) for ts in timestamps)
+        migrated.append((prn,))
+    with conn:
+        insert_attendance_events(conn, events)
+        conn.executemany("UPDATE users SET verification_timestamps = '[]' WHERE prn = ?", migrated)
+    return len(events)
+
+
+def insert_attendance_events(conn, events):
+    """Append (prn, ts) events and fold them into attendance_daily inside the caller's transaction."""
+    conn.executemany("INSERT INTO attendance_events (prn, ts) VALUES (?, ?)", events)
+    # Aggregate the batch first, so each student-day is one upsert however often they scanned
+    days = {}
+    for prn, ts in events:
+        key = (ts[:10], prn)
+        rollup = days.get(key)
+        if rollup is None:
+            days[key] = [1, ts, ts]
+        else:
+            rollup[0] += 1
+            rollup[1] = min(rollup[1], ts)
+            rollup[2] = max(rollup[2], ts)
+    conn.executemany(ROLL_UP_DAY, [(day, prn, scans, first, last) for (day, prn), (scans, first, last) in days.items()])
+
+
+def database_file(conn):
+    """Path of the connection's main database file."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return ""
+
+
+def archive_partitions(conn, start, end):
+    """(month, path, events, first_ts, last_ts) of the archived partitions with events in [start, end], oldest first."""
+    base = os.path.dirname(database_file(conn))
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT month, path, events, first_ts, last_ts FROM attendance_archive "
+        "WHERE first_ts <= ? AND last_ts >= ? ORDER BY month",
+        (end, start)
+    )
+    return [(month, os.path.join(base, path), events, first, last) for month, path, events, first, last in cursor]
+
+
+@contextmanager
+def open_partition(conn, path):
+    """
+    Read-only connection to an archived partition.
+
+    conn's database is attached to it, so queries joining users run unchanged
+    against the partition's attendance_events.
+    """
+    if not os.path.exists(path):
+        raise sqlite3.OperationalError(f"Attendance archive {path} is missing.")
+    partition = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        partition.execute("ATTACH DATABASE ? AS live", (database_file(conn),))
+        yield partition
+    finally:
+        partition.close()
+
+
+def fetch_last_check_ins(conn, since):
+    """(prn, latest ts) for every student with an event at or after `since`; recent events are never archived."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT prn, MAX(ts) FROM attendance_events WHERE ts >= ? GROUP BY prn", (since,))
+    return cursor.fetchall()
+
+
+RANGE_QUERY = (
+    "SELECT e.prn, u.name, e.ts FROM attendance_events e "
+    "LEFT JOIN users u ON u.prn = e.prn "
+    "WHERE e.ts BETWEEN ? AND ? ORDER BY e.ts"
+)
+
+
+def _iter_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _archived_range(conn, partitions, start, end, chunk_size):
+    # Partitions hold disjoint months, so reading them in order keeps timestamp order
+    for _, path, _, _, _ in partitions:
+        with open_partition(conn, path) as partition:
+            for rows in _iter_chunks(partition.execute(RANGE_QUERY, (start, end)), chunk_size):
+                yield from rows
+
+
+def iter_attendance_range(conn, start, end, chunk_size=5000):
+    """Yield lists of up to chunk_size (prn, name, ts) rows in timestamp order, live and archived."""
+    cursor = conn.cursor()
+    cursor.execute(RANGE_QUERY, (start, end))
+    partitions = archive_partitions(conn, start, end)
+    if not partitions:
+        yield from _iter_chunks(cursor, chunk_size)
+        return
+    # Events merged by sync after their month was archived are still live
+    live = (row for rows in _iter_chunks(cursor, chunk_size) for row in rows)
+    rows = heapq.merge(_archived_range(conn, partitions, start, end, chunk_size), live, key=lambda row: row[2])
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_attendance_range(conn, start, end):
+    """Return (prn, name, ts) rows with start <= ts <= end, ordered by timestamp."""
+    return [row for chunk in iter_attendance_range(conn, start, end) for row in chunk]
+
+
+def count_attendance_range(conn, start, end):
+    """
+    Number of events with start <= ts <= end, counted on the timestamp index.
+
+    A partition lying wholly inside the range is counted from attendance_archive
+    without being opened.
+    """
+    query = "SELECT COUNT(*) FROM attendance_events WHERE ts BETWEEN ? AND ?"
+    cursor = conn.cursor()
+    cursor.execute(query, (start, end))
+    total = cursor.fetchone()[0]
+    for _, path, events, first_ts, last_ts in archive_partitions(conn, start, end):
+        if start <= first_ts and last_ts <= end:
+            total += events
+        else:
+            with open_partition(conn, path) as partition:
+                total += partition.execute(query, (start, end)).fetchone()[0]
+    return total
+
+
+def fetch_attendance_page(conn, start, end, sort="Timestamp", descending=False, after=None, limit=200):
+    """
+    One page of (prn, name, ts) rows in a date-time range, sorted in SQLite.
+
+    Args:
+        sort: Column name from SORT_PLANS.
+        descending: Sort direction.
+        after: Sort key returned with the previous page, or None for the first page.
+        limit: Page size.
+
+    Returns:
+        (rows, last_key), where last_key is passed as `after` to get the next page.
+
+    Each archived partition overlapping the range is asked for its own page
+    with the same query, and the pages are merged.
+    """
+    arms = []
+    params = []
+    for tables, name, keys in SORT_PLANS[sort]:
+        key_list = ", ".join(keys)
+        arm = f"SELECT e.prn, {name}, e.ts, {key_list} FROM {tables} WHERE e.ts BETWEEN ? AND ?"
+        params.extend((start, end))
+        if after is not None:
+            arm += f" AND ({key_list}) {'<' if descending else '>'} ({', '.join('?' * len(keys))})"
+            params.extend(after)
+        arms.append(arm)
+    direction = " DESC" if descending else ""
+    # Result columns 4.. are the keys; each arm is walked in key order and merged
+    sql = " UNION ALL ".join(arms) + " ORDER BY " + ", ".join(
+        f"{column}{direction}" for column in range(4, 4 + len(keys))
+    ) + " LIMIT ?"
+    params.append(limit)
+
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    partitions = archive_partitions(conn, start, end)
+    if partitions:
+        for _, path, _, _, _ in partitions:
+            with open_partition(conn, path) as partition:
+                rows.extend(partition.execute(sql, params).fetchall())
+        # SQLite orders NULL names first
+        rows.sort(key=lambda row: tuple((value is not None, value) for value in row[3:]), reverse=descending)
+        del rows[limit:]
+    last_key = tuple(rows[-1][3:]) if rows else None
+    return [row[:3] for row in rows], last_key
+
+
+def _full_months(start_day, end_day):
+    """First and last "%Y-%m" month lying entirely within [start_day, end_day]."""
+    first = date.fromisoformat(start_day)
+    if first.day != 1:
+        first = (first.replace(day=1) + timedelta(days=32)).replace(day=1)
+    last = date.fromisoformat(end_day)
+    if last.day != calendar.monthrange(last.year, last.month)[1]:
+        last = last.replace(day=1) - timedelta(days=1)
+    return first.strftime("%Y-%m"), last.strftime("%Y-%m")
+
+
+def fetch_attendance_summary(conn, start_day, end_day):
+    """
+    Per-student totals over whole days, read from the rollups.
+
+    Args:
+        start_day: First day, "%Y-%m-%d".
+        end_day: Last day, inclusive.
+
+    Returns:
+        (prn, name, days_present, scans, first_day, last_day) rows ordered by PRN.
+    """
+    # Each side is grouped per student first, so the join and final merge see
+    # at most two rows per student
+    first_month, last_month = _full_months(start_day, end_day)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT r.prn, u.name, SUM(r.days), SUM(r.scans), MIN(r.first_day), MAX(r.last_day) FROM ( "
+        "SELECT prn, SUM(days_present) AS days, SUM(scans) AS scans, MIN(first_day) AS first_day, "
+        "MAX(last_day) AS last_day FROM attendance_monthly WHERE month BETWEEN ? AND ? GROUP BY prn "
+        "UNION ALL "
+        "SELECT prn, COUNT(*), SUM(scans), MIN(day), MAX(day) FROM attendance_daily "
+        "WHERE day BETWEEN ? AND ? AND substr(day, 1, 7) NOT BETWEEN ? AND ? GROUP BY prn "
+        ") r LEFT JOIN users u ON u.prn = r.prn GROUP BY r.prn ORDER BY r.prn",
+        (first_month, last_month, start_day, end_day, first_month, last_month)
+    )
+    return cursor.fetchall()
+
+
+def fetch_daily_totals(conn, start_day, end_day):
+    """(day, students_present, scans) for each day with any attendance, in date order."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT day, students, scans FROM attendance_day_totals WHERE day BETWEEN ? AND ? ORDER BY day",
+        (start_day, end_day)
+    )
+    return cursor.fetchall()
+
+
+def fetch_student_days(conn, prn, start_day, end_day):
+    """(day, scans, first_in, last_out) for each day a student was present, in date order."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT day, scans, first_in, last_out FROM attendance_daily "
+        "WHERE prn = ? AND day BETWEEN ? AND ? ORDER BY day",
+        (prn, start_day, end_day)
+    )
+    return cursor.fetchall()
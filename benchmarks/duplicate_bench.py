@@ -0,0 +1,80 @@
+"""
+Cost of the enrollment-time duplicate check at different gallery sizes.
+
+Usage: python benchmarks/duplicate_bench.py [gallery sizes...]
+
+For each size, a temporary database is filled through Database.insert_users
+and loaded into a TemplateGallery backed by the stand-in matcher. Two kinds of
+template are then checked with find_duplicate: new fingers (the usual case,
+no match) and re-captures of enrolled fingers (2% of bits flipped). The
+"table scan" rows show the old alternative for comparison: read every stored
+template from SQLite and compare them in table order.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_gallery, make_probe, make_template  # noqa: E402
+from db import Database  # noqa: E402
+from gallery import TemplateGallery  # noqa: E402
+from matcher import StandInMatcher, standin_score  # noqa: E402
+
+
+def table_scan(db, probe, threshold):
+    """Duplicate check by reading the users table, as a fresh full scan would."""
+    with db.pool.connection() as conn:
+        for prn, template in conn.execute("SELECT prn, fingerprint_data FROM users"):
+            if standin_score(probe, template) >= threshold:
+                return prn
+    return None
+
+
+def run(size, probes=50, scan_probes=5, seed=1):
+    rng = random.Random(seed)
+    enrolled = make_gallery(size)
+    new_fingers = [(None, make_template(rng)) for _ in range(probes)]
+    recaptures = [(prn, make_probe(template, rng)) for prn, template in rng.sample(enrolled, probes)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "bench.db"))
+        db.initialize()
+        for start in range(0, size, 5000):
+            db.insert_users([(prn, prn, template) for prn, template in enrolled[start:start + 5000]])
+        gallery = TemplateGallery(db.pool, StandInMatcher())
+        gallery.load()
+
+        for label, workload in (("new", new_fingers), ("re-capture", recaptures)):
+            for method in ("gallery", "table scan"):
+                checks = workload if method == "gallery" else workload[:scan_probes]
+                correct = 0
+                started = time.perf_counter()
+                for expected, probe in checks:
+                    if method == "gallery":
+                        duplicate = gallery.find_duplicate(probe)
+                        prn = duplicate.prn if duplicate is not None else None
+                    else:
+                        prn = table_scan(db, probe, gallery.matcher.threshold)
+                    correct += prn == expected
+                elapsed = (time.perf_counter() - started) / len(checks)
+                results[(label, method)] = (elapsed, correct / len(checks))
+        db.close()
+    return results
+
+
+def main(sizes):
+    print(f"{'gallery':>8} {'template':>11} {'method':>11} {'ms/check':>9} {'checks/s':>9} {'accuracy':>9}")
+    for size in sizes:
+        for (label, method), (elapsed, accuracy) in run(size).items():
+            print(
+                f"{size:>8} {label:>11} {method:>11} {elapsed * 1000:>9.1f} "
+                f"{1 / elapsed:>9.0f} {accuracy:>9.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
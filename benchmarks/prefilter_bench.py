@@ -0,0 +1,72 @@
+"""
+Average comparisons per identification with and without the candidate pre-filter.
+
+Usage: python benchmarks/prefilter_bench.py [gallery sizes...]
+
+For each gallery size, enrolled probes (2% of bits flipped) and non-enrolled
+probes are identified with the stand-in matcher, once in enrollment order and
+once in CandidateIndex order with popcount-band pruning.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_gallery, make_probe, make_template  # noqa: E402
+from fir import template_key  # noqa: E402
+from matcher import StandInMatcher, standin_score  # noqa: E402
+from prefilter import CandidateIndex  # noqa: E402
+
+
+def count_comparisons(matcher, probe, order):
+    """Comparisons the stand-in matcher makes before matching or exhausting `order`."""
+    comparisons = 0
+    for prn in order:
+        comparisons += 1
+        if standin_score(probe, matcher.templates[prn]) >= matcher.threshold:
+            return comparisons, prn
+    return comparisons, None
+
+
+def run(size, probes=50, seed=1):
+    gallery = make_gallery(size)
+    matcher = StandInMatcher()
+    matcher.load(gallery)
+    index = CandidateIndex()
+    for prn, template in gallery:
+        index.add(prn, template_key(template))
+
+    rng = random.Random(seed)
+    genuine = [(prn, make_probe(template, rng)) for prn, template in rng.sample(gallery, probes)]
+    impostors = [(None, make_template(rng)) for _ in range(probes)]
+    enrollment_order = [prn for prn, _ in gallery]
+
+    results = {}
+    for label, workload in (("genuine", genuine), ("impostor", impostors)):
+        for mode in ("table order", "pre-filtered"):
+            total, correct = 0, 0
+            started = time.perf_counter()
+            for expected, probe in workload:
+                if mode == "table order":
+                    order = enrollment_order
+                else:
+                    order = index.candidates(probe, matcher.max_bits_per_byte)
+                comparisons, prn = count_comparisons(matcher, probe, order)
+                total += comparisons
+                correct += prn == expected
+            elapsed = (time.perf_counter() - started) / len(workload)
+            results[(label, mode)] = (total / len(workload), correct / len(workload), elapsed)
+    return results
+
+
+def main(sizes):
+    print(f"{'gallery':>8} {'probe':>9} {'order':>13} {'avg cmp':>10} {'accuracy':>9} {'ms/id':>8}")
+    for size in sizes:
+        for (label, mode), (comparisons, accuracy, elapsed) in run(size).items():
+            print(f"{size:>8} {label:>9} {mode:>13} {comparisons:>10.1f} {accuracy:>9.0%} {elapsed * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,312 @@
+"""
+Headless end-to-end benchmark of enrollment, identification and attendance queries.
+
+Usage:
+    python benchmarks/suite.py [--sizes 1000 10000 100000] [--json results.json]
+                               [--baseline results.json] [--tolerance 0.25]
+
+For each gallery size, a synthetic fingerprint_data.db with years of
+attendance history is built once and cached under benchmarks/data/. Each run
+works on a copy of it. test.py's own scan and enrollment functions are driven
+with the deterministic LatencyMatcher, with capture replaced by synthetic
+probes. Every workload reports p50/p95/p99 latency. Memory is reported as
+the traced Python allocations of the loaded gallery and the process peak
+RSS, where the platform reports it.
+
+With --baseline, any p95 slower than the baseline by more than --tolerance is
+reported as a regression and the exit status is 1.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import HISTORY_END, LatencyMatcher, make_database, make_probe, make_template  # noqa: E402
+from archive import archive_attendance, compact_database  # noqa: E402
+from attendance import SORT_PLANS  # noqa: E402
+from capture import CapturePipeline, SimulatedCapture  # noqa: E402
+from db import Database  # noqa: E402
+from gallery import DuplicateFingerprint, TemplateGallery  # noqa: E402
+from service import KioskService  # noqa: E402
+from sync import DirectoryTransport, SiteSync  # noqa: E402
+import test as app  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(samples):
+    return {
+        "ops": len(samples),
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def timed(func, inputs):
+    """Call func once per input and return the per-call latencies in seconds."""
+    samples = []
+    for value in inputs:
+        started = time.perf_counter()
+        func(value)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def cached_database(size, days, daily_scans, seed):
+    """Path of the synthetic database for these parameters, building it on first use."""
+    path = os.path.join(DATA_DIR, f"users{size}_days{days}_daily{daily_scans}_seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Building {path}...", flush=True)
+        make_database(path + ".partial", size, days, daily_scans, seed)
+        os.replace(path + ".partial", path)
+    return path
+
+
+def run(size, args):
+    rng = random.Random(args.seed)
+    source = cached_database(size, args.days, args.daily_scans, args.seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fingerprint_data.db")
+        shutil.copyfile(source, path)
+        app.db = Database(path)
+        app.db.initialize()
+        app.matcher = LatencyMatcher(args.call_latency / 1000, args.comparison_latency / 1e6)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        app.gallery = TemplateGallery(app.db.pool, app.matcher)
+        app.gallery.load()
+        results["gallery_load"] = {"seconds": time.perf_counter() - started}
+        results["gallery_load"]["traced_mb"] = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+        tracemalloc.stop()
+        app.service = KioskService(app.db, app.matcher, app.gallery)
+
+        # The same load through a gallery file: first built from the database,
+        # then reused as is
+        gallery_dir = os.path.join(directory, "gallery")
+        for label in ("gallery_file_build", "gallery_file_load"):
+            started = time.perf_counter()
+            file_gallery = TemplateGallery(app.db.pool, LatencyMatcher(), gallery_dir)
+            file_gallery.load()
+            results[label] = {"seconds": time.perf_counter() - started}
+            results[label]["file_mb"] = os.path.getsize(file_gallery.file.path) / (1024 * 1024)
+            file_gallery.file.close()
+
+        enrolled = app.gallery.templates()
+        genuine = [make_probe(template, rng) for _, template in rng.sample(enrolled, min(args.ops, len(enrolled)))]
+        impostors = [make_template(rng) for _ in range(args.ops)]
+
+        # Scans go through test.py's scan path with the capture step fed from a list
+        # identify_repeat taps the genuine fingers again inside the debounce window
+        scans = (("identify_genuine", genuine), ("identify_repeat", genuine), ("identify_impostor", impostors))
+        for label, probes in scans:
+            feed = iter(probes)
+            app.capture_template = lambda: next(feed)
+            with redirect_stdout(io.StringIO()):
+                results[label] = summarize(timed(lambda _: app.identify_and_record(), probes))
+        app.db.attendance_writer.flush()
+
+        # A kiosk whose scans mostly come from a few dozen regulars, measured once
+        # the hot set has learned them; debounce is off so every tap is a match
+        regulars = rng.sample(enrolled, min(40, len(enrolled)))
+        kiosk = KioskService(app.db, app.matcher, app.gallery, debounce_window=0)
+        for _ in range(10):
+            for _, template in regulars:
+                kiosk.check_in(make_probe(template, rng), "bench")
+        regular_probes = [make_probe(template, rng) for _, template in rng.choices(regulars, k=args.ops)]
+        results["identify_regular"] = summarize(timed(lambda probe: kiosk.check_in(probe, "bench"), regular_probes))
+        results["identify_regular"]["hot_set_hit_rate"] = kiosk.hot_set.statistics()["hit_rate"]
+
+        # Top-5 candidate lists for genuine probes over the whole gallery,
+        # scoring every template or stopping at the first certain match
+        results["search_top5_full"] = summarize(
+            timed(lambda probe: app.matcher.search(probe, top_k=5, certain=math.inf), genuine)
+        )
+        results["search_top5_early_stop"] = summarize(timed(lambda probe: app.matcher.search(probe, top_k=5), genuine))
+
+        # Time per student for back-to-back scans on a simulated scanner: one
+        # at a time as Mark Attendance does, then pipelined so the next capture
+        # overlaps identification
+        capture_seconds = args.capture_latency / 1000
+        scanner = SimulatedCapture(genuine, capture_seconds)
+        results["scan_serial"] = summarize(timed(lambda _: kiosk.check_in(scanner.capture(), "bench"), genuine))
+        finished = []
+        pipeline = CapturePipeline(
+            SimulatedCapture(genuine, capture_seconds), lambda probe: kiosk.check_in(probe, "bench"),
+            on_result=lambda _: finished.append(time.perf_counter())
+        )
+        started = time.perf_counter()
+        pipeline.start().join()
+        results["scan_pipelined"] = summarize([end - start for start, end in zip([started] + finished, finished)])
+        app.db.attendance_writer.flush()
+
+        def enroll(template):
+            prn = f"NEW{rng.randrange(10 ** 9):09d}"
+            try:
+                app.save_to_database(prn, "Benchmark User", template)
+            except DuplicateFingerprint:
+                pass
+
+        results["enroll"] = summarize(timed(enroll, [make_template(rng) for _ in range(args.ops)]))
+
+        def random_range(days):
+            end = HISTORY_END - timedelta(days=rng.randrange(args.days - days + 1))
+            start = end - timedelta(days=days - 1)
+            return start.strftime("%Y-%m-%d 00:00:00"), end.strftime("%Y-%m-%d 23:59:59")
+
+        for label, days in (("day", 1), ("month", 30), ("year", 365)):
+            ranges = [random_range(days) for _ in range(args.ops)]
+            results[f"count_{label}"] = summarize(timed(lambda r: app.db.attendance_count(*r), ranges))
+            for sort in SORT_PLANS:
+                results[f"page_{label}_by_{sort.lower()}"] = summarize(
+                    timed(lambda r: app.db.attendance_page(*r, sort=sort, limit=app.RECORDS_PAGE_SIZE), ranges)
+                )
+            # Summary reports read the daily rollup rather than the raw events
+            day_spans = [(start[:10], end[:10]) for start, end in ranges]
+            results[f"summary_{label}"] = summarize(timed(lambda r: app.db.attendance_summary(*r), day_spans))
+            results[f"daily_totals_{label}"] = summarize(timed(lambda r: app.db.daily_totals(*r), day_spans))
+        day_ranges = [random_range(1) for _ in range(args.ops)]
+        results["range_day_full"] = summarize(timed(lambda r: app.db.attendance_range(*r), day_ranges))
+
+        # Multi-site sync: the first push ships the whole history, later ones
+        # only the events recorded since
+        site = SiteSync(app.db, DirectoryTransport(os.path.join(directory, "remote")), "bench")
+        started = time.perf_counter()
+        shipped = site.push()
+        results["sync_initial_push"] = {"seconds": time.perf_counter() - started, "mb": shipped["bytes"] / (1024 * 1024)}
+        prns = [prn for prn, _ in enrolled]
+
+        def push_after_scans(_):
+            for _ in range(10):
+                app.db.record_attendance(rng.choice(prns))
+            site.push()
+
+        results["sync_push_10_events"] = summarize(timed(push_after_scans, range(args.ops)))
+
+        app.db.close()
+
+        # Retention on a fresh copy: archive all but the last 90 days, then
+        # query ranges that span the monthly archive files
+        archived_db = Database(os.path.join(directory, "archived.db"))
+        shutil.copyfile(source, archived_db.path)
+        archived_db.initialize()
+        started = time.perf_counter()
+        moved = archive_attendance(archived_db, 90, os.path.join(directory, "archive"), HISTORY_END.date())
+        compacted = compact_database(archived_db)
+        results["archive_initial"] = {
+            "seconds": time.perf_counter() - started,
+            "events": moved["events"],
+            "live_mb": compacted["bytes_after"] / (1024 * 1024),
+            "before_mb": compacted["bytes_before"] / (1024 * 1024),
+        }
+        for label, days in (("month", 30), ("year", 365)):
+            ranges = [random_range(days) for _ in range(args.ops)]
+            results[f"count_{label}_archived"] = summarize(timed(lambda r: archived_db.attendance_count(*r), ranges))
+            results[f"page_{label}_archived"] = summarize(
+                timed(lambda r: archived_db.attendance_page(*r, limit=app.RECORDS_PAGE_SIZE), ranges)
+            )
+        archived_db.close()
+    results["process"] = {"peak_rss_mb": peak_rss_mb()}
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """p95 regressions against a baseline, as printable lines."""
+    regressions = []
+    for size, workloads in current.items():
+        for name, stats in workloads.items():
+            before = baseline.get(size, {}).get(name, {}).get("p95_ms")
+            if before and stats.get("p95_ms", 0) > before * (1 + tolerance):
+                regressions.append(
+                    f"REGRESSION {size} users, {name}: p95 {stats['p95_ms']:.2f} ms (baseline {before:.2f} ms)"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless throughput benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--days", type=int, default=730, help="days of attendance history (default: %(default)s)")
+    parser.add_argument("--daily-scans", type=int, default=1500, help="check-ins per day (default: %(default)s)")
+    parser.add_argument("--ops", type=int, default=100, help="operations per workload (default: %(default)s)")
+    parser.add_argument("--call-latency", type=float, default=0.0, help="matcher ms per identify call")
+    parser.add_argument("--comparison-latency", type=float, default=0.0, help="matcher microseconds per comparison")
+    parser.add_argument("--capture-latency", type=float, default=50.0,
+                        help="simulated scanner ms per capture (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run(size, args)
+        workloads = results[str(size)]
+        print(f"\n{size} users, {args.days} days of history")
+        print(f"  gallery load {workloads['gallery_load']['seconds']:.2f} s, "
+              f"{workloads['gallery_load']['traced_mb']:.1f} MB traced")
+        print(f"  gallery file build {workloads['gallery_file_build']['seconds']:.2f} s, "
+              f"reload {workloads['gallery_file_load']['seconds']:.2f} s, "
+              f"{workloads['gallery_file_load']['file_mb']:.1f} MB")
+        print(f"  initial sync push {workloads['sync_initial_push']['seconds']:.2f} s, "
+              f"{workloads['sync_initial_push']['mb']:.1f} MB")
+        archived = workloads["archive_initial"]
+        print(f"  archive all but 90 days {archived['seconds']:.2f} s, {archived['events']} events, "
+              f"live db {archived['before_mb']:.1f} -> {archived['live_mb']:.1f} MB")
+        print(f"  {'workload':<26} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, stats in workloads.items():
+            if "p50_ms" in stats:
+                print(f"  {name:<26} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    rss = results[str(args.sizes[-1])]["process"]["peak_rss_mb"]
+    if rss is not None:
+        print(f"\nPeak RSS {rss:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Deterministic synthetic FIR templates for benchmarks.
+
+Each template has a random payload length and one of seven bit densities,
+standing in for real captures with different minutiae counts. A probe is a
+copy of an enrolled template with a small fraction of its bits flipped, like a
+re-capture of the same finger.
+
+make_database() builds a complete fingerprint_data.db with users and a
+history of attendance events, and LatencyMatcher is a deterministic matcher
+with configurable per-call and per-comparison latency.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance import TIMESTAMP_FORMAT, insert_attendance_events  # noqa: E402
+from db import Database  # noqa: E402
+from fir import build_fir  # noqa: E402
+from matcher import StandInMatcher  # noqa: E402
+
+# Last day of synthetic attendance history, fixed so databases are reproducible
+HISTORY_END = datetime(2025, 6, 30)
+
+
+# Bit densities k/8 built from three independent uniform bit strings a, b, c
+DENSITIES = [
+    lambda a, b, c: a & b & c,
+    lambda a, b, c: a & b,
+    lambda a, b, c: a & (b | c),
+    lambda a, b, c: a,
+    lambda a, b, c: a | (b & c),
+    lambda a, b, c: a | b,
+    lambda a, b, c: a | b | c,
+]
+
+
+def make_template(rng, min_length=384, max_length=640):
+    """Random FIR with a per-template payload length and bit density."""
+    length = rng.randint(min_length, max_length)
+    a, b, c = (rng.getrandbits(8 * length) for _ in range(3))
+    bits = rng.choice(DENSITIES)(a, b, c)
+    return build_fir(bits.to_bytes(length, "little"))
+
+
+def make_gallery(size, seed=0):
+    """List of (prn, template) pairs with PRNs PRN0000000.. in enrollment order."""
+    rng = random.Random(seed)
+    return [(f"PRN{i:07d}", make_template(rng)) for i in range(size)]
+
+
+def make_probe(template, rng, flip_fraction=0.02):
+    """Copy of a template with flip_fraction of its payload bits inverted."""
+    header_size = len(build_fir(b""))
+    payload_bits = 8 * (len(template) - header_size)
+    value = int.from_bytes(template, "little")
+    for position in rng.sample(range(payload_bits), int(payload_bits * flip_fraction)):
+        value ^= 1 << (8 * header_size + position)
+    return value.to_bytes(len(template), "little")
+
+
+def make_database(path, size, days=730, daily_scans=1500, seed=0):
+    """
+    Create a fingerprint_data.db with `size` users and `days` days of attendance.
+
+    Each day has min(size, daily_scans) check-ins by distinct random users,
+    between 08:00 and 17:00, ending on HISTORY_END.
+
+    Returns:
+        The enrolled (prn, template) pairs, as make_gallery(size, seed).
+    """
+    gallery = make_gallery(size, seed)
+    db = Database(path)
+    try:
+        db.initialize()
+        for start in range(0, size, 5000):
+            db.insert_users([(prn, f"Student {prn[3:]}", template) for prn, template in gallery[start:start + 5000]])
+
+        rng = random.Random(seed + 1)
+        prns = [prn for prn, _ in gallery]
+        first_day = HISTORY_END - timedelta(days=days - 1)
+        for day in range(days):
+            date = first_day + timedelta(days=day)
+            events = [
+                (prn, (date + timedelta(seconds=rng.randrange(8 * 3600, 17 * 3600))).strftime(TIMESTAMP_FORMAT))
+                for prn in rng.sample(prns, min(size, daily_scans))
+            ]
+            with db.pool.transaction() as conn:
+                insert_attendance_events(conn, events)
+    finally:
+        db.close()
+    return gallery
+
+
+def _spin(seconds):
+    # time.sleep is far too coarse for microsecond latencies
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class LatencyMatcher(StandInMatcher):
+    """
+    Stand-in matcher that also spends fixed time per search() call and per comparison.
+
+    Results are exactly those of StandInMatcher, so runs are reproducible; the
+    latencies model a slower real matcher (pipe round trip, SDK comparisons).
+
+    Args:
+        call_latency: Seconds added to every search().
+        comparison_latency: Seconds added per template compared.
+    """
+
+    def __init__(self, call_latency=0.0, comparison_latency=0.0, threshold=0.9):
+        super().__init__(threshold)
+        self.call_latency = call_latency
+        self.comparison_latency = comparison_latency
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        matches = super().search(probe, candidates, top_k, threshold, certain)
+        _spin(self.call_latency + self.comparison_latency * self.last_comparisons)
+        return matches
@@ -0,0 +1,324 @@
+"""
+Fingerprint capture devices and a pipeline that overlaps capture with identification.
+
+A capture device returns one serialized FIR per capture():
+
+    OneShotCapture    legacy behaviour: one fingerprint_app.exe run per capture,
+                      which initializes the SDK and opens the device every time
+    WorkerCapture     `fingerprint_app.exe --serve`, started once, keeps the
+                      device open and captures on request over the matcher
+                      frame protocol (opcodes below, see test.cpp)
+    SimulatedCapture  emits templates from a Python source after a fixed
+                      acquisition delay, for tests and benchmarks without a
+                      scanner
+
+CapturePipeline runs a capture thread that streams templates into a bounded
+queue and an identification thread that drains it, so the scanner acquires
+person N+1 while person N is being matched. When the queue is full the capture
+thread waits, which bounds both memory and how stale a queued template gets.
+"""
+import os
+import queue
+import struct
+import subprocess
+import threading
+import time
+
+from matcher import OP_ERROR, OP_OK, OP_QUIT, MatcherError, read_frame, unpack_buffers, write_frame
+from metrics import REGISTRY, STAGE_SECONDS
+
+OP_CAPTURE = b"S"     # payload = optional u32 timeout in milliseconds
+OP_TEMPLATE = b"T"    # payload = serialized FIR
+OP_NO_FINGER = b"N"   # nothing was placed on the scanner within the timeout
+
+# Seconds the scanner waits for a finger per capture, and before a hung
+# one-shot capture program is killed
+FINGER_TIMEOUT = 5.0
+PROCESS_TIMEOUT = 30
+
+
+class CaptureError(Exception):
+    """Raised when the scanner or the capture program fails."""
+
+
+class CaptureClosed(Exception):
+    """Raised by capture() once the device is closed or a simulated source runs out."""
+
+
+class CaptureDevice:
+    """Interface shared by all capture devices."""
+
+    def capture(self, timeout=None):
+        """
+        Capture one fingerprint.
+
+        Args:
+            timeout: Seconds to wait for a finger; FINGER_TIMEOUT if None.
+
+        Returns:
+            The serialized FIR, or None if no finger was placed in time.
+
+        Raises:
+            CaptureError: If the scanner or capture program fails.
+            CaptureClosed: If the device has been closed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OneShotCapture(CaptureDevice):
+    """Runs the capture program once per capture; the program has its own fixed finger timeout."""
+
+    def __init__(self, command=("fingerprint_app.exe",), process_timeout=PROCESS_TIMEOUT):
+        self.command = list(command)
+        self.process_timeout = process_timeout
+
+    def capture(self, timeout=None):
+        result = subprocess.run(self.command, capture_output=True, timeout=self.process_timeout)
+        if result.returncode != 0:
+            raise CaptureError(f"Error occurred: {result.stderr.decode('utf-8', 'replace')}")
+        try:
+            buffers = unpack_buffers(result.stdout)
+        except MatcherError as e:
+            raise CaptureError(f"Malformed fingerprint data from the capture program: {e}") from None
+        if len(buffers) != 1 or not buffers[0]:
+            raise CaptureError("The capture program did not return a fingerprint.")
+        return buffers[0]
+
+
+class WorkerCapture(CaptureDevice):
+    """
+    Client for a long-lived capture program that keeps the scanner open.
+
+    The program is started on first use and restarted after it fails, so a
+    scanner that is unplugged and reconnected recovers on the next capture.
+    """
+
+    def __init__(self, command=("fingerprint_app.exe", "--serve")):
+        self.command = list(command)
+        self._lock = threading.Lock()
+        self._process = None
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # The program reports whether it could open the scanner before taking requests
+        reply, body = read_frame(self._process.stdout)
+        if reply != OP_OK:
+            self._process.wait()
+            self._process = None
+            raise CaptureError(body.decode("utf-8", "replace") if reply == OP_ERROR else "Capture program failed to start.")
+
+    def capture(self, timeout=None):
+        timeout = FINGER_TIMEOUT if timeout is None else timeout
+        with self._lock:
+            if self._closed:
+                raise CaptureClosed("The scanner is closed.")
+            try:
+                self._ensure_started()
+                write_frame(self._process.stdin, OP_CAPTURE, struct.pack("<I", int(timeout * 1000)))
+                reply, body = read_frame(self._process.stdout)
+            except (OSError, EOFError) as e:
+                if self._process is not None:
+                    self._process.kill()
+                    self._process = None
+                raise CaptureError(f"Capture program failed: {e}") from None
+        if reply == OP_TEMPLATE:
+            return body
+        if reply == OP_NO_FINGER:
+            return None
+        raise CaptureError(body.decode("utf-8", "replace") if reply == OP_ERROR else f"Unexpected reply {reply!r}.")
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            write_frame(process.stdin, OP_QUIT)
+            process.wait(timeout=FINGER_TIMEOUT + 1)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+
+
+class SimulatedCapture(CaptureDevice):
+    """
+    Scanner stand-in that returns templates from `source` after `acquisition_seconds`.
+
+    Args:
+        source: Iterable of templates, or a callable returning one per call.
+            A None item stands for a capture in which no finger was placed.
+        acquisition_seconds: Time each capture takes, modelling finger
+            placement and image acquisition.
+    """
+
+    def __init__(self, source, acquisition_seconds=0.0):
+        self._next = source if callable(source) else iter(source).__next__
+        self.acquisition_seconds = acquisition_seconds
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def capture(self, timeout=None):
+        with self._lock:
+            if self._closed.wait(self.acquisition_seconds):
+                raise CaptureClosed("The scanner is closed.")
+            try:
+                return self._next()
+            except StopIteration:
+                raise CaptureClosed("The simulated scanner has no more templates.") from None
+
+    def close(self):
+        self._closed.set()
+
+
+def create_capture_device(backend=None, source=None):
+    """
+    Build the capture device selected by `backend` or the FINGERPRINT_CAPTURE environment variable.
+
+    Args:
+        backend: "oneshot" (one fingerprint_app.exe run per scan, the
+            default), "worker" (`fingerprint_app.exe --serve`, keeping the
+            scanner open) or "simulated", which needs `source` and takes
+            FINGERPRINT_CAPTURE_SECONDS (default 0.5) per capture.
+        source: Templates for the simulated device; see SimulatedCapture.
+    """
+    backend = backend or os.environ.get("FINGERPRINT_CAPTURE", "oneshot")
+    if backend == "oneshot":
+        return OneShotCapture()
+    if backend == "worker":
+        return WorkerCapture()
+    if backend == "simulated":
+        if source is None:
+            raise ValueError("The simulated capture device needs a template source.")
+        return SimulatedCapture(source, float(os.environ.get("FINGERPRINT_CAPTURE_SECONDS", "0.5")))
+    raise ValueError(f"Unknown capture backend: {backend}")
+
+
+_STOP = object()
+
+
+class CapturePipeline:
+    """
+    Continuous scanning: capture on one thread, identify on another.
+
+    Args:
+        device: CaptureDevice to read from.
+        identify: Called with each template on the identification thread,
+            e.g. KioskService.check_in; its return value goes to on_result.
+        on_result: Called with each identification result.
+        on_error: Called with exceptions from capture or identification.
+            Capture errors are retried after `retry_delay` seconds.
+        depth: Captured templates allowed to wait for identification.
+    """
+
+    def __init__(self, device, identify, on_result=None, on_error=None, depth=2, retry_delay=1.0):
+        self.device = device
+        self.identify = identify
+        self.on_result = on_result
+        self.on_error = on_error
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.stats = {"captured": 0, "no_finger": 0, "capture_errors": 0, "identified": 0, "identify_errors": 0}
+
+    def start(self):
+        if self._threads:
+            raise RuntimeError("The pipeline is already running.")
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="capture-worker", daemon=True),
+            threading.Thread(target=self._identify_loop, name="identify-worker", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _report(self, callback, value):
+        if callback is not None:
+            callback(value)
+
+    def _put(self, item):
+        # Wait for room without missing a stop; queued templates are still identified
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if self._stopped.is_set() and item is not _STOP:
+                    return False
+
+    def _capture_loop(self):
+        try:
+            while not self._stopped.is_set():
+                try:
+                    with REGISTRY.timer(STAGE_SECONDS, stage="capture"):
+                        template = self.device.capture()
+                except CaptureClosed:
+                    break
+                except Exception as e:
+                    self._count("capture_errors")
+                    self._report(self.on_error, e)
+                    self._stopped.wait(self.retry_delay)
+                    continue
+                if template is None:
+                    self._count("no_finger")
+                    continue
+                self._count("captured")
+                if not self._put((template, time.perf_counter())):
+                    break
+        finally:
+            self._put(_STOP)
+
+    def _identify_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            template, captured = item
+            REGISTRY.observe(STAGE_SECONDS, time.perf_counter() - captured, stage="capture_queue")
+            try:
+                result = self.identify(template)
+            except Exception as e:
+                self._count("identify_errors")
+                self._report(self.on_error, e)
+                continue
+            self._count("identified")
+            self._report(self.on_result, result)
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        """Stop capturing; templates already captured are still identified."""
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        """Wait for both threads to finish after stop() or the end of the device's input."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not self.running
+
+    def statistics(self):
+        """Capture and identification counts and the number of templates waiting."""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
@@ -0,0 +1,342 @@
+"""
+Data access layer for fingerprint_data.db.
+
+All database access goes through one Database object. It holds a thread-safe
+pool of long-lived connections. Each connection runs in WAL mode, so readers
+never block the writer, and keeps its own prepared-statement cache. High
+frequency writes (attendance events) are buffered and committed in batches.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from attendance import (
+    TIMESTAMP_FORMAT, count_attendance_range, create_attendance_schema,
+    fetch_attendance_page, fetch_attendance_range, fetch_attendance_summary,
+    fetch_daily_totals, fetch_last_check_ins, fetch_student_days,
+    insert_attendance_events, migrate_verification_timestamps,
+)
+from fir import template_key
+from hotset import create_hot_set_schema
+from metrics import BATCH_WRITE_FAILURES, DB_QUERY_SECONDS, REGISTRY
+from sync import create_sync_schema
+
+DB_PATH = "fingerprint_data.db"
+
+logger = logging.getLogger(__name__)
+
+# Applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",   # durable at checkpoints; safe with WAL
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",    # 16 MB page cache per connection
+)
+
+INSERT_USER = (
+    "INSERT INTO users (prn, name, fingerprint_file, fingerprint_data, isadmin, template_version, template_key) "
+    "VALUES (?, ?, ?, ?, 0, (SELECT COALESCE(MAX(template_version), 0) + 1 FROM users), ?)"
+)
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared between threads.
+
+    Args:
+        path: Database file.
+        size: Maximum number of open connections.
+        timeout: Seconds to wait for a free connection before raising
+            sqlite3.OperationalError.
+    """
+
+    def __init__(self, path=DB_PATH, size=4, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection.") from None
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; any open transaction is rolled back if the block raises."""
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit when the block exits cleanly."""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class BatchWriter:
+    """
+    Buffers rows and commits them in one transaction per batch.
+
+    A batch is flushed when it reaches batch_size rows, every flush_interval
+    seconds from a background thread, and on flush()/close(). A batch whose
+    commit fails is put back in front of the buffer and retried on the next
+    tick, so rows are never dropped.
+
+    Args:
+        pool: ConnectionPool to write through.
+        write_batch: Callable (conn, rows) that writes a batch without committing.
+    """
+
+    def __init__(self, pool, write_batch, batch_size=100, flush_interval=0.5):
+        self.pool = pool
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._failing = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        with self._lock:
+            self._rows.append(row)
+            # While commits are failing, only the background thread retries
+            full = len(self._rows) >= self.batch_size and not self._failing
+        if full:
+            self._flush_or_keep()
+
+    def flush(self):
+        """
+        Commit everything buffered so far.
+
+        Raises:
+            sqlite3.Error: If the commit fails; the rows stay buffered.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                with REGISTRY.timer(DB_QUERY_SECONDS, query="batch_write"), self.pool.transaction() as conn:
+                    self.write_batch(conn, rows)
+            except BaseException:
+                with self._lock:
+                    self._rows[:0] = rows
+                    self._failing = True
+                raise
+            with self._lock:
+                self._failing = False
+
+    def _flush_or_keep(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            REGISTRY.inc(BATCH_WRITE_FAILURES)
+            logger.warning("Batch write failed, %d rows kept for a retry: %s", self.pending(), e)
+
+    def pending(self):
+        """Number of rows buffered and not yet committed."""
+        with self._lock:
+            return len(self._rows)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._flush_or_keep()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+
+class Database:
+    """
+    Users, templates and attendance storage for one database file.
+
+    Args:
+        path: Database file.
+        pool_size: Maximum number of pooled connections.
+    """
+
+    def __init__(self, path=DB_PATH, pool_size=4):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self.attendance_writer = BatchWriter(self.pool, insert_attendance_events)
+
+    def initialize(self):
+        """Create or upgrade the schema and run one-shot data migrations."""
+        with self.pool.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    prn TEXT PRIMARY KEY,
+                    name TEXT,
+                    fingerprint_file TEXT,
+                    fingerprint_data BLOB,
+                    verification_timestamps TEXT DEFAULT '[]',
+                    isadmin INTEGER,
+                    template_version INTEGER DEFAULT 0,
+                    template_key TEXT
+                )
+            ''')
+            # Older databases predate these columns; template_version drives incremental
+            # gallery refresh and template_key the candidate pre-filter
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)")]
+            if "template_version" not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN template_version INTEGER DEFAULT 0")
+            if "template_key" not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN template_key TEXT")
+            cursor.execute(
+                "SELECT prn, fingerprint_data FROM users WHERE template_key IS NULL AND fingerprint_data IS NOT NULL"
+            )
+            cursor.executemany(
+                "UPDATE users SET template_key = ? WHERE prn = ?",
+                [(template_key(data), prn) for prn, data in cursor.fetchall()]
+            )
+            # Older enrollments all point at the same reused capture file; templates
+            # live only in fingerprint_data
+            cursor.execute("UPDATE users SET fingerprint_file = NULL WHERE fingerprint_file = 'fingerprint.fir'")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_template_version ON users(template_version)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name, prn)")
+            create_attendance_schema(conn)
+            create_hot_set_schema(conn)
+            create_sync_schema(conn)
+        with self.pool.connection() as conn:
+            # One-shot move of legacy JSON timestamp arrays into attendance_events
+            migrate_verification_timestamps(conn)
+
+    def insert_user(self, prn, name, fingerprint_file, fingerprint_data):
+        """Enroll a user; returns False if the PRN already exists."""
+        try:
+            with REGISTRY.timer(DB_QUERY_SECONDS, query="insert_user"), self.pool.transaction() as conn:
+                conn.execute(
+                    INSERT_USER,
+                    (prn.upper(), name, fingerprint_file, fingerprint_data, template_key(fingerprint_data))
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def insert_users(self, users):
+        """
+        Enroll many (prn, name, fingerprint_data) rows in one transaction.
+
+        PRNs that are already enrolled are skipped rather than failing the batch.
+
+        Returns:
+            The set of skipped PRNs.
+        """
+        users = [(prn.upper(), name, data) for prn, name, data in users]
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="insert_users"), self.pool.transaction() as conn:
+            # Take the write lock up front so the existence check and the inserts agree
+            conn.execute("BEGIN IMMEDIATE")
+            existing = set()
+            for start in range(0, len(users), 500):
+                prns = [prn for prn, _, _ in users[start:start + 500]]
+                cursor = conn.execute(f"SELECT prn FROM users WHERE prn IN ({', '.join('?' * len(prns))})", prns)
+                existing.update(row[0] for row in cursor)
+            conn.executemany(
+                INSERT_USER,
+                [(prn, name, None, data, template_key(data)) for prn, name, data in users if prn not in existing]
+            )
+        return existing
+
+    def record_attendance(self, prn, timestamp=None):
+        """Queue one attendance event for the next batch commit and return its timestamp."""
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        self.attendance_writer.write((prn, timestamp))
+        return timestamp
+
+    def last_check_ins(self, since):
+        """(prn, latest ts) for students recorded at or after `since`, including unflushed events."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="last_check_ins"), self.pool.connection() as conn:
+            return fetch_last_check_ins(conn, since)
+
+    def attendance_range(self, start, end):
+        """(prn, name, ts) rows with start <= ts <= end, including events not yet flushed."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="attendance_range"), self.pool.connection() as conn:
+            return fetch_attendance_range(conn, start, end)
+
+    def attendance_count(self, start, end):
+        """Number of attendance events in a range, including events not yet flushed."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="attendance_count"), self.pool.connection() as conn:
+            return count_attendance_range(conn, start, end)
+
+    def attendance_page(self, start, end, sort="Timestamp", descending=False, after=None, limit=200):
+        """One sorted page of a range, including events not yet flushed; see attendance.fetch_attendance_page."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="attendance_page"), self.pool.connection() as conn:
+            return fetch_attendance_page(conn, start, end, sort, descending, after, limit)
+
+    def attendance_summary(self, start_day, end_day):
+        """Per-student totals from the daily rollup; see attendance.fetch_attendance_summary."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="attendance_summary"), self.pool.connection() as conn:
+            return fetch_attendance_summary(conn, start_day, end_day)
+
+    def daily_totals(self, start_day, end_day):
+        """(day, students_present, scans) rows from the daily rollup."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="daily_totals"), self.pool.connection() as conn:
+            return fetch_daily_totals(conn, start_day, end_day)
+
+    def student_days(self, prn, start_day, end_day):
+        """(day, scans, first_in, last_out) rows for one student from the daily rollup."""
+        self.attendance_writer.flush()
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="student_days"), self.pool.connection() as conn:
+            return fetch_student_days(conn, prn, start_day, end_day)
+
+    def close(self):
+        self.attendance_writer.close()
+        self.pool.close()
@@ -0,0 +1,195 @@
+"""
+Bulk enrollment from pre-captured FIR files and a roster CSV.
+
+    python enroll.py roster.csv --templates captures/ [--report problems.csv]
+
+The roster needs a header row with "prn" and "name" columns. An optional
+"file" column names each template, relative to --templates; without it
+"<prn>.fir" is used. Templates are read and validated on a thread pool, and
+valid rows are inserted in large transactions. Each template is also
+identified 1:N against the in-memory gallery, which includes rows accepted
+earlier in the same import. A finger already enrolled under another PRN is
+reported as a duplicate and skipped. Duplicates and errors do not stop the
+import. They are collected and printed as one summary at the end.
+
+A running kiosk picks the new users up at its next scan (see
+TemplateGallery.refresh).
+"""
+import argparse
+import csv
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DB_PATH, Database
+from fir import parse_fir_header
+from gallery import TemplateGallery
+from matcher import create_matcher
+
+RosterEntry = namedtuple("RosterEntry", "line prn name path")
+Problem = namedtuple("Problem", "line prn status detail")
+
+DUPLICATE = "duplicate"
+ERROR = "error"
+
+
+class ImportSummary:
+    """Outcome of a bulk import: counts plus one Problem per rejected roster row."""
+
+    def __init__(self):
+        self.enrolled = 0
+        self.problems = []
+
+    def add(self, line, prn, status, detail):
+        self.problems.append(Problem(line, prn, status, detail))
+
+    def count(self, status):
+        return sum(1 for problem in self.problems if problem.status == status)
+
+    def __str__(self):
+        lines = [
+            f"Enrolled {self.enrolled}, duplicates {self.count(DUPLICATE)}, errors {self.count(ERROR)}."
+        ]
+        for problem in sorted(self.problems):
+            lines.append(f"  line {problem.line}: {problem.prn or '-'}: {problem.status}: {problem.detail}")
+        return "\n".join(lines)
+
+
+def read_roster(roster_path, template_dir, summary):
+    """
+    Parse the roster CSV into RosterEntry rows.
+
+    Rows without a PRN or name are recorded in `summary` as errors. Later rows
+    that repeat a PRN are recorded as duplicates.
+    """
+    entries = []
+    seen = {}
+    with open(roster_path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.DictReader(file)
+        fields = {field.strip().lower(): field for field in reader.fieldnames or []}
+        if "prn" not in fields or "name" not in fields:
+            raise ValueError("The roster must have 'prn' and 'name' columns.")
+        for row in reader:
+            line = reader.line_num
+            prn = (row[fields["prn"]] or "").strip().upper()
+            name = (row[fields["name"]] or "").strip()
+            if not prn or not name:
+                summary.add(line, prn, ERROR, "missing PRN or name")
+                continue
+            if prn in seen:
+                summary.add(line, prn, DUPLICATE, f"PRN repeated from line {seen[prn]}")
+                continue
+            seen[prn] = line
+            file_name = (row[fields["file"]] or "").strip() if "file" in fields else ""
+            entries.append(RosterEntry(line, prn, name, os.path.join(template_dir, file_name or f"{prn}.fir")))
+    return entries
+
+
+def load_template(entry):
+    """Read and validate one roster entry's template; returns (entry, template, error)."""
+    try:
+        with open(entry.path, "rb") as file:
+            template = file.read()
+    except OSError as e:
+        return entry, None, f"cannot read {entry.path}: {e.strerror or e}"
+    header = parse_fir_header(template)
+    if header is None:
+        return entry, None, f"{entry.path} is not a valid FIR template"
+    if header.data_length == 0:
+        return entry, None, f"{entry.path} has no template data"
+    return entry, template, None
+
+
+def import_roster(db, entries, summary, workers=8, batch_size=1000, progress=None, gallery=None):
+    """
+    Validate and enroll roster entries in batches.
+
+    Args:
+        db: db.Database to enroll into.
+        entries: RosterEntry rows from read_roster().
+        summary: ImportSummary that collects the outcome.
+        workers: Threads used to read and validate templates.
+        batch_size: Rows per insert transaction.
+        progress: Optional callable (rows_done, total_rows), called after each batch.
+        gallery: Loaded gallery.TemplateGallery used to reject fingers that are
+            already enrolled, or None to skip the check.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(entries), batch_size):
+            valid = []
+            staged = set()
+            for entry, template, error in executor.map(load_template, entries[start:start + batch_size]):
+                if error is not None:
+                    summary.add(entry.line, entry.prn, ERROR, error)
+                    continue
+                # Known PRNs are left for insert_users to report
+                if gallery is not None and entry.prn not in gallery:
+                    duplicate = gallery.find_duplicate(template)
+                    if duplicate is not None:
+                        summary.add(entry.line, entry.prn, DUPLICATE, f"fingerprint already enrolled as {duplicate.prn}")
+                        continue
+                    gallery.stage(entry.prn, entry.name, template)
+                    staged.add(entry.prn)
+                valid.append((entry, template))
+
+            skipped = db.insert_users([(entry.prn, entry.name, template) for entry, template in valid])
+            for entry, _ in valid:
+                if entry.prn in skipped:
+                    summary.add(entry.line, entry.prn, DUPLICATE, "PRN already enrolled")
+            summary.enrolled += len(valid) - len(skipped)
+            if gallery is not None:
+                for prn in skipped & staged:
+                    gallery.discard(prn)
+                gallery.refresh()
+            if progress is not None:
+                progress(min(start + batch_size, len(entries)), len(entries))
+    return summary
+
+
+def write_report(path, summary):
+    """Write the summary's problems to a CSV file."""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(Problem._fields)
+        writer.writerows(sorted(summary.problems))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enroll users in bulk from a roster CSV and FIR files.")
+    parser.add_argument("roster", help="CSV with prn, name and optional file columns")
+    parser.add_argument("--templates", default=".", help="directory holding the FIR files (default: current)")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8, help="validation threads (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per transaction (default: %(default)s)")
+    parser.add_argument("--report", help="also write duplicates and errors to this CSV file")
+    parser.add_argument("--matcher", help="matcher backend for the duplicate check (default: FINGERPRINT_MATCHER)")
+    parser.add_argument("--no-duplicate-check", action="store_true", help="skip the 1:N fingerprint duplicate check")
+    args = parser.parse_args(argv)
+
+    summary = ImportSummary()
+    entries = read_roster(args.roster, args.templates, summary)
+    db = Database(args.db, pool_size=1)
+    gallery = None
+    try:
+        db.initialize()
+        if not args.no_duplicate_check:
+            gallery = TemplateGallery(db.pool, create_matcher(args.matcher))
+            gallery.load()
+        import_roster(
+            db, entries, summary, args.workers, args.batch_size,
+            progress=lambda done, total: print(f"Processed {done}/{total} roster rows", flush=True),
+            gallery=gallery
+        )
+    finally:
+        if gallery is not None:
+            gallery.matcher.close()
+        db.close()
+
+    print(summary)
+    if args.report:
+        write_report(args.report, summary)
+    return 0 if not summary.problems else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
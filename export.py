@@ -0,0 +1,99 @@
+"""
+Streaming attendance export.
+
+Rows are read from a SQLite cursor in fixed-size chunks and written straight
+to the output file, so memory use does not depend on the size of the export.
+Output ending in .gz (or compress=True) is gzip-compressed. The file is
+written under a temporary name and renamed when complete, so a cancelled or
+failed export never leaves a partial file behind.
+
+Headless use, e.g. from a nightly scheduled task:
+
+    python export.py --out attendance.csv.gz                  (yesterday)
+    python export.py --start "2025-01-01 00:00:00" --end "2025-06-30 23:59:59" --out h1.csv
+"""
+import argparse
+import csv
+import gzip
+import io
+import os
+from datetime import datetime, timedelta
+
+from attendance import TIMESTAMP_FORMAT, count_attendance_range, iter_attendance_range
+from db import DB_PATH, Database
+
+CSV_HEADER = ["PRN", "Name", "Timestamp"]
+
+
+class ExportCancelled(Exception):
+    """Raised when an export is cancelled through its cancel event."""
+
+
+def export_attendance(db, start, end, path, compress=None, chunk_size=5000, progress=None, cancel_event=None):
+    """
+    Write attendance events in [start, end] to a CSV file, streaming from SQLite.
+
+    Args:
+        db: db.Database to read from.
+        path: Output file; compressed with gzip when it ends in .gz unless
+            `compress` says otherwise.
+        progress: Optional callable (rows_written, total_rows), called after each chunk.
+        cancel_event: Optional threading.Event; when set the export stops and
+            ExportCancelled is raised.
+
+    Returns:
+        The number of rows written.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    db.attendance_writer.flush()
+    temp_path = path + ".partial"
+    written = 0
+    try:
+        with db.pool.connection() as conn:
+            total = count_attendance_range(conn, start, end)
+            if compress:
+                raw = gzip.open(temp_path, "wb")
+                file = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+            else:
+                file = open(temp_path, "w", encoding="utf-8", newline="")
+            with file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_HEADER)
+                for chunk in iter_attendance_range(conn, start, end, chunk_size):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ExportCancelled("Export cancelled.")
+                    writer.writerows(chunk)
+                    written += len(chunk)
+                    if progress is not None:
+                        progress(written, total)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return written
+
+
+def main(argv=None):
+    yesterday = datetime.now().date() - timedelta(days=1)
+    parser = argparse.ArgumentParser(description="Export attendance records to CSV.")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--start", default=f"{yesterday} 00:00:00", help="start date-time (default: yesterday)")
+    parser.add_argument("--end", default=f"{yesterday} 23:59:59", help="end date-time (default: end of yesterday)")
+    parser.add_argument("--out", required=True, help="output file; .gz is compressed")
+    parser.add_argument("--gzip", action="store_true", help="compress regardless of the file name")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    start = datetime.strptime(args.start, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    end = datetime.strptime(args.end, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    db = Database(args.db, pool_size=1)
+    try:
+        written = export_attendance(db, start, end, args.out, args.gzip or None, args.chunk_size)
+    finally:
+        db.close()
+    print(f"Exported {written} records to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
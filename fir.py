@@ -0,0 +1,63 @@
+"""
+Helpers for serialized FIR templates as written by fingerprint_app.exe.
+
+Layout (little-endian): NBioAPI_FIR_FORMAT Format (u32), then NBioAPI_FIR_HEADER
+(Length u32, DataLength u32, Version u16, DataType u16, Purpose u16,
+Quality u16, Reserved u32), then DataLength bytes of template data.
+"""
+import struct
+from collections import namedtuple
+
+FIR_PREFIX = struct.Struct("<IIIHHHHI")
+
+FirHeader = namedtuple("FirHeader", "format length data_length version data_type purpose quality")
+
+
+def popcount(value):
+    """Number of set bits in a non-negative int."""
+    return bin(value).count("1")
+
+
+# int.bit_count (Python 3.10+) is an order of magnitude faster on template-sized ints
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count  # noqa: F811
+
+
+def parse_fir_header(template):
+    """Return the FirHeader of a serialized FIR, or None if it is not one."""
+    if len(template) < FIR_PREFIX.size:
+        return None
+    fmt, length, data_length, version, data_type, purpose, quality, _ = FIR_PREFIX.unpack_from(template)
+    if length < FIR_PREFIX.size - 4 or 4 + length + data_length > len(template):
+        return None
+    return FirHeader(fmt, length, data_length, version, data_type, purpose, quality)
+
+
+def build_fir(data, fmt=1, version=1, data_type=0, purpose=1, quality=100):
+    """Serialize raw template data with a FIR header (used for synthetic templates)."""
+    return FIR_PREFIX.pack(fmt, FIR_PREFIX.size - 4, len(data), version, data_type, purpose, quality, 0) + data
+
+
+def template_key(template):
+    """
+    Pre-filter key stored next to each template in users.template_key.
+
+    The key is "format.version.data_type:size:quality:popcount". The first
+    field groups templates the matcher can compare directly. size is the whole
+    template in bytes. popcount, the number of set bits in the template, is a
+    coarse feature: similar templates have similar popcounts.
+    """
+    header = parse_fir_header(template)
+    bits = popcount(int.from_bytes(template, "little"))
+    if header is None:
+        return f"raw:{len(template)}:0:{bits}"
+    return (
+        f"{header.format}.{header.version}.{header.data_type}:"
+        f"{len(template)}:{header.quality}:{bits}"
+    )
+
+
+def split_template_key(key):
+    """Inverse of template_key: (compat_group, size, quality, popcount)."""
+    group, size, quality, popcount = key.rsplit(":", 3)
+    return group, int(size), int(quality), int(popcount)
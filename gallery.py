@@ -0,0 +1,204 @@
+"""
+In-memory cache of enrolled templates, kept in step with the users table.
+
+The gallery is loaded once at startup and then refreshed incrementally: every
+enrollment bumps users.template_version, so refresh() only reads rows whose
+version is newer than the last one seen. A CandidateIndex built from each
+row's template_key orders identification candidates.
+
+The same gallery backs duplicate-enrollment checks: a new template is
+identified against the cached templates before it is stored, so the check
+never reads the users table.
+
+With a gallery_dir, load() first brings a gallery file (see gallery_file.py)
+up to date, reading only templates changed since it was built, and hands the
+matcher its path instead of every template.
+"""
+import threading
+from collections import namedtuple
+
+from fir import template_key
+from gallery_file import sync_gallery_file
+from metrics import DB_QUERY_SECONDS, REGISTRY
+from prefilter import CandidateIndex
+
+GalleryEntry = namedtuple("GalleryEntry", "prn name template isadmin version key")
+
+
+class DuplicateFingerprint(Exception):
+    """Raised when a template being enrolled matches an already enrolled user."""
+
+    def __init__(self, entry):
+        super().__init__(f"This fingerprint is already enrolled for {entry.name} (PRN: {entry.prn}).")
+        self.entry = entry
+
+
+class TemplateGallery:
+    """
+    Enrolled templates keyed by PRN, optionally mirrored into a matcher.
+
+    Args:
+        pool: db.ConnectionPool for the database holding the users table.
+        matcher: Optional matcher.Matcher kept in sync with the gallery.
+        gallery_dir: Optional directory for the gallery file loaded by the matcher.
+    """
+
+    def __init__(self, pool, matcher=None, gallery_dir=None):
+        self.pool = pool
+        self.matcher = matcher
+        self.gallery_dir = gallery_dir
+        self.file = None
+        self.entries = {}
+        self.index = CandidateIndex()
+        self.version = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "full_loads": 0,
+            "refreshes": 0,
+            "rows_refreshed": 0,
+        }
+
+    def _fetch(self, min_version):
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="gallery_fetch"), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT prn, name, fingerprint_data, isadmin, template_version, template_key FROM users "
+                "WHERE fingerprint_data IS NOT NULL AND template_version > ? "
+                "ORDER BY template_version",
+                (min_version,)
+            )
+            rows = [GalleryEntry(*row) for row in cursor.fetchall()]
+        # Rows enrolled before template_key existed get their key computed here
+        return [entry if entry.key else entry._replace(key=template_key(entry.template)) for entry in rows]
+
+    def _load_from_file(self):
+        gallery_file = sync_gallery_file(self.pool, self.gallery_dir, self.file)
+        if self.file is not None and gallery_file is not self.file:
+            self.file.close()
+        self.file = gallery_file
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="gallery_fetch"), self.pool.connection() as conn:
+            # Rows enrolled after the file was built are left to the next refresh()
+            cursor = conn.execute(
+                "SELECT prn, name, isadmin, template_version, template_key FROM users "
+                "WHERE fingerprint_data IS NOT NULL AND template_version <= ? ORDER BY template_version",
+                (gallery_file.version,)
+            )
+            metadata = cursor.fetchall()
+        records = gallery_file.index()
+        rows = []
+        for prn, name, isadmin, version, key in metadata:
+            template = gallery_file.template(records[prn])
+            rows.append(GalleryEntry(prn, name, template, isadmin, version, key or template_key(template)))
+        return rows
+
+    def load(self):
+        """Load every enrolled template, replacing whatever is cached."""
+        rows = self._fetch(-1) if self.gallery_dir is None else self._load_from_file()
+        with self._lock:
+            self.entries = {entry.prn: entry for entry in rows}
+            self.index = CandidateIndex()
+            for entry in rows:
+                self.index.add(entry.prn, entry.key)
+            self.version = max((entry.version for entry in rows), default=0)
+            self.stats["full_loads"] += 1
+            if self.matcher is not None and self.file is not None:
+                self.matcher.load_file(self.file.path)
+            elif self.matcher is not None:
+                self.matcher.load([(entry.prn, entry.template) for entry in rows])
+        return len(rows)
+
+    def refresh(self):
+        """Pull only the rows enrolled or re-enrolled since the last load/refresh."""
+        rows = self._fetch(self.version)
+        with self._lock:
+            self.stats["refreshes"] += 1
+            self.stats["rows_refreshed"] += len(rows)
+            for entry in rows:
+                self.entries[entry.prn] = entry
+                self.index.add(entry.prn, entry.key)
+                self.version = max(self.version, entry.version)
+                if self.matcher is not None:
+                    self.matcher.add(entry.prn, entry.template)
+        return len(rows)
+
+    def get(self, prn):
+        """Return the cached GalleryEntry for a PRN, or None."""
+        with self._lock:
+            entry = self.entries.get(prn)
+            self.stats["hits" if entry is not None else "misses"] += 1
+            return entry
+
+    def stage(self, prn, name, template):
+        """
+        Cache a template whose row is not committed yet.
+
+        Bulk enrollment stages each accepted template so later rows in the same
+        batch are checked against it. The next refresh() replaces the staged
+        entry with the stored row; discard() drops it if the insert is skipped.
+        """
+        entry = GalleryEntry(prn, name, bytes(template), 0, 0, template_key(template))
+        with self._lock:
+            self.entries[prn] = entry
+            self.index.add(prn, entry.key)
+            if self.matcher is not None:
+                self.matcher.add(prn, entry.template)
+
+    def discard(self, prn):
+        """Drop a PRN from the cache and the matcher."""
+        with self._lock:
+            self.entries.pop(prn, None)
+            self.index.remove(prn)
+            if self.matcher is not None:
+                self.matcher.remove(prn)
+
+    def find_duplicate(self, template):
+        """
+        Return the GalleryEntry of an enrolled user whose template matches, or None.
+
+        This is a single 1:N identification against the cached gallery over
+        pre-filtered candidates. Call refresh() first to include enrollments
+        made by other processes.
+        """
+        prn = self.matcher.identify(template, self.candidates(template))
+        with self._lock:
+            return self.entries.get(prn) if prn is not None else None
+
+    def candidates(self, probe):
+        """
+        PRNs to try for a probe, most likely first.
+
+        Templates the matcher proves cannot match (see Matcher.max_bits_per_byte)
+        are left out.
+        """
+        max_bits_per_byte = self.matcher.max_bits_per_byte if self.matcher is not None else None
+        return list(self.index.candidates(probe, max_bits_per_byte))
+
+    def templates(self):
+        """Snapshot of (prn, template) pairs in enrollment order."""
+        with self._lock:
+            return [(entry.prn, entry.template) for entry in self.entries.values()]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, prn):
+        return prn in self.entries
+
+    def memory_bytes(self):
+        """Approximate memory held by cached templates and their keys."""
+        with self._lock:
+            return sum(
+                len(entry.template) + len(entry.prn) + len(entry.name or "")
+                for entry in self.entries.values()
+            )
+
+    def statistics(self):
+        """Counters plus current size, version and memory estimate."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["templates"] = len(self.entries)
+            stats["version"] = self.version
+        stats["memory_bytes"] = self.memory_bytes()
+        return stats
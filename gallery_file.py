@@ -0,0 +1,295 @@
+"""
+Compact, memory-mappable gallery file built from the users table.
+
+SQLite stays the source of truth. The gallery file is a read-only snapshot
+that matcher workers map instead of each receiving and holding a copy of
+every template. Several processes mapping the same file share one copy in
+the OS page cache.
+
+Layout (little-endian, format version 1):
+
+    file header     magic "FPGL", format u16, reserved u16, record count u32,
+                    FIR header count u32, PRN area size u32,
+                    gallery version u64 (highest users.template_version),
+                    reserved u32
+    FIR headers     Format u32, Length u32, Version u16, DataType u16,
+                    Purpose u16, Quality u16, Reserved u32 per distinct header
+    records         PRN offset u32, PRN length u16, FIR header index u16,
+                    data offset u64, data length u32 per template, in
+                    enrollment order
+    PRN area        UTF-8 PRNs, back to back
+    payloads        template data from the 8-byte aligned offset after the PRNs
+
+FIR headers repeat across a gallery, as only DataLength differs between
+templates from one scanner, so each distinct header is stored once and
+records keep just the data. The SDK's NBioAPI_FIR points at its data
+separately from its header, so matcher_server.exe can compare straight from
+the mapping. Templates that are not well-formed FIRs are stored whole with
+header index RAW.
+
+Files are named gallery-<version>.fpg and replaced, never rewritten in place,
+because Windows will not replace a file that another process has mapped.
+"""
+import glob
+import mmap
+import os
+import struct
+
+from fir import FIR_PREFIX
+from metrics import DB_QUERY_SECONDS, REGISTRY
+
+MAGIC = b"FPGL"
+FORMAT_VERSION = 1
+RAW = 0xFFFF
+
+FILE_HEADER = struct.Struct("<4sHHIIIQI")
+FIR_HEADER = struct.Struct("<IIHHHHI")
+RECORD = struct.Struct("<IHHQI")
+
+
+class GalleryFileError(Exception):
+    """Raised when a gallery file is truncated, corrupt or of an unknown format."""
+
+
+def split_template(template):
+    """
+    Split a serialized FIR into its header fields and data.
+
+    Returns:
+        (header, data), where header is the FIR_HEADER field tuple, or None
+        (with data the whole template) when the template is not a plain FIR.
+    """
+    if len(template) >= FIR_PREFIX.size:
+        fmt, length, data_length, version, data_type, purpose, quality, reserved = FIR_PREFIX.unpack_from(template)
+        if length == FIR_PREFIX.size - 4 and FIR_PREFIX.size + data_length == len(template):
+            return (fmt, length, version, data_type, purpose, quality, reserved), memoryview(template)[FIR_PREFIX.size:]
+    return None, memoryview(template)
+
+
+def _write_records(path, records, version):
+    # records: (prn, header tuple or None, data buffer); written through a
+    # temporary file so readers never see a partial gallery
+    headers = {}
+    prn_area = []
+    prn_size = 0
+    for prn, header, _ in records:
+        if header is not None and header not in headers:
+            if len(headers) >= RAW:
+                raise GalleryFileError("Too many distinct FIR headers.")
+            headers[header] = len(headers)
+        prn_area.append(prn.encode("utf-8"))
+        prn_size += len(prn_area[-1])
+
+    offset = FILE_HEADER.size + FIR_HEADER.size * len(headers) + RECORD.size * len(records) + prn_size
+    offset = (offset + 7) & ~7
+    table = []
+    prn_offset = 0
+    for (prn, header, data), prn_bytes in zip(records, prn_area):
+        table.append(RECORD.pack(
+            prn_offset, len(prn_bytes), RAW if header is None else headers[header], offset, len(data)
+        ))
+        prn_offset += len(prn_bytes)
+        offset += len(data)
+
+    temp_path = path + ".partial"
+    with open(temp_path, "wb") as file:
+        file.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(records), len(headers), prn_size, version, 0))
+        for header in headers:
+            file.write(FIR_HEADER.pack(*header))
+        file.writelines(table)
+        file.writelines(prn_area)
+        file.write(b"\0" * (-file.tell() % 8))
+        for _, _, data in records:
+            file.write(data)
+    os.replace(temp_path, path)
+
+
+def write_gallery_file(path, entries, version):
+    """Write (prn, template) pairs as a gallery file for the given gallery version."""
+    _write_records(path, [(prn, *split_template(template)) for prn, template in entries], version)
+
+
+class GalleryFile:
+    """
+    Read-only, memory-mapped view of a gallery file.
+
+    Records are decoded on access, so opening a file costs the same whatever
+    its size. data() returns zero-copy views into the mapping; release them
+    before close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise GalleryFileError(f"{path} is empty.") from None
+        self._view = memoryview(self._map)
+        self._index = None
+        try:
+            self._parse_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse_header(self):
+        if len(self._map) < FILE_HEADER.size:
+            raise GalleryFileError(f"{self.path} is truncated.")
+        magic, fmt, _, self.count, header_count, prn_size, self.version, _ = FILE_HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise GalleryFileError(f"{self.path} is not a gallery file.")
+        if fmt != FORMAT_VERSION:
+            raise GalleryFileError(f"{self.path} has unsupported format version {fmt}.")
+        self.headers = [
+            FIR_HEADER.unpack_from(self._map, FILE_HEADER.size + i * FIR_HEADER.size) for i in range(header_count)
+        ]
+        self._records = FILE_HEADER.size + header_count * FIR_HEADER.size
+        self._prns = self._records + self.count * RECORD.size
+        end = self._prns + prn_size
+        if end > len(self._map):
+            raise GalleryFileError(f"{self.path} is truncated.")
+        if self.count:
+            _, _, _, data_offset, data_length = self._record(self.count - 1)
+            if data_offset + data_length > len(self._map):
+                raise GalleryFileError(f"{self.path} is truncated.")
+
+    def _record(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return RECORD.unpack_from(self._map, self._records + i * RECORD.size)
+
+    def __len__(self):
+        return self.count
+
+    def prn(self, i):
+        prn_offset, prn_length, _, _, _ = self._record(i)
+        start = self._prns + prn_offset
+        return self._map[start:start + prn_length].decode("utf-8")
+
+    def prns(self):
+        """Every PRN in record order."""
+        return [self.prn(i) for i in range(self.count)]
+
+    def index(self):
+        """Dict of PRN -> record number, built on first use."""
+        if self._index is None:
+            self._index = {prn: i for i, prn in enumerate(self.prns())}
+        return self._index
+
+    def header(self, i):
+        """FIR_HEADER field tuple of record i, or None for a raw template."""
+        header_index = self._record(i)[2]
+        return None if header_index == RAW else self.headers[header_index]
+
+    def data(self, i):
+        """Zero-copy view of the stored data of record i (the whole template for raw records)."""
+        _, _, _, data_offset, data_length = self._record(i)
+        return self._view[data_offset:data_offset + data_length]
+
+    def template(self, i):
+        """Serialized FIR of record i, as bytes."""
+        _, _, header_index, data_offset, data_length = self._record(i)
+        data = self._map[data_offset:data_offset + data_length]
+        if header_index == RAW:
+            return data
+        fmt, length, version, data_type, purpose, quality, reserved = self.headers[header_index]
+        return FIR_PREFIX.pack(fmt, length, data_length, version, data_type, purpose, quality, reserved) + data
+
+    def entries(self):
+        """Yield (prn, template) pairs in record order."""
+        for i in range(self.count):
+            yield self.prn(i), self.template(i)
+
+    def close(self):
+        if self._map is not None:
+            self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def gallery_file_path(directory, version):
+    return os.path.join(directory, f"gallery-{version}.fpg")
+
+
+def sync_gallery_file(pool, directory, current=None):
+    """
+    Bring the gallery file in `directory` up to date with the users table.
+
+    Only templates enrolled or re-enrolled since `current` was built are read
+    from SQLite; the rest are copied from the mapped `current` file. Files
+    from older versions are deleted where no other process still maps them.
+
+    Args:
+        pool: db.ConnectionPool for the database holding the users table.
+        directory: Directory holding gallery-<version>.fpg files.
+        current: The GalleryFile in use, or None to pick up the newest file
+            in the directory. It is left open; the caller closes it once it
+            has switched to the returned file.
+
+    Returns:
+        An open GalleryFile, which is `current` itself when nothing changed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    opened = None
+    if current is None:
+        existing = sorted(
+            glob.glob(os.path.join(directory, "gallery-*.fpg")), key=os.path.getmtime, reverse=True
+        )
+        for path in existing:
+            try:
+                opened = current = GalleryFile(path)
+                break
+            except (OSError, GalleryFileError):
+                continue
+
+    with REGISTRY.timer(DB_QUERY_SECONDS, query="gallery_file_sync"), pool.connection() as conn:
+        rows = conn.execute(
+            "SELECT prn, template_version FROM users WHERE fingerprint_data IS NOT NULL ORDER BY template_version"
+        ).fetchall()
+        version = max((row[1] for row in rows), default=0)
+        if current is not None and current.version == version and len(current) == len(rows):
+            return current
+        since = current.version if current is not None else -1
+        changed = dict(conn.execute(
+            "SELECT prn, fingerprint_data FROM users WHERE fingerprint_data IS NOT NULL AND template_version > ?",
+            (since,)
+        ))
+        known = current.index() if current is not None else {}
+        # Rows the current file should hold but does not, e.g. a file built from another database
+        missing = [prn for prn, _ in rows if prn not in changed and prn not in known]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            changed.update(conn.execute(
+                f"SELECT prn, fingerprint_data FROM users WHERE prn IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+
+    records = []
+    for prn, _ in rows:
+        if prn in changed:
+            records.append((prn, *split_template(changed[prn])))
+        else:
+            i = known[prn]
+            records.append((prn, current.header(i), current.data(i)))
+    path = gallery_file_path(directory, version)
+    if current is not None and os.path.abspath(current.path) == os.path.abspath(path):
+        # Same version, fewer rows (a user was deleted); a new name keeps the mapped file intact
+        path = gallery_file_path(directory, f"{version}-{len(rows)}")
+    _write_records(path, records, version)
+    del records
+    if opened is not None:
+        opened.close()
+
+    for old_path in glob.glob(os.path.join(directory, "gallery-*.fpg")):
+        if os.path.abspath(old_path) not in (os.path.abspath(path), os.path.abspath(getattr(current, "path", ""))):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass  # Still mapped by a worker; removed by a later sync
+    return GalleryFile(path)
@@ -0,0 +1,168 @@
+"""
+Adaptive identification order from past matches, per kiosk and time of day.
+
+Most scans at a kiosk come from the same students at roughly the same time
+each day. The hot set keeps a decayed match frequency per PRN (recent matches
+weigh more, half of a score fades every half_life_days) in two tables per
+terminal: one for the current time-of-day slot and one for the whole day.
+Identification tries the slot's highest scorers first, then the terminal's,
+then everyone else, so a regular attendee matches in a few comparisons. Only
+the top `prefix` PRNs are moved ahead of the pre-filtered order, which bounds
+the extra comparisons paid by a student who is not hot.
+
+Each table holds at most `capacity` PRNs; the lowest current score is evicted
+to make room. Tables are persisted in the hot_set table and saved every
+save_interval seconds and on close, so the order survives restarts.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metrics import DB_QUERY_SECONDS, HOT_SET_LOOKUPS, REGISTRY
+
+ALL_DAY = -1
+
+
+def create_hot_set_schema(conn):
+    """Create the hot_set table if missing."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS hot_set (
+            terminal TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            prn TEXT NOT NULL,
+            score REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            PRIMARY KEY (terminal, slot, prn)
+        ) WITHOUT ROWID
+    ''')
+
+
+class HotSet:
+    """
+    Recency- and frequency-weighted candidate order per (terminal, slot).
+
+    Args:
+        pool: db.ConnectionPool for the database holding the hot_set table.
+        capacity: Maximum PRNs kept per terminal and slot.
+        slot_minutes: Length of a time-of-day slot.
+        half_life_days: Days after which a match counts half as much.
+        save_interval: Minimum seconds between saves triggered by record().
+        prefix: Maximum PRNs ranked() returns.
+    """
+
+    def __init__(self, pool, capacity=256, slot_minutes=60, half_life_days=14.0, save_interval=300.0, prefix=64):
+        self.pool = pool
+        self.capacity = capacity
+        self.prefix = prefix
+        self.slot_minutes = slot_minutes
+        self.half_life = half_life_days * 86400
+        self.save_interval = save_interval
+        self.tables = {}  # (terminal, slot) -> {prn: [score, last_seen]}
+        self._dirty = set()
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0}
+
+    def _keys(self, terminal, when):
+        when = when or datetime.now()
+        terminal = terminal or ""
+        return (terminal, (when.hour * 60 + when.minute) // self.slot_minutes), (terminal, ALL_DAY)
+
+    def _score(self, entry, now):
+        score, last_seen = entry
+        return score * 0.5 ** ((now - last_seen) / self.half_life)
+
+    def load(self):
+        """Replace the in-memory tables with the persisted ones."""
+        with REGISTRY.timer(DB_QUERY_SECONDS, query="hot_set_load"), self.pool.connection() as conn:
+            rows = conn.execute("SELECT terminal, slot, prn, score, last_seen FROM hot_set").fetchall()
+        with self._lock:
+            self.tables = {}
+            for terminal, slot, prn, score, last_seen in rows:
+                self.tables.setdefault((terminal, slot), {})[prn] = [score, last_seen]
+            self._dirty.clear()
+        return len(rows)
+
+    def ranked(self, terminal=None, when=None):
+        """Up to `prefix` PRNs to try first at this terminal and time: the slot's best, then the whole day's."""
+        with self._lock:
+            return self._ranked(self._keys(terminal, when), time.time())
+
+    def _ranked(self, keys, now):
+        # Caller holds self._lock
+        ordered = []
+        seen = set()
+        for key in keys:
+            table = self.tables.get(key, {})
+            for prn in sorted(table, key=lambda prn: self._score(table[prn], now), reverse=True):
+                if len(ordered) >= self.prefix:
+                    return ordered
+                if prn not in seen:
+                    seen.add(prn)
+                    ordered.append(prn)
+        return ordered
+
+    def record(self, prn, terminal=None, when=None):
+        """
+        Count a match at this terminal and time, evicting the coldest PRN if a table is full.
+
+        The match is a hit if ranked() would have put the PRN ahead of the rest
+        of the gallery, judged before this match is counted. A PRN that is in a
+        table but below the first `prefix` is a miss.
+        """
+        now = time.time()
+        with self._lock:
+            keys = self._keys(terminal, when)
+            hit = prn in self._ranked(keys, now)
+            self.stats["lookups"] += 1
+            self.stats["hits" if hit else "misses"] += 1
+            for key in keys:
+                table = self.tables.setdefault(key, {})
+                entry = table.get(prn)
+                if entry is None:
+                    if len(table) >= self.capacity:
+                        del table[min(table, key=lambda other: self._score(table[other], now))]
+                    table[prn] = [1.0, now]
+                else:
+                    entry[:] = [self._score(entry, now) + 1.0, now]
+                self._dirty.add(key)
+            due = time.monotonic() - self._last_save >= self.save_interval
+        REGISTRY.inc(HOT_SET_LOOKUPS, result="hit" if hit else "miss")
+        if due:
+            try:
+                self.save()
+            except sqlite3.Error as e:
+                print(f"Saving the hot set failed: {e}")
+
+    def save(self):
+        """Write the tables changed since the last save."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._last_save = time.monotonic()
+            rows = [
+                (terminal, slot, prn, score, last_seen)
+                for terminal, slot in dirty
+                for prn, (score, last_seen) in self.tables.get((terminal, slot), {}).items()
+            ]
+        if not dirty:
+            return
+        try:
+            with REGISTRY.timer(DB_QUERY_SECONDS, query="hot_set_save"), self.pool.transaction() as conn:
+                conn.executemany("DELETE FROM hot_set WHERE terminal = ? AND slot = ?", list(dirty))
+                conn.executemany(
+                    "INSERT INTO hot_set (terminal, slot, prn, score, last_seen) VALUES (?, ?, ?, ?, ?)", rows
+                )
+        except sqlite3.Error:
+            # Keep the tables dirty so the next save retries them
+            with self._lock:
+                self._dirty |= dirty
+            raise
+
+    def statistics(self):
+        """Lookup, hit and miss counts, the hit rate and the number of PRNs held."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = sum(len(table) for table in self.tables.values())
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
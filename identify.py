@@ -0,0 +1,221 @@
+"""
+Parallel 1:N identification.
+
+The candidate list is split into strided shards (shard i gets candidates i,
+i + n, i + 2n, ...), so every shard walks the list in its original priority
+order. Each shard runs on a thread or process pool and keeps the matches at
+or above the accept threshold. In "first" mode the first shard to find a
+score at or above the certain threshold raises a shared cancel flag and the
+other shards stop at their next comparison; marginal matches do not stop the
+scan. In "best" mode every shard runs to completion. Either way the shards'
+matches are merged into the top K, highest score first.
+
+With a process pool, a gallery loaded through load_file() is not shipped to
+the workers: shards carry record numbers, and each worker process maps the
+gallery file once and reads templates straight from it.
+"""
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from gallery_file import GalleryFile
+from matcher import CERTAIN_THRESHOLD, DEFAULT_THRESHOLD, Match, Matcher, best_matches, select_templates, standin_score
+
+MODE_FIRST = "first"
+MODE_BEST = "best"
+
+Identification = namedtuple("Identification", "prn score comparisons matches")
+
+# Cancel flag installed in each pool process by _init_process_worker
+_process_cancel_event = None
+
+# Gallery file mapped by this pool process, see _gallery_template
+_gallery_file = None
+
+
+def _init_process_worker(cancel_event):
+    global _process_cancel_event
+    _process_cancel_event = cancel_event
+
+
+def _gallery_template(path, record):
+    """Template `record` of the gallery file at `path`, mapping it on first use in this process."""
+    global _gallery_file
+    if _gallery_file is None or _gallery_file.path != path:
+        if _gallery_file is not None:
+            _gallery_file.close()
+        _gallery_file = GalleryFile(path)
+    return _gallery_file.template(record)
+
+
+def _scan_shard(scorer, probe, shard, threshold, certain, top_k, cancel_event=None, gallery_path=None):
+    """
+    Score one shard; returns ([Match, ...], comparisons) with its top_k matches.
+
+    A score at or above `certain` cancels every shard; None scans the whole
+    shard. Shard templates given as ints are record numbers in the gallery
+    file at gallery_path.
+    """
+    cancel_event = cancel_event or _process_cancel_event
+    matches, comparisons = [], 0
+    for prn, template in shard:
+        if cancel_event.is_set():
+            break
+        if isinstance(template, int):
+            template = _gallery_template(gallery_path, template)
+        score = scorer(probe, template)
+        comparisons += 1
+        if score >= threshold:
+            matches.append(Match(prn, score))
+            if certain is not None and score >= certain:
+                cancel_event.set()
+                break
+    return best_matches(matches, top_k), comparisons
+
+
+class IdentificationEngine:
+    """
+    Shards a candidate list across a worker pool and scores it against a probe.
+
+    Args:
+        scorer: Callable (probe, template) -> similarity in [0, 1]. It must be
+            picklable (a module-level function or simple object) when
+            use_processes is set.
+        threshold: Minimum score accepted as a match.
+        workers: Pool size, defaulting to the CPU count.
+        mode: MODE_FIRST to stop at the first certain match, MODE_BEST to
+            score every candidate.
+        use_processes: Use a process pool instead of threads, for scorers that
+            hold the GIL.
+        certain_threshold: Score that stops a MODE_FIRST scan.
+    """
+
+    def __init__(self, scorer, threshold=DEFAULT_THRESHOLD, workers=None, mode=MODE_FIRST, use_processes=False,
+                 certain_threshold=CERTAIN_THRESHOLD):
+        if mode not in (MODE_FIRST, MODE_BEST):
+            raise ValueError(f"Unknown identification mode: {mode}")
+        self.scorer = scorer
+        self.threshold = threshold
+        self.certain_threshold = certain_threshold
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.use_processes = use_processes
+        self._lock = threading.Lock()
+        if use_processes:
+            context = multiprocessing.get_context("spawn")
+            self._process_cancel = context.Event()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_process_worker,
+                initargs=(self._process_cancel,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def identify(self, probe, candidates, gallery_path=None, top_k=1, threshold=None, certain=None):
+        """
+        Match a probe against (prn, template) candidates, in priority order.
+
+        With gallery_path, a template may instead be its record number in that
+        gallery file. threshold and certain default to the engine's; certain is
+        ignored in MODE_BEST.
+
+        Returns:
+            An Identification with the best match and the top_k matches; its
+            prn is None when nothing cleared the threshold.
+        """
+        candidates = list(candidates)
+        shard_count = max(1, min(self.workers, len(candidates)))
+        shards = [candidates[i::shard_count] for i in range(shard_count)]
+        threshold = self.threshold if threshold is None else threshold
+        if self.mode == MODE_FIRST:
+            certain = self.certain_threshold if certain is None else certain
+        else:
+            certain = None
+
+        # The process pool shares one cancel flag, so identifications run one at a time
+        with self._lock:
+            if self.use_processes:
+                self._process_cancel.clear()
+                futures = [
+                    self._executor.submit(
+                        _scan_shard, self.scorer, probe, shard, threshold, certain, top_k, None, gallery_path
+                    )
+                    for shard in shards
+                ]
+            else:
+                cancel_event = threading.Event()
+                futures = [
+                    self._executor.submit(
+                        _scan_shard, self.scorer, probe, shard, threshold, certain, top_k, cancel_event,
+                        gallery_path
+                    )
+                    for shard in shards
+                ]
+            results = [future.result() for future in futures]
+
+        matches = best_matches((match for shard_matches, _ in results for match in shard_matches), top_k)
+        comparisons = sum(comparisons for _, comparisons in results)
+        if not matches:
+            return Identification(None, 0.0, comparisons, [])
+        return Identification(matches[0].prn, matches[0].score, comparisons, matches)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ParallelMatcher(Matcher):
+    """Matcher that keeps the gallery in-process and identifies through an IdentificationEngine."""
+
+    def __init__(self, scorer, threshold=DEFAULT_THRESHOLD, workers=None, mode=MODE_FIRST, use_processes=False,
+                 certain_threshold=CERTAIN_THRESHOLD):
+        self.engine = IdentificationEngine(scorer, threshold, workers, mode, use_processes, certain_threshold)
+        self.templates = {}
+        self.gallery_path = None
+        self.last_result = None
+
+    def load(self, entries):
+        self.templates = {prn: bytes(template) for prn, template in entries}
+        self.gallery_path = None
+
+    def load_file(self, path):
+        if not self.engine.use_processes:
+            super().load_file(path)
+            return
+        # Keep record numbers only; the pool processes map the file themselves
+        with GalleryFile(path) as gallery_file:
+            self.templates = dict(zip(gallery_file.prns(), range(len(gallery_file))))
+        self.gallery_path = os.path.abspath(path)
+
+    def add(self, prn, template):
+        self.templates[prn] = bytes(template)
+
+    def remove(self, prn):
+        self.templates.pop(prn, None)
+
+    @property
+    def max_bits_per_byte(self):
+        if self.engine.scorer is standin_score:
+            return (1.0 - self.engine.threshold) * 8
+        return None
+
+    @property
+    def threshold(self):
+        return self.engine.threshold
+
+    @property
+    def certain_threshold(self):
+        return self.engine.certain_threshold
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        self.last_result = self.engine.identify(
+            probe, select_templates(self.templates, candidates), self.gallery_path, top_k, threshold, certain
+        )
+        self.last_comparisons = self.last_result.comparisons
+        return self.last_result.matches
+
+    def close(self):
+        self.engine.close()
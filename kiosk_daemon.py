@@ -0,0 +1,502 @@
+"""
+Headless kiosk daemon: one warm gallery and database behind a local HTTP/JSON API.
+
+    python kiosk_daemon.py [--host 127.0.0.1] [--port 8765] [--db fingerprint_data.db] [--matcher standin]
+
+Thin front-ends on several terminals post captured templates here instead of
+each running their own matcher and database. Endpoints:
+
+    POST /identify            body: raw FIR bytes, or JSON {"template": base64}
+                              ?record=0 skips the attendance write; the
+                              X-Terminal-Id header names the calling kiosk.
+                              "repeat": true marks a match inside the
+                              debounce window, which writes nothing.
+                              "score" is the matcher's score; with
+                              record=0, &top_k=N also lists up to N
+                              "candidates", best first
+    POST /enroll              JSON {"prn", "name", "template": base64}
+    GET  /attendance          ?start=&end=&sort=Timestamp|PRN|Name&descending=0&after=&limit=
+    GET  /attendance/count    ?start=&end=
+    GET  /attendance/summary  ?start=YYYY-MM-DD&end=YYYY-MM-DD per-student totals
+                              from the daily rollup; &prn= lists one student's days
+    GET  /health
+    GET  /metrics             Prometheus text format
+
+The server is a small HTTP/1.1 implementation on asyncio streams (keep-alive,
+Content-Length bodies only), so it needs nothing outside the standard
+library. Matching and enrollment run one at a time on a dedicated worker
+thread, as the matcher is a single process. At most max_pending of them may
+wait, and further requests get 503 at once instead of queueing without
+bound. Attendance queries run on their own thread pool and never wait
+behind matches. KioskClient is a blocking client for front-ends and tests.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import http.client
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from archive import start_retention
+from attendance import SORT_PLANS, TIMESTAMP_FORMAT
+from db import DB_PATH
+from gallery import DuplicateFingerprint
+from metrics import REGISTRY
+from service import ALREADY_EXISTS, KioskService
+from sync import start_site_sync
+
+DEFAULT_PORT = 8765
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 100
+MAX_PAGE_SIZE = 1000
+MAX_TOP_K = 20
+HEADER_TIMEOUT = 10.0
+IDLE_TIMEOUT = 30.0
+
+REASONS = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class HttpError(Exception):
+    """Raised by handlers to answer with an error status and message."""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        try:
+            payload = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Request body is not valid JSON.") from None
+        if not isinstance(payload, dict):
+            raise HttpError(400, "Request body must be a JSON object.")
+        return payload
+
+
+def _decode_template(value):
+    try:
+        template = base64.b64decode(value or "", validate=True)
+    except (binascii.Error, TypeError):
+        raise HttpError(400, "template must be base64.") from None
+    if not template:
+        raise HttpError(400, "template is empty.")
+    return template
+
+
+def _parse_timestamp(request, name):
+    value = request.query.get(name)
+    try:
+        return datetime.strptime(value or "", TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    except ValueError:
+        raise HttpError(400, f"{name} must be given as YYYY-MM-DD HH:MM:SS.") from None
+
+
+def _parse_day(request, name):
+    value = request.query.get(name)
+    try:
+        return datetime.strptime(value or "", "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HttpError(400, f"{name} must be given as YYYY-MM-DD.") from None
+
+
+def _entry_json(entry):
+    return {"prn": entry.prn, "name": entry.name, "isadmin": bool(entry.isadmin)}
+
+
+class KioskServer:
+    """
+    HTTP/JSON front for a KioskService.
+
+    Args:
+        service: The KioskService to serve.
+        max_pending: Identify/enroll requests allowed to wait for the matcher
+            before new ones are refused with 503.
+        match_timeout: Seconds a client waits for its match before getting
+            504. The match itself still completes, and keeps its place
+            against max_pending until it does.
+        query_workers: Threads for attendance queries.
+    """
+
+    def __init__(self, service, max_pending=32, match_timeout=15.0, query_workers=4):
+        self.service = service
+        self.max_pending = max_pending
+        self.match_timeout = match_timeout
+        self._pending = 0
+        self._match_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kiosk-match")
+        self._query_executor = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix="kiosk-query")
+        self._server = None
+        self.routes = {
+            ("POST", "/identify"): self.identify,
+            ("POST", "/enroll"): self.enroll,
+            ("GET", "/attendance"): self.attendance,
+            ("GET", "/attendance/count"): self.attendance_count,
+            ("GET", "/attendance/summary"): self.attendance_summary,
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+        }
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """Start listening; returns the bound port (useful with port 0)."""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._match_executor.shutdown(wait=True)
+        self._query_executor.shutdown(wait=True)
+
+    async def _run_match(self, func, *args):
+        """Run matcher work on the single match thread with admission control and a timeout."""
+        if self._pending >= self.max_pending:
+            raise HttpError(503, "The matcher is busy, please retry.")
+        future = asyncio.get_running_loop().run_in_executor(self._match_executor, func, *args)
+        # The slot is held until the work itself finishes, not until this client
+        # gives up, so timed-out matches still count against max_pending
+        self._pending += 1
+        future.add_done_callback(self._match_finished)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.match_timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(504, "Matching timed out.") from None
+
+    def _match_finished(self, future):
+        self._pending -= 1
+        if not future.cancelled():
+            future.exception()  # Mark an abandoned match's error as retrieved
+
+    async def _run_query(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._query_executor, func, *args)
+
+    async def identify(self, request):
+        if request.headers.get("content-type", "").startswith("application/json"):
+            template = _decode_template(request.json().get("template"))
+        else:
+            template = request.body
+        if not template:
+            raise HttpError(400, "No template in the request body.")
+        terminal = request.headers.get("x-terminal-id")
+        if request.query.get("record", "1") == "0":
+            try:
+                top_k = int(request.query.get("top_k", "1"))
+            except ValueError:
+                raise HttpError(400, "top_k must be an integer.") from None
+            if not 1 <= top_k <= MAX_TOP_K:
+                raise HttpError(400, f"top_k must be between 1 and {MAX_TOP_K}.")
+            matches = await self._run_match(self.service.search, template, terminal, top_k)
+            if not matches:
+                return 200, {"match": False, "candidates": []}
+            candidates = [dict(_entry_json(entry), score=score) for entry, score in matches]
+            return 200, dict(candidates[0], match=True, timestamp=None, repeat=False, candidates=candidates)
+        entry, timestamp, repeat, score = await self._run_match(self.service.check_in, template, terminal)
+        if entry is None:
+            return 200, {"match": False}
+        return 200, dict(_entry_json(entry), match=True, timestamp=timestamp, repeat=repeat, score=score)
+
+    async def enroll(self, request):
+        body = request.json()
+        prn = str(body.get("prn") or "").strip().upper()
+        name = str(body.get("name") or "").strip()
+        if not prn or not name:
+            raise HttpError(400, "prn and name are required.")
+        template = _decode_template(body.get("template"))
+        try:
+            result = await self._run_match(self.service.enroll, prn, name, template)
+        except DuplicateFingerprint as e:
+            raise HttpError(409, str(e), duplicate_of=e.entry.prn) from None
+        if result == ALREADY_EXISTS:
+            raise HttpError(409, "A user with this PRN already exists.")
+        return 201, {"prn": prn, "name": name}
+
+    async def attendance(self, request):
+        start, end = _parse_timestamp(request, "start"), _parse_timestamp(request, "end")
+        sort = request.query.get("sort", "Timestamp")
+        if sort not in SORT_PLANS:
+            raise HttpError(400, f"sort must be one of {', '.join(SORT_PLANS)}.")
+        descending = request.query.get("descending", "0") == "1"
+        try:
+            limit = min(int(request.query.get("limit", "200")), MAX_PAGE_SIZE)
+            after = json.loads(request.query["after"]) if request.query.get("after") else None
+        except ValueError:
+            raise HttpError(400, "limit must be an integer and after a JSON array.") from None
+        if limit < 1 or (after is not None and not isinstance(after, list)):
+            raise HttpError(400, "limit must be positive and after a JSON array.")
+        rows, last_key = await self._run_query(
+            self.service.db.attendance_page, start, end, sort, descending, after, limit
+        )
+        return 200, {
+            "rows": [{"prn": prn, "name": name, "timestamp": ts} for prn, name, ts in rows],
+            "next": list(last_key) if last_key is not None and len(rows) == limit else None,
+        }
+
+    async def attendance_count(self, request):
+        start, end = _parse_timestamp(request, "start"), _parse_timestamp(request, "end")
+        return 200, {"count": await self._run_query(self.service.db.attendance_count, start, end)}
+
+    async def attendance_summary(self, request):
+        start, end = _parse_day(request, "start"), _parse_day(request, "end")
+        prn = request.query.get("prn")
+        if prn:
+            rows = await self._run_query(self.service.db.student_days, prn.upper(), start, end)
+            return 200, {"days": [
+                {"day": day, "scans": scans, "first_in": first_in, "last_out": last_out}
+                for day, scans, first_in, last_out in rows
+            ]}
+        rows = await self._run_query(self.service.db.attendance_summary, start, end)
+        return 200, {"students": [
+            {"prn": prn, "name": name, "days_present": days, "scans": scans, "first_day": first, "last_day": last}
+            for prn, name, days, scans, first, last in rows
+        ]}
+
+    async def health(self, request):
+        return 200, {
+            "status": "ok",
+            "templates": len(self.service.gallery),
+            "pending_matches": self._pending,
+            "hot_set": self.service.hot_set.statistics(),
+        }
+
+    async def metrics(self, request):
+        return 200, REGISTRY.render()
+
+    async def _read_request(self, reader, timeout):
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "Malformed request line.") from None
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(400, "Too many headers.")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "transfer-encoding" in headers:
+            raise HttpError(400, "Chunked bodies are not supported; send Content-Length.")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length.") from None
+        if length > MAX_BODY:
+            raise HttpError(413, "Request body too large.")
+        body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT) if length else b""
+        request = Request(method.upper(), target, headers, body)
+        request.keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return request
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                raise HttpError(405, "Method not allowed.")
+            raise HttpError(404, "Not found.")
+        return await handler(request)
+
+    async def _handle_connection(self, reader, writer):
+        timeout = HEADER_TIMEOUT
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader, timeout)
+                    if request is None:
+                        break
+                    keep_alive = request.keep_alive
+                    status, payload = await self._dispatch(request)
+                except HttpError as e:
+                    status, payload = e.status, dict(e.extra, error=str(e))
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except Exception as e:
+                    status, payload = 500, {"error": f"Internal error: {e}"}
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+                timeout = IDLE_TIMEOUT
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _write_response(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        )
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+
+class KioskError(Exception):
+    """Raised by KioskClient for error responses; `status` holds the HTTP status."""
+
+    def __init__(self, status, payload):
+        super().__init__(payload.get("error", f"HTTP {status}"))
+        self.status = status
+        self.payload = payload
+
+
+class KioskClient:
+    """
+    Blocking client for the daemon, reusing one keep-alive connection.
+
+    Args:
+        host, port: Daemon address.
+        terminal: Terminal id sent with identify requests.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, terminal=None, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.terminal = terminal
+        self.timeout = timeout
+        self._connection = None
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        while True:
+            reused = self._connection is not None
+            if not reused:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._connection.request(method, path, body=body, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # The daemon closes idle keep-alive connections; retry once on a fresh one
+                self.close()
+                if not reused:
+                    raise
+        if response.getheader("Content-Type", "").startswith("application/json"):
+            payload = json.loads(data)
+        else:
+            payload = data.decode("utf-8")
+        if response.status >= 400:
+            raise KioskError(response.status, payload if isinstance(payload, dict) else {"error": payload})
+        return payload
+
+    def identify(self, template, record=True, top_k=None):
+        """
+        Identify a template; returns {"match": False} or the matched user with its score and attendance timestamp.
+
+        top_k lists that many candidates and implies record=False.
+        """
+        headers = {"Content-Type": "application/octet-stream"}
+        if self.terminal:
+            headers["X-Terminal-Id"] = self.terminal
+        query = {}
+        if not record or top_k is not None:
+            query["record"] = "0"
+        if top_k is not None:
+            query["top_k"] = top_k
+        path = "/identify" + ("?" + urlencode(query) if query else "")
+        return self._request("POST", path, bytes(template), headers)
+
+    def enroll(self, prn, name, template):
+        body = json.dumps({"prn": prn, "name": name, "template": base64.b64encode(template).decode("ascii")})
+        return self._request("POST", "/enroll", body, {"Content-Type": "application/json"})
+
+    def attendance_page(self, start, end, sort="Timestamp", descending=False, after=None, limit=200):
+        """One page of attendance; returns (rows, next_after) like Database.attendance_page."""
+        query = {"start": start, "end": end, "sort": sort, "descending": int(descending), "limit": limit}
+        if after is not None:
+            query["after"] = json.dumps(list(after))
+        payload = self._request("GET", "/attendance?" + urlencode(query))
+        rows = [(row["prn"], row["name"], row["timestamp"]) for row in payload["rows"]]
+        return rows, payload["next"]
+
+    def attendance_count(self, start, end):
+        return self._request("GET", "/attendance/count?" + urlencode({"start": start, "end": end}))["count"]
+
+    def attendance_summary(self, start_day, end_day, prn=None):
+        """Per-student totals, or one student's days when prn is given, as decoded JSON."""
+        query = {"start": start_day, "end": end_day}
+        if prn:
+            query["prn"] = prn
+        return self._request("GET", "/attendance/summary?" + urlencode(query))
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+async def serve(service, host="127.0.0.1", port=DEFAULT_PORT, **options):
+    server = KioskServer(service, **options)
+    port = await server.start(host, port)
+    print(f"Kiosk daemon listening on http://{host}:{port} with {len(service.gallery)} templates", flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless kiosk daemon with a local HTTP/JSON API.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port (default: %(default)s)")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--matcher", help="matcher backend (default: FINGERPRINT_MATCHER or worker)")
+    parser.add_argument("--max-pending", type=int, default=32, help="queued matches before 503 (default: %(default)s)")
+    parser.add_argument("--match-timeout", type=float, default=15.0, help="seconds before 504 (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    service = KioskService.open(args.db, args.matcher)
+    sync_stopped = start_site_sync(service.db, service.gallery)
+    retention_stopped = start_retention(service.db)
+    try:
+        asyncio.run(serve(
+            service, args.host, args.port, max_pending=args.max_pending, match_timeout=args.match_timeout
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sync_stopped is not None:
+            sync_stopped.set()
+        if retention_stopped is not None:
+            retention_stopped.set()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,629 @@
+"""
+Pluggable fingerprint matchers used for 1:N identification.
+
+A matcher holds the enrolled gallery (PRN -> FIR template bytes) and answers
+"which PRNs does this probe belong to, and how strongly?". search() scores
+candidates in priority order, keeps those at or above the accept threshold and
+stops early once one reaches the certain threshold, returning the top K
+matches best first; identify() is its top-1 shortcut. Backends:
+
+    WorkerMatcher      long-lived matcher process spoken to over a pipe
+                       (matcher_server.exe with the SDK, or matcher_worker.py)
+    StandInMatcher     pure-Python in-process matcher, no SDK required
+    SubprocessMatcher  legacy behaviour: one verify.exe spawn per candidate
+    ParallelMatcher    gallery sharded over a thread/process pool (identify.py)
+
+Templates travel as in-memory buffers over pipes, or, with load_file(), as
+the path of a gallery file (see gallery_file.py) that the worker maps
+instead of receiving every template. verify.exe and the capture app
+(fingerprint_app.exe) use the simpler pack_buffers() framing on stdin/stdout.
+"""
+import heapq
+import math
+import os
+import struct
+import subprocess
+import sys
+import threading
+
+from collections import namedtuple
+
+from fir import popcount
+
+# Frame = 1 byte opcode + 4 byte little-endian payload length + payload.
+FRAME_HEADER = struct.Struct("<cI")
+
+OP_LOAD = b"L"      # replace the gallery, payload = packed entries
+OP_ADD = b"A"       # add/replace templates, payload = packed entries
+OP_REMOVE = b"R"    # remove a PRN, payload = utf-8 PRN
+OP_IDENTIFY = b"I"  # first match, payload = probe template
+OP_IDENTIFY_AMONG = b"C"  # first match among, payload = u32 probe length, probe, packed PRN list (in order)
+OP_LOAD_FILE = b"F"  # replace the gallery from a gallery file, payload = utf-8 path
+OP_SEARCH = b"S"    # payload = SEARCH_HEADER, then as OP_IDENTIFY_AMONG (see pack_search)
+OP_QUIT = b"Q"
+
+OP_OK = b"K"        # payload = u32 gallery size
+OP_MATCH = b"M"     # payload = utf-8 PRN
+OP_NO_MATCH = b"N"
+OP_ERROR = b"E"     # payload = utf-8 message
+OP_SCORES = b"P"    # payload = u32 comparisons, then f32 score and u32 length-prefixed PRN per match
+
+# top_k u32, accept threshold f32, certain threshold f32 (NaN = the worker's
+# default for either), whole gallery u8 (1 = no candidate list follows)
+SEARCH_HEADER = struct.Struct("<IffB")
+
+# Stand-in score thresholds: a score at or above DEFAULT_THRESHOLD is a match,
+# and one at or above CERTAIN_THRESHOLD is taken without scanning further.
+# Genuine stand-in probes score about 0.98 and impostors about 0.5.
+DEFAULT_THRESHOLD = 0.9
+CERTAIN_THRESHOLD = 0.95
+
+Match = namedtuple("Match", "prn score")
+
+
+class MatcherError(Exception):
+    """Raised when a matcher backend fails (as opposed to a plain no-match)."""
+
+
+def pack_entries(entries):
+    """Pack (prn, template) pairs as u32 length-prefixed PRN and template bytes."""
+    parts = []
+    for prn, template in entries:
+        prn_bytes = prn.encode("utf-8")
+        parts.append(struct.pack("<I", len(prn_bytes)))
+        parts.append(prn_bytes)
+        parts.append(struct.pack("<I", len(template)))
+        parts.append(bytes(template))
+    return b"".join(parts)
+
+
+def unpack_entries(payload):
+    """Inverse of pack_entries; returns a list of (prn, template) pairs."""
+    entries = []
+    offset = 0
+    while offset < len(payload):
+        (prn_len,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        prn = payload[offset:offset + prn_len].decode("utf-8")
+        offset += prn_len
+        (template_len,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        entries.append((prn, payload[offset:offset + template_len]))
+        offset += template_len
+    return entries
+
+
+def pack_identify_among(probe, candidates):
+    """Payload for OP_IDENTIFY_AMONG: the probe followed by u32 length-prefixed PRNs."""
+    parts = [struct.pack("<I", len(probe)), bytes(probe)]
+    for prn in candidates:
+        prn_bytes = prn.encode("utf-8")
+        parts.append(struct.pack("<I", len(prn_bytes)))
+        parts.append(prn_bytes)
+    return b"".join(parts)
+
+
+def unpack_identify_among(payload):
+    """Inverse of pack_identify_among; returns (probe, [prn, ...])."""
+    (probe_len,) = struct.unpack_from("<I", payload)
+    probe = payload[4:4 + probe_len]
+    candidates = []
+    offset = 4 + probe_len
+    while offset < len(payload):
+        (prn_len,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        candidates.append(payload[offset:offset + prn_len].decode("utf-8"))
+        offset += prn_len
+    return probe, candidates
+
+
+def pack_search(probe, candidates=None, top_k=1, threshold=None, certain=None):
+    """Payload for OP_SEARCH; None thresholds are sent as NaN so the worker uses its own."""
+    header = SEARCH_HEADER.pack(
+        top_k,
+        math.nan if threshold is None else threshold,
+        math.nan if certain is None else certain,
+        candidates is None,
+    )
+    return header + pack_identify_among(probe, candidates or ())
+
+
+def unpack_search(payload):
+    """Inverse of pack_search; returns (probe, candidates or None, top_k, threshold, certain)."""
+    top_k, threshold, certain, whole_gallery = SEARCH_HEADER.unpack_from(payload)
+    probe, candidates = unpack_identify_among(payload[SEARCH_HEADER.size:])
+    return (
+        probe,
+        None if whole_gallery else candidates,
+        top_k,
+        None if math.isnan(threshold) else threshold,
+        None if math.isnan(certain) else certain,
+    )
+
+
+def pack_scores(matches, comparisons):
+    """Payload for OP_SCORES."""
+    parts = [struct.pack("<I", comparisons)]
+    for prn, score in matches:
+        prn_bytes = prn.encode("utf-8")
+        parts.append(struct.pack("<fI", score, len(prn_bytes)))
+        parts.append(prn_bytes)
+    return b"".join(parts)
+
+
+def unpack_scores(payload):
+    """Inverse of pack_scores; returns ([Match, ...], comparisons)."""
+    (comparisons,) = struct.unpack_from("<I", payload)
+    matches = []
+    offset = 4
+    while offset < len(payload):
+        score, prn_len = struct.unpack_from("<fI", payload, offset)
+        offset += 8
+        matches.append(Match(payload[offset:offset + prn_len].decode("utf-8"), score))
+        offset += prn_len
+    return matches, comparisons
+
+
+def best_matches(matches, top_k):
+    """The top_k highest-scoring Match tuples, best first; equal scores keep scan order."""
+    return heapq.nlargest(top_k, matches, key=lambda match: match.score)
+
+
+def pack_buffers(*buffers):
+    """Concatenate buffers, each prefixed with its u32 little-endian length."""
+    parts = []
+    for buffer in buffers:
+        parts.append(struct.pack("<I", len(buffer)))
+        parts.append(bytes(buffer))
+    return b"".join(parts)
+
+
+def unpack_buffers(payload):
+    """Inverse of pack_buffers; raises MatcherError on truncated input."""
+    buffers = []
+    offset = 0
+    while offset < len(payload):
+        if offset + 4 > len(payload):
+            raise MatcherError("Truncated buffer length.")
+        (length,) = struct.unpack_from("<I", payload, offset)
+        offset += 4
+        if offset + length > len(payload):
+            raise MatcherError("Truncated buffer.")
+        buffers.append(payload[offset:offset + length])
+        offset += length
+    return buffers
+
+
+def select_templates(templates, candidates=None):
+    """(prn, template) pairs for the given PRN order, or the whole dict when candidates is None."""
+    if candidates is None:
+        return templates.items()
+    return ((prn, templates[prn]) for prn in candidates if prn in templates)
+
+
+def write_frame(stream, op, payload=b""):
+    """Write a single frame to a binary stream and flush it."""
+    stream.write(FRAME_HEADER.pack(op, len(payload)))
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError("Pipe closed unexpectedly.")
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """Read a single frame from a binary stream, returning (op, payload)."""
+    op, length = FRAME_HEADER.unpack(_read_exact(stream, FRAME_HEADER.size))
+    return op, _read_exact(stream, length)
+
+
+def standin_score(probe, template):
+    """
+    Similarity in [0, 1] between two templates, used where the SDK is unavailable.
+
+    The score is the fraction of identical bits over the longer of the two
+    buffers, so a template always scores 1.0 against itself and unrelated random
+    templates score around 0.5.
+    """
+    return _bit_similarity(
+        int.from_bytes(probe, "little"), int.from_bytes(template, "little"), max(len(probe), len(template))
+    )
+
+
+def _bit_similarity(probe_value, template_value, size):
+    if size == 0:
+        return 0.0
+    return 1.0 - popcount(probe_value ^ template_value) / (8 * size)
+
+
+def run_verify(command, probe, template):
+    """
+    Run a one-shot verifier (verify.exe or `matcher_worker.py --verify`) on two templates.
+
+    Both templates are sent on stdin with pack_buffers(); the exit code carries
+    the result.
+
+    Returns:
+        True for a match, False for no match.
+
+    Raises:
+        MatcherError: If the verifier rejects its input or the SDK fails.
+    """
+    result = subprocess.run(command, input=pack_buffers(probe, template), capture_output=True)
+    if result.returncode not in (0, 1):
+        raise MatcherError(result.stderr.decode("utf-8", "replace").strip() or "Verifier failed.")
+    return result.returncode == 0
+
+
+class VerifyExeScorer:
+    """
+    Pairwise scorer that pipes both templates to verify.exe (1.0 = match, 0.0 = no match).
+
+    Nothing is shared between calls, so several comparisons can run concurrently.
+    Instances are picklable and can be handed to a process pool.
+
+    Args:
+        command: Verifier executable, or an argument list such as
+            [sys.executable, "matcher_worker.py", "--verify"].
+    """
+
+    def __init__(self, command="verify.exe"):
+        self.command = [command] if isinstance(command, str) else list(command)
+
+    def __call__(self, probe, template):
+        return 1.0 if run_verify(self.command, probe, template) else 0.0
+
+
+class Matcher:
+    """Base class for 1:N matchers. Subclasses override the gallery hooks and search()."""
+
+    # Scores at or above `threshold` are matches; a match at or above
+    # `certain_threshold` ends the scan. Backends scoring on another scale
+    # override both.
+    threshold = DEFAULT_THRESHOLD
+    certain_threshold = CERTAIN_THRESHOLD
+
+    # Upper bound on how many bits per byte a matching template can differ from
+    # the probe, or None when the backend cannot promise one (the SDK cannot).
+    # The candidate pre-filter uses it to skip templates that cannot match.
+    max_bits_per_byte = None
+
+    # Comparisons made by the last search(), or None when the backend does
+    # not report it
+    last_comparisons = None
+
+    def load(self, entries):
+        """Replace the whole gallery with the given (prn, template) pairs."""
+        raise NotImplementedError
+
+    def load_file(self, path):
+        """
+        Replace the whole gallery with the templates of a gallery file.
+
+        Backends running in another process override this to map the file
+        themselves; by default its templates are read and passed to load().
+        """
+        from gallery_file import GalleryFile
+
+        with GalleryFile(path) as gallery_file:
+            self.load(gallery_file.entries())
+
+    def add(self, prn, template):
+        """Add or replace a single enrolled template."""
+        raise NotImplementedError
+
+    def remove(self, prn):
+        """Drop a PRN from the gallery; unknown PRNs are ignored."""
+        raise NotImplementedError
+
+    def identify(self, probe, candidates=None):
+        """
+        Return the PRN best matching the probe template, or None.
+
+        Args:
+            probe: Serialized probe template.
+            candidates: Optional iterable of PRNs to try, in order. Defaults to
+                the whole gallery.
+        """
+        matches = self.search(probe, candidates)
+        return matches[0].prn if matches else None
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        """
+        Score the probe against the gallery and return the best matches.
+
+        Candidates are scored in order; the scan stops at the first score at or
+        above `certain`, so later candidates are only tried while every match
+        so far is marginal. Pass certain=math.inf to score every candidate.
+
+        Args:
+            probe: Serialized probe template.
+            candidates: Optional iterable of PRNs to try, in order. Defaults to
+                the whole gallery.
+            top_k: Maximum number of matches to return.
+            threshold: Minimum score of a match; defaults to self.threshold.
+            certain: Score that ends the scan; defaults to self.certain_threshold.
+
+        Returns:
+            Up to top_k Match tuples, highest score first; empty when nothing
+            cleared the threshold.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any process or SDK resources held by the matcher."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StandInMatcher(Matcher):
+    """
+    Pure-Python in-process matcher backed by standin_score().
+
+    Templates are also kept as integers, so a comparison is one XOR and a
+    popcount instead of two bytes-to-int conversions.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, certain_threshold=CERTAIN_THRESHOLD):
+        self.threshold = threshold
+        self.certain_threshold = certain_threshold
+        self.templates = {}
+        self._values = {}
+
+    @property
+    def max_bits_per_byte(self):
+        return (1.0 - self.threshold) * 8
+
+    def load(self, entries):
+        self.templates = {prn: bytes(template) for prn, template in entries}
+        self._values = {prn: int.from_bytes(template, "little") for prn, template in self.templates.items()}
+
+    def add(self, prn, template):
+        self.templates[prn] = bytes(template)
+        self._values[prn] = int.from_bytes(template, "little")
+
+    def remove(self, prn):
+        self.templates.pop(prn, None)
+        self._values.pop(prn, None)
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        threshold = self.threshold if threshold is None else threshold
+        certain = self.certain_threshold if certain is None else certain
+        probe_value = int.from_bytes(probe, "little")
+        matches = []
+        self.last_comparisons = 0
+        for prn, template in select_templates(self.templates, candidates):
+            self.last_comparisons += 1
+            score = _bit_similarity(probe_value, self._values[prn], max(len(probe), len(template)))
+            if score >= threshold:
+                matches.append(Match(prn, score))
+                if score >= certain:
+                    break
+        return best_matches(matches, top_k)
+
+
+class WorkerMatcher(Matcher):
+    """
+    Client for a long-lived matcher process speaking the frame protocol on stdin/stdout.
+
+    The worker is started once and keeps its SDK handle and gallery in memory, so
+    each identification is a single request/response round trip.
+
+    Scores are on the worker's scale: matcher_server.exe reports the highest
+    SDK security level (1-9) at which the pair still matches, divided by 9.
+    Thresholds left as None use the worker's defaults (for the SDK, the
+    configured security level to accept and HIGH to stop early).
+
+    The last load (or gallery file) and the templates added or removed since
+    are kept, so a worker that has died is restarted with the same gallery
+    before it takes the next request.
+    """
+
+    def __init__(self, command, threshold=None, certain_threshold=None):
+        self.command = list(command)
+        self.threshold = threshold
+        self.certain_threshold = certain_threshold
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._process = None
+        self._base = None     # (OP_LOAD, packed entries) or (OP_LOAD_FILE, path) of the last full load
+        self._changes = {}    # PRN -> template added since, or None if removed
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        try:
+            self._process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except OSError as e:
+            self._process = None
+            raise MatcherError(f"Could not start matcher worker {self.command[0]}: {e}") from None
+        if self._base is None:
+            return
+        self.restarts += 1
+        frames = [self._base] + [
+            (OP_ADD, pack_entries([(prn, template)])) if template is not None else (OP_REMOVE, prn.encode("utf-8"))
+            for prn, template in self._changes.items()
+        ]
+        for op, payload in frames:
+            write_frame(self._process.stdin, op, payload)
+            reply, body = read_frame(self._process.stdout)
+            if reply == OP_ERROR:
+                self._process.kill()
+                self._process = None
+                raise MatcherError(f"Restarted matcher worker rejected its gallery: {body.decode('utf-8', 'replace')}")
+
+    def _request(self, op, payload=b""):
+        with self._lock:
+            try:
+                self._ensure_started()
+                write_frame(self._process.stdin, op, payload)
+                reply, body = read_frame(self._process.stdout)
+            except (OSError, EOFError) as e:
+                if self._process is not None:
+                    self._process.kill()
+                    self._process = None
+                raise MatcherError(f"Matcher worker failed: {e}")
+        if reply == OP_ERROR:
+            raise MatcherError(body.decode("utf-8", "replace"))
+        return reply, body
+
+    def _remember(self, base=None, prn=None, template=None):
+        # Called after the worker accepted a gallery change, for replay after a restart
+        with self._lock:
+            if base is not None:
+                self._base, self._changes = base, {}
+            else:
+                self._changes[prn] = template
+
+    def load(self, entries):
+        payload = pack_entries(entries)
+        self._request(OP_LOAD, payload)
+        self._remember(base=(OP_LOAD, payload))
+
+    def load_file(self, path):
+        payload = os.path.abspath(path).encode("utf-8")
+        self._request(OP_LOAD_FILE, payload)
+        self._remember(base=(OP_LOAD_FILE, payload))
+
+    def add(self, prn, template):
+        self._request(OP_ADD, pack_entries([(prn, template)]))
+        self._remember(prn=prn, template=bytes(template))
+
+    def remove(self, prn):
+        self._request(OP_REMOVE, prn.encode("utf-8"))
+        self._remember(prn=prn)
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        reply, body = self._request(OP_SEARCH, pack_search(
+            probe,
+            candidates,
+            top_k,
+            self.threshold if threshold is None else threshold,
+            self.certain_threshold if certain is None else certain,
+        ))
+        if reply != OP_SCORES:
+            raise MatcherError(f"Unexpected reply {reply!r}.")
+        matches, self.last_comparisons = unpack_scores(body)
+        return matches
+
+    def close(self):
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                write_frame(self._process.stdin, OP_QUIT)
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+            self._process = None
+
+
+class SubprocessMatcher(Matcher):
+    """
+    Legacy matcher: spawns verify.exe for every candidate, piping both templates to it.
+
+    verify.exe only answers match or no match, so every match scores 1.0 and
+    ends the scan.
+
+    Args:
+        command: Verifier executable or argument list, as for VerifyExeScorer.
+    """
+
+    threshold = 1.0
+    certain_threshold = 1.0
+
+    def __init__(self, command="verify.exe"):
+        self.command = [command] if isinstance(command, str) else list(command)
+        self.templates = {}
+
+    def load(self, entries):
+        self.templates = {prn: bytes(template) for prn, template in entries}
+
+    def add(self, prn, template):
+        self.templates[prn] = bytes(template)
+
+    def remove(self, prn):
+        self.templates.pop(prn, None)
+
+    def search(self, probe, candidates=None, top_k=1, threshold=None, certain=None):
+        threshold = self.threshold if threshold is None else threshold
+        certain = self.certain_threshold if certain is None else certain
+        matches = []
+        self.last_comparisons = 0
+        for prn, template in select_templates(self.templates, candidates):
+            self.last_comparisons += 1
+            score = 1.0 if run_verify(self.command, probe, template) else 0.0
+            if score >= threshold:
+                matches.append(Match(prn, score))
+                if score >= certain:
+                    break
+        return best_matches(matches, top_k)
+
+
+def create_matcher(backend=None):
+    """
+    Build the matcher selected by `backend` or the FINGERPRINT_MATCHER environment variable.
+
+    Args:
+        backend: "worker" (matcher_server.exe, the default), "standin-worker"
+            (matcher_worker.py in a child process), "standin" (in-process),
+            "subprocess" (one verify.exe per candidate), "standin-subprocess"
+            (one `matcher_worker.py --verify` per candidate), or the sharded
+            "parallel-standin" / "parallel-subprocess" variants. The parallel
+            backends read FINGERPRINT_MATCH_WORKERS and FINGERPRINT_MATCH_MODE
+            ("first" or "best").
+
+    FINGERPRINT_MATCH_THRESHOLD and FINGERPRINT_MATCH_CERTAIN override the
+    accept and certain thresholds of the scoring backends, on that backend's
+    scale (security level / 9 for matcher_server.exe).
+    """
+    backend = backend or os.environ.get("FINGERPRINT_MATCHER", "worker")
+    threshold = os.environ.get("FINGERPRINT_MATCH_THRESHOLD")
+    threshold = float(threshold) if threshold else None
+    certain = os.environ.get("FINGERPRINT_MATCH_CERTAIN")
+    certain = float(certain) if certain else None
+    standin_threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+    standin_certain = CERTAIN_THRESHOLD if certain is None else certain
+    if backend.startswith("parallel-"):
+        from identify import ParallelMatcher
+
+        workers = int(os.environ.get("FINGERPRINT_MATCH_WORKERS", "0")) or None
+        mode = os.environ.get("FINGERPRINT_MATCH_MODE", "first")
+        if backend == "parallel-standin":
+            # Pure-Python scoring holds the GIL, so shard across processes
+            return ParallelMatcher(
+                standin_score, standin_threshold, workers, mode, use_processes=True,
+                certain_threshold=standin_certain,
+            )
+        if backend == "parallel-subprocess":
+            return ParallelMatcher(VerifyExeScorer(), 1.0, workers, mode, certain_threshold=1.0)
+    if backend == "worker":
+        return WorkerMatcher(["matcher_server.exe"], threshold, certain)
+    if backend == "standin-worker":
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matcher_worker.py")
+        return WorkerMatcher([sys.executable, worker], threshold, certain)
+    if backend == "standin-subprocess":
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matcher_worker.py")
+        return SubprocessMatcher([sys.executable, worker, "--verify"])
+    if backend == "standin":
+        return StandInMatcher(standin_threshold, standin_certain)
+    if backend == "subprocess":
+        return SubprocessMatcher()
+    raise ValueError(f"Unknown matcher backend: {backend}")
@@ -0,0 +1,517 @@
+#include <algorithm>
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <fcntl.h>
+#include <io.h>
+#include <map>
+#include <memory>
+#include <string>
+#include <vector>
+#include <windows.h>
+#include "NBioAPI.h"
+
+// Long-lived matcher worker. Initializes the SDK once, keeps the enrolled
+// gallery in memory (or maps it from a gallery file, opcode 'F') and answers
+// 1:N identification requests over stdin/stdout.
+// Frame format: 1 byte opcode, 4 byte little-endian payload length, payload.
+// See matcher.py for the opcode list.
+//
+// NBioAPI_VerifyMatch only answers match or no match at the handle's security
+// level (1 lowest to 9 highest), so 'S' scores a pair as the highest level at
+// which it still matches, divided by 9. Non-matches cost one comparison at the
+// accept level; only matches are re-checked at higher levels.
+
+typedef std::vector<unsigned char> Buffer;
+
+// An enrolled template. fir views either `owned`, for templates sent with
+// 'L' or 'A', or the mapped gallery file, for templates loaded with 'F'.
+struct Template {
+    Buffer owned;
+    NBioAPI_FIR fir;
+    bool valid = false;
+};
+typedef std::map<std::string, Template> Gallery;
+
+// Gallery file layout, see gallery_file.py
+#pragma pack(push, 1)
+struct GalleryFileHeader {
+    char magic[4];
+    NBioAPI_UINT16 format;
+    NBioAPI_UINT16 reserved;
+    NBioAPI_UINT32 count;
+    NBioAPI_UINT32 headerCount;
+    NBioAPI_UINT32 prnSize;
+    unsigned long long version;
+    NBioAPI_UINT32 reserved2;
+};
+struct GalleryFIRHeader {
+    NBioAPI_UINT32 format;
+    NBioAPI_UINT32 length;
+    NBioAPI_UINT16 version;
+    NBioAPI_UINT16 dataType;
+    NBioAPI_UINT16 purpose;
+    NBioAPI_UINT16 quality;
+    NBioAPI_UINT32 reserved;
+};
+struct GalleryRecord {
+    NBioAPI_UINT32 prnOffset;
+    NBioAPI_UINT16 prnLength;
+    NBioAPI_UINT16 headerIndex;
+    unsigned long long dataOffset;
+    NBioAPI_UINT32 dataLength;
+};
+#pragma pack(pop)
+const NBioAPI_UINT16 kGalleryFormat = 1;
+const NBioAPI_UINT16 kRawRecord = 0xFFFF;
+
+// Read exactly `size` bytes from stdin
+bool ReadExact(void* dest, size_t size) {
+    return size == 0 || fread(dest, 1, size, stdin) == size;
+}
+
+bool ReadFrame(char& op, Buffer& payload) {
+    NBioAPI_UINT32 length = 0;
+    if (!ReadExact(&op, 1) || !ReadExact(&length, sizeof(length))) {
+        return false;
+    }
+    payload.resize(length);
+    return ReadExact(payload.data(), length);
+}
+
+void WriteFrame(char op, const void* payload, NBioAPI_UINT32 length) {
+    fwrite(&op, 1, 1, stdout);
+    fwrite(&length, sizeof(length), 1, stdout);
+    if (length > 0) {
+        fwrite(payload, 1, length, stdout);
+    }
+    fflush(stdout);
+}
+
+void WriteMessage(char op, const std::string& message) {
+    WriteFrame(op, message.data(), static_cast<NBioAPI_UINT32>(message.size()));
+}
+
+// Split a packed entry list (u32 PRN length, PRN, u32 template length, template)
+bool UnpackEntries(const Buffer& payload, std::map<std::string, Buffer>& entries) {
+    size_t offset = 0;
+    while (offset < payload.size()) {
+        NBioAPI_UINT32 prnLength = 0, templateLength = 0;
+        if (offset + sizeof(prnLength) > payload.size()) return false;
+        memcpy(&prnLength, &payload[offset], sizeof(prnLength));
+        offset += sizeof(prnLength);
+        if (offset + prnLength + sizeof(templateLength) > payload.size()) return false;
+        std::string prn(reinterpret_cast<const char*>(&payload[offset]), prnLength);
+        offset += prnLength;
+        memcpy(&templateLength, &payload[offset], sizeof(templateLength));
+        offset += sizeof(templateLength);
+        if (offset + templateLength > payload.size()) return false;
+        entries[prn] = Buffer(payload.begin() + offset, payload.begin() + offset + templateLength);
+        offset += templateLength;
+    }
+    return true;
+}
+
+// Point an NBioAPI_FIR at a serialized FIR (Format, Header, Data) without copying
+bool ViewFIR(const unsigned char* bytes, size_t size, NBioAPI_FIR& fir) {
+    if (size < sizeof(fir.Format) + sizeof(fir.Header)) {
+        return false;
+    }
+    memcpy(&fir.Format, bytes, sizeof(fir.Format));
+    memcpy(&fir.Header, bytes + sizeof(fir.Format), sizeof(fir.Header));
+    size_t dataOffset = sizeof(fir.Format) + sizeof(fir.Header);
+    if (dataOffset + fir.Header.DataLength > size) {
+        return false;
+    }
+    fir.Data = const_cast<NBioAPI_UINT8*>(bytes + dataOffset);
+    return true;
+}
+
+bool ViewFIR(const Buffer& buffer, NBioAPI_FIR& fir) {
+    return ViewFIR(buffer.data(), buffer.size(), fir);
+}
+
+// Take ownership of a serialized FIR and point the template's view at it
+void SetOwned(Template& stored, Buffer& bytes) {
+    stored.owned.swap(bytes);
+    stored.valid = ViewFIR(stored.owned, stored.fir);
+}
+
+// Read-only mapping of a gallery file
+class MappedFile {
+public:
+    MappedFile() = default;
+    MappedFile(const MappedFile&) = delete;
+    MappedFile& operator=(const MappedFile&) = delete;
+    ~MappedFile() { Close(); }
+
+    bool Open(const std::string& utf8Path) {
+        int length = MultiByteToWideChar(CP_UTF8, 0, utf8Path.c_str(), -1, nullptr, 0);
+        if (length <= 0) return false;
+        std::wstring path(length, L'\0');
+        MultiByteToWideChar(CP_UTF8, 0, utf8Path.c_str(), -1, &path[0], length);
+        // FILE_SHARE_DELETE lets the Python side delete superseded files we still map
+        file_ = CreateFileW(path.c_str(), GENERIC_READ, FILE_SHARE_READ | FILE_SHARE_DELETE, nullptr,
+                            OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, nullptr);
+        LARGE_INTEGER fileSize;
+        if (file_ == INVALID_HANDLE_VALUE || !GetFileSizeEx(file_, &fileSize) || fileSize.QuadPart == 0) {
+            Close();
+            return false;
+        }
+        mapping_ = CreateFileMappingW(file_, nullptr, PAGE_READONLY, 0, 0, nullptr);
+        data = mapping_ ? static_cast<const unsigned char*>(MapViewOfFile(mapping_, FILE_MAP_READ, 0, 0, 0)) : nullptr;
+        if (!data) {
+            Close();
+            return false;
+        }
+        size = static_cast<size_t>(fileSize.QuadPart);
+        return true;
+    }
+
+    void Close() {
+        if (data) UnmapViewOfFile(data);
+        if (mapping_) CloseHandle(mapping_);
+        if (file_ != INVALID_HANDLE_VALUE) CloseHandle(file_);
+        data = nullptr;
+        mapping_ = nullptr;
+        file_ = INVALID_HANDLE_VALUE;
+        size = 0;
+    }
+
+    const unsigned char* data = nullptr;
+    size_t size = 0;
+
+private:
+    HANDLE file_ = INVALID_HANDLE_VALUE;
+    HANDLE mapping_ = nullptr;
+};
+
+// Build a gallery of FIR views straight into a mapped gallery file; nothing is copied
+bool ViewGalleryFile(const MappedFile& file, Gallery& gallery, std::string& error) {
+    GalleryFileHeader header;
+    if (file.size < sizeof(header)) {
+        error = "Gallery file is truncated.";
+        return false;
+    }
+    memcpy(&header, file.data, sizeof(header));
+    if (memcmp(header.magic, "FPGL", 4) != 0 || header.format != kGalleryFormat) {
+        error = "Not a gallery file, or an unsupported format version.";
+        return false;
+    }
+    size_t headersOffset = sizeof(header);
+    size_t recordsOffset = headersOffset + static_cast<size_t>(header.headerCount) * sizeof(GalleryFIRHeader);
+    size_t prnsOffset = recordsOffset + static_cast<size_t>(header.count) * sizeof(GalleryRecord);
+    if (prnsOffset + header.prnSize > file.size) {
+        error = "Gallery file is truncated.";
+        return false;
+    }
+    std::vector<GalleryFIRHeader> firHeaders(header.headerCount);
+    if (header.headerCount) {
+        memcpy(firHeaders.data(), file.data + headersOffset, firHeaders.size() * sizeof(GalleryFIRHeader));
+    }
+    for (NBioAPI_UINT32 i = 0; i < header.count; i++) {
+        GalleryRecord record;
+        memcpy(&record, file.data + recordsOffset + i * sizeof(record), sizeof(record));
+        if (static_cast<size_t>(record.prnOffset) + record.prnLength > header.prnSize
+            || record.dataOffset + record.dataLength > file.size) {
+            error = "Gallery file is truncated.";
+            return false;
+        }
+        std::string prn(reinterpret_cast<const char*>(file.data + prnsOffset + record.prnOffset), record.prnLength);
+        Template& stored = gallery[prn];
+        const unsigned char* data = file.data + record.dataOffset;
+        if (record.headerIndex == kRawRecord) {
+            stored.valid = ViewFIR(data, record.dataLength, stored.fir);
+        } else if (record.headerIndex < firHeaders.size()) {
+            const GalleryFIRHeader& firHeader = firHeaders[record.headerIndex];
+            stored.fir.Format = firHeader.format;
+            stored.fir.Header.Length = firHeader.length;
+            stored.fir.Header.DataLength = record.dataLength;
+            stored.fir.Header.Version = firHeader.version;
+            stored.fir.Header.DataType = firHeader.dataType;
+            stored.fir.Header.Purpose = firHeader.purpose;
+            stored.fir.Header.Quality = firHeader.quality;
+            stored.fir.Header.Reserved = firHeader.reserved;
+            stored.fir.Data = const_cast<NBioAPI_UINT8*>(data);
+            stored.valid = true;
+        } else {
+            error = "Gallery file has a bad FIR header index.";
+            return false;
+        }
+    }
+    return true;
+}
+
+// Compare a probe against one stored template
+bool Matches(NBioAPI_HANDLE hBSP, NBioAPI_FIR& probeFIR, const Template& stored) {
+    if (!stored.valid) {
+        return false;
+    }
+    NBioAPI_FIR storedFIR = stored.fir;
+    NBioAPI_INPUT_FIR inputProbe, inputStored;
+    inputProbe.Form = NBioAPI_FIR_FORM_FULLFIR;
+    inputProbe.InputFIR.FIR = &probeFIR;
+    inputStored.Form = NBioAPI_FIR_FORM_FULLFIR;
+    inputStored.InputFIR.FIR = &storedFIR;
+
+    NBioAPI_BOOL matchResult = NBioAPI_FALSE;
+    NBioAPI_RETURN ret = NBioAPI_VerifyMatch(hBSP, &inputProbe, &inputStored, &matchResult, nullptr);
+    return ret == NBioAPIERROR_NONE && matchResult == NBioAPI_TRUE;
+}
+
+// Switches the handle's security level, restoring the configured one on exit
+class SecurityLevel {
+public:
+    explicit SecurityLevel(NBioAPI_HANDLE handle) : handle_(handle) {
+        info_.StructureType = 0;
+        if (NBioAPI_GetInitInfo(handle_, 0, &info_) != NBioAPIERROR_NONE) {
+            info_.SecurityLevel = NBioAPI_FIR_SECURITY_LEVEL_NORMAL;
+        }
+        configured = current_ = static_cast<int>(info_.SecurityLevel);
+    }
+    SecurityLevel(const SecurityLevel&) = delete;
+    SecurityLevel& operator=(const SecurityLevel&) = delete;
+    ~SecurityLevel() { Set(configured); }
+
+    bool Set(int level) {
+        if (level == current_) return true;
+        info_.SecurityLevel = static_cast<NBioAPI_UINT32>(level);
+        if (NBioAPI_SetInitInfo(handle_, 0, &info_) != NBioAPIERROR_NONE) return false;
+        current_ = level;
+        return true;
+    }
+
+    int configured;
+
+private:
+    NBioAPI_HANDLE handle_;
+    NBioAPI_INIT_INFO_0 info_;
+    int current_;
+};
+
+const int kMinLevel = NBioAPI_FIR_SECURITY_LEVEL_LOWEST;
+const int kMaxLevel = NBioAPI_FIR_SECURITY_LEVEL_HIGHEST;
+
+// Security level for a score threshold sent by the client; NaN picks `fallback`
+int ThresholdLevel(float threshold, int fallback) {
+    if (std::isnan(threshold)) return fallback;
+    if (threshold > 1.0f) return kMaxLevel + 1;  // never reached
+    int level = static_cast<int>(std::ceil(threshold * kMaxLevel - 1e-4f));
+    return std::max(kMinLevel, level);
+}
+
+// Highest security level at which probe and stored match, or 0 if they do not
+// match at `floor`. Higher levels are stricter, so a binary search above
+// `floor` finds it in at most three more comparisons.
+int MatchLevel(NBioAPI_HANDLE hBSP, SecurityLevel& level, NBioAPI_FIR& probeFIR, const Template& stored, int floor) {
+    if (!level.Set(floor) || !Matches(hBSP, probeFIR, stored)) {
+        return 0;
+    }
+    int low = floor, high = kMaxLevel;
+    while (low < high) {
+        int mid = (low + high + 1) / 2;
+        if (level.Set(mid) && Matches(hBSP, probeFIR, stored)) {
+            low = mid;
+        } else {
+            high = mid - 1;
+        }
+    }
+    return low;
+}
+
+struct ScoredMatch {
+    float score;
+    const std::string* prn;
+};
+
+// Split an identify-among payload (u32 probe length, probe, u32 length-prefixed PRNs)
+bool UnpackCandidates(const Buffer& payload, Buffer& probe, std::vector<std::string>& candidates) {
+    NBioAPI_UINT32 length = 0;
+    if (payload.size() < sizeof(length)) return false;
+    memcpy(&length, payload.data(), sizeof(length));
+    size_t offset = sizeof(length);
+    if (offset + length > payload.size()) return false;
+    probe.assign(payload.begin() + offset, payload.begin() + offset + length);
+    offset += length;
+    while (offset < payload.size()) {
+        if (offset + sizeof(length) > payload.size()) return false;
+        memcpy(&length, &payload[offset], sizeof(length));
+        offset += sizeof(length);
+        if (offset + length > payload.size()) return false;
+        candidates.emplace_back(reinterpret_cast<const char*>(&payload[offset]), length);
+        offset += length;
+    }
+    return true;
+}
+
+int main() {
+    _setmode(_fileno(stdin), _O_BINARY);
+    _setmode(_fileno(stdout), _O_BINARY);
+
+    NBioAPI_HANDLE g_hBSP = 0;
+    if (NBioAPI_Init(&g_hBSP) != NBioAPIERROR_NONE) {
+        WriteMessage('E', "Failed to initialize NBioAPI.");
+        return 1;
+    }
+
+    Gallery gallery;
+    // Mapping the gallery's file-backed templates point into, if loaded with 'F'
+    std::unique_ptr<MappedFile> mapped;
+    char op = 0;
+    Buffer payload;
+
+    while (ReadFrame(op, payload)) {
+        if (op == 'Q') {
+            break;
+        } else if (op == 'L' || op == 'A') {
+            std::map<std::string, Buffer> entries;
+            if (!UnpackEntries(payload, entries)) {
+                WriteMessage('E', "Malformed template list.");
+                continue;
+            }
+            if (op == 'L') {
+                Gallery loaded;
+                for (auto& entry : entries) {
+                    SetOwned(loaded[entry.first], entry.second);
+                }
+                gallery.swap(loaded);
+                loaded.clear();
+                mapped.reset();
+            } else {
+                for (auto& entry : entries) {
+                    SetOwned(gallery[entry.first], entry.second);
+                }
+            }
+        } else if (op == 'F') {
+            std::unique_ptr<MappedFile> file(new MappedFile);
+            if (!file->Open(std::string(payload.begin(), payload.end()))) {
+                WriteMessage('E', "Cannot map gallery file.");
+                continue;
+            }
+            Gallery loaded;
+            std::string error;
+            if (!ViewGalleryFile(*file, loaded, error)) {
+                WriteMessage('E', error);
+                continue;
+            }
+            gallery.swap(loaded);
+            loaded.clear();
+            // The previous mapping, if any, is unmapped as `file` goes out of scope
+            mapped.swap(file);
+        } else if (op == 'R') {
+            gallery.erase(std::string(payload.begin(), payload.end()));
+        } else if (op == 'S') {
+            // u32 top K, f32 accept and certain thresholds, u8 whole gallery, then as 'C'
+            NBioAPI_UINT32 topK = 0;
+            float threshold = 0, certain = 0;
+            unsigned char wholeGallery = 0;
+            const size_t headerSize = sizeof(topK) + sizeof(threshold) + sizeof(certain) + sizeof(wholeGallery);
+            Buffer probe;
+            std::vector<std::string> candidates;
+            if (payload.size() < headerSize
+                    || !UnpackCandidates(Buffer(payload.begin() + headerSize, payload.end()), probe, candidates)) {
+                WriteMessage('E', "Malformed search request.");
+                continue;
+            }
+            memcpy(&topK, &payload[0], sizeof(topK));
+            memcpy(&threshold, &payload[4], sizeof(threshold));
+            memcpy(&certain, &payload[8], sizeof(certain));
+            wholeGallery = payload[12];
+            NBioAPI_FIR probeFIR;
+            if (!ViewFIR(probe, probeFIR)) {
+                WriteMessage('E', "Malformed probe FIR.");
+                continue;
+            }
+
+            SecurityLevel level(g_hBSP);
+            int acceptLevel = ThresholdLevel(threshold, level.configured);
+            int certainLevel = std::max(acceptLevel, ThresholdLevel(certain, NBioAPI_FIR_SECURITY_LEVEL_HIGH));
+            std::vector<ScoredMatch> matches;
+            NBioAPI_UINT32 comparisons = 0;
+            auto score = [&](const std::string& prn, const Template& stored) {
+                comparisons++;
+                int matched = acceptLevel <= kMaxLevel ? MatchLevel(g_hBSP, level, probeFIR, stored, acceptLevel) : 0;
+                if (matched) {
+                    matches.push_back({static_cast<float>(matched) / kMaxLevel, &prn});
+                }
+                return matched >= certainLevel;
+            };
+            if (wholeGallery) {
+                for (const auto& entry : gallery) {
+                    if (score(entry.first, entry.second)) break;
+                }
+            } else {
+                for (const auto& prn : candidates) {
+                    auto entry = gallery.find(prn);
+                    if (entry != gallery.end() && score(entry->first, entry->second)) break;
+                }
+            }
+
+            // Best first; equal scores keep scan order
+            std::stable_sort(matches.begin(), matches.end(),
+                             [](const ScoredMatch& a, const ScoredMatch& b) { return a.score > b.score; });
+            if (matches.size() > topK) {
+                matches.resize(topK);
+            }
+            Buffer reply(sizeof(comparisons));
+            memcpy(reply.data(), &comparisons, sizeof(comparisons));
+            for (const auto& match : matches) {
+                NBioAPI_UINT32 length = static_cast<NBioAPI_UINT32>(match.prn->size());
+                size_t offset = reply.size();
+                reply.resize(offset + sizeof(match.score) + sizeof(length) + length);
+                memcpy(&reply[offset], &match.score, sizeof(match.score));
+                memcpy(&reply[offset + sizeof(match.score)], &length, sizeof(length));
+                memcpy(&reply[offset + sizeof(match.score) + sizeof(length)], match.prn->data(), length);
+            }
+            WriteFrame('P', reply.data(), static_cast<NBioAPI_UINT32>(reply.size()));
+            continue;
+        } else if (op == 'I' || op == 'C') {
+            // 'I' scans the whole gallery, 'C' only the listed PRNs in the given order
+            Buffer probe;
+            std::vector<std::string> candidates;
+            if (op == 'I') {
+                probe.swap(payload);
+            } else if (!UnpackCandidates(payload, probe, candidates)) {
+                WriteMessage('E', "Malformed candidate list.");
+                continue;
+            }
+            NBioAPI_FIR probeFIR;
+            if (!ViewFIR(probe, probeFIR)) {
+                WriteMessage('E', "Malformed probe FIR.");
+                continue;
+            }
+
+            const std::string* matchedPrn = nullptr;
+            if (op == 'I') {
+                for (const auto& entry : gallery) {
+                    if (Matches(g_hBSP, probeFIR, entry.second)) {
+                        matchedPrn = &entry.first;
+                        break;
+                    }
+                }
+            } else {
+                for (const auto& prn : candidates) {
+                    auto entry = gallery.find(prn);
+                    if (entry != gallery.end() && Matches(g_hBSP, probeFIR, entry->second)) {
+                        matchedPrn = &entry->first;
+                        break;
+                    }
+                }
+            }
+            if (matchedPrn) {
+                WriteMessage('M', *matchedPrn);
+            } else {
+                WriteFrame('N', nullptr, 0);
+            }
+            continue;
+        } else {
+            WriteMessage('E', "Unknown opcode.");
+            continue;
+        }
+        NBioAPI_UINT32 size = static_cast<NBioAPI_UINT32>(gallery.size());
+        WriteFrame('K', &size, sizeof(size));
+    }
+
+    NBioAPI_Terminate(g_hBSP);
+    return 0;
+}
@@ -0,0 +1,82 @@
+"""
+Stand-in matcher worker speaking the same pipe protocol as matcher_server.exe.
+
+Run it as a child process (see matcher.create_matcher("standin-worker")) to
+exercise the long-lived worker path on machines without the NBioBSP SDK.
+
+With --verify it stands in for verify.exe instead: it reads two
+length-prefixed templates from stdin, prints "match" or "no match" and exits
+with 0, 1, or 2 on bad input.
+"""
+import sys
+
+from matcher import (
+    OP_ADD, OP_ERROR, OP_IDENTIFY, OP_IDENTIFY_AMONG, OP_LOAD, OP_LOAD_FILE, OP_MATCH,
+    OP_NO_MATCH, OP_OK, OP_QUIT, OP_REMOVE, OP_SCORES, OP_SEARCH, DEFAULT_THRESHOLD, MatcherError,
+    StandInMatcher, pack_scores, read_frame, standin_score, unpack_buffers, unpack_entries,
+    unpack_identify_among, unpack_search, write_frame,
+)
+
+
+def serve(stdin, stdout, matcher=None):
+    """Answer frames from stdin until OP_QUIT or end of input."""
+    matcher = matcher or StandInMatcher()
+    while True:
+        try:
+            op, payload = read_frame(stdin)
+        except EOFError:
+            return
+        try:
+            if op == OP_QUIT:
+                return
+            elif op == OP_LOAD:
+                matcher.load(unpack_entries(payload))
+            elif op == OP_LOAD_FILE:
+                matcher.load_file(payload.decode("utf-8"))
+            elif op == OP_ADD:
+                for prn, template in unpack_entries(payload):
+                    matcher.add(prn, template)
+            elif op == OP_REMOVE:
+                matcher.remove(payload.decode("utf-8"))
+            elif op == OP_SEARCH:
+                probe, candidates, top_k, threshold, certain = unpack_search(payload)
+                matches = matcher.search(probe, candidates, top_k, threshold, certain)
+                write_frame(stdout, OP_SCORES, pack_scores(matches, matcher.last_comparisons))
+                continue
+            elif op in (OP_IDENTIFY, OP_IDENTIFY_AMONG):
+                if op == OP_IDENTIFY:
+                    prn = matcher.identify(payload)
+                else:
+                    prn = matcher.identify(*unpack_identify_among(payload))
+                if prn is None:
+                    write_frame(stdout, OP_NO_MATCH)
+                else:
+                    write_frame(stdout, OP_MATCH, prn.encode("utf-8"))
+                continue
+            else:
+                write_frame(stdout, OP_ERROR, f"Unknown opcode {op!r}".encode("utf-8"))
+                continue
+            write_frame(stdout, OP_OK, len(matcher.templates).to_bytes(4, "little"))
+        except Exception as e:
+            write_frame(stdout, OP_ERROR, str(e).encode("utf-8"))
+
+
+def verify(stdin, stdout, threshold=DEFAULT_THRESHOLD):
+    """One-shot 1:1 verification with verify.exe's stdin/stdout contract; returns the exit code."""
+    try:
+        buffers = unpack_buffers(stdin.read())
+    except MatcherError:
+        buffers = []
+    if len(buffers) != 2:
+        sys.stderr.write("Expected two length-prefixed FIR templates on stdin.\n")
+        return 2
+    matched = standin_score(*buffers) >= threshold
+    stdout.write(b"match\n" if matched else b"no match\n")
+    stdout.flush()
+    return 0 if matched else 1
+
+
+if __name__ == "__main__":
+    if "--verify" in sys.argv[1:]:
+        sys.exit(verify(sys.stdin.buffer, sys.stdout.buffer))
+    serve(sys.stdin.buffer, sys.stdout.buffer)
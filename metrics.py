@@ -0,0 +1,292 @@
+"""
+In-process metrics for the scan, enrollment and database paths.
+
+Counters, gauges and histograms live in one Metrics registry (REGISTRY) and
+are rendered in the Prometheus text exposition format. They can be exported
+in two ways: a file rewritten every few seconds, for node_exporter's textfile
+collector, or a small HTTP endpoint on localhost. Both are optional and
+configured with environment variables; see start_exporters().
+
+A single scan can also be captured with cProfile. arm_profile(path) makes the
+next profiled() block dump its stats to path.
+"""
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram buckets, in seconds
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+SCORE_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.98, 1.0)
+
+STAGE_SECONDS = "fingerprint_stage_seconds"
+SCANS = "fingerprint_scans_total"
+LIKELY_FALSE_REJECTS = "fingerprint_likely_false_rejects_total"
+CANDIDATES = "fingerprint_identification_candidates"
+COMPARISONS = "fingerprint_identification_comparisons"
+MATCH_SCORES = "fingerprint_match_score"
+ENROLLMENTS = "fingerprint_enrollments_total"
+DB_QUERY_SECONDS = "fingerprint_db_query_seconds"
+GALLERY_TEMPLATES = "fingerprint_gallery_templates"
+DEBOUNCED_SCANS = "fingerprint_debounced_scans_total"
+HOT_SET_LOOKUPS = "fingerprint_hot_set_lookups_total"
+SYNC_BYTES = "fingerprint_sync_bytes_total"
+BATCH_WRITE_FAILURES = "fingerprint_batch_write_failures_total"
+
+# A match this soon after a no-match is most likely the same person retrying
+RETRY_WINDOW = 60.0
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and histograms.
+
+    Metrics are declared once with describe(). Each observation carries
+    keyword labels, and every distinct label set is its own series.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self._help = {}
+        self._buckets = {}
+        self._values = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text, buckets=SECONDS_BUCKETS):
+        """Declare a "counter", "gauge" or "histogram"."""
+        with self._lock:
+            self._kinds[name] = kind
+            self._help[name] = help_text
+            if kind == "histogram":
+                self._buckets[name] = tuple(buckets)
+            self._values.setdefault(name, {})
+
+    def add_collector(self, collect):
+        """Register a callable run just before each render(), e.g. to update gauges."""
+        self._collectors.append(collect)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * len(self._buckets[name]), 0.0, 0]
+            for i, bound in enumerate(self._buckets[name]):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the wall-clock duration of the block in seconds, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def value(self, name, **labels):
+        """Current value of a counter or gauge series, or (count, sum) of a histogram series."""
+        with self._lock:
+            state = self._values[name].get(tuple(sorted(labels.items())))
+            if self._kinds[name] == "histogram":
+                return (state[2], state[1]) if state else (0, 0.0)
+            return state or 0
+
+    def render(self):
+        """The registry in the Prometheus text exposition format."""
+        for collect in self._collectors:
+            collect(self)
+        lines = []
+        with self._lock:
+            for name in sorted(self._kinds):
+                kind = self._kinds[name]
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, state in sorted(self._values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(state)}")
+                        continue
+                    counts, total, count = state
+                    for bound, bucket_count in zip(self._buckets[name], counts):
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace `path` with the rendered metrics."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+
+REGISTRY = Metrics()
+REGISTRY.describe(STAGE_SECONDS, "histogram", "Time spent in each stage of a scan or enrollment.")
+REGISTRY.describe(SCANS, "counter", "Verification scans by result (match, no_match, error).")
+REGISTRY.describe(
+    LIKELY_FALSE_REJECTS, "counter",
+    f"Matches that follow a no-match within {RETRY_WINDOW:.0f} s, most likely a false reject and a retry."
+)
+REGISTRY.describe(CANDIDATES, "histogram", "Candidates passed to the matcher per identification.", COUNT_BUCKETS)
+REGISTRY.describe(
+    COMPARISONS, "histogram", "Template comparisons per identification, where the matcher reports it.", COUNT_BUCKETS
+)
+REGISTRY.describe(MATCH_SCORES, "histogram", "Score of the best match per identification that matched.", SCORE_BUCKETS)
+REGISTRY.describe(ENROLLMENTS, "counter", "Enrollment attempts by result (enrolled, duplicate_prn, duplicate_finger).")
+REGISTRY.describe(DB_QUERY_SECONDS, "histogram", "Database call latency by query.")
+REGISTRY.describe(GALLERY_TEMPLATES, "gauge", "Templates held in the in-memory gallery.")
+REGISTRY.describe(DEBOUNCED_SCANS, "counter", "Matches inside the debounce window that wrote no attendance event.")
+REGISTRY.describe(
+    HOT_SET_LOOKUPS, "counter", "Recorded matches by whether the PRN was already in the kiosk's hot set (hit, miss)."
+)
+REGISTRY.describe(SYNC_BYTES, "counter", "Multi-site sync bytes by direction (push, merge, publish, pull).")
+REGISTRY.describe(BATCH_WRITE_FAILURES, "counter", "Buffered batch commits that failed and were kept for a retry.")
+
+
+class ScanOutcomes:
+    """Counts scan results and flags matches that quickly follow a no-match on the same terminal."""
+
+    def __init__(self, registry=REGISTRY, retry_window=RETRY_WINDOW):
+        self.registry = registry
+        self.retry_window = retry_window
+        self._last_no_match = {}
+        self._lock = threading.Lock()
+
+    def record(self, result, terminal=None):
+        """Record "match", "no_match" or "error" for a terminal (None for the local kiosk)."""
+        now = time.monotonic()
+        self.registry.inc(SCANS, result=result)
+        with self._lock:
+            if result == "no_match":
+                self._last_no_match[terminal] = now
+            elif result == "match":
+                last = self._last_no_match.pop(terminal, None)
+                if last is not None and now - last <= self.retry_window:
+                    self.registry.inc(LIKELY_FALSE_REJECTS)
+
+
+_profile_lock = threading.Lock()
+_profile_path = None
+
+
+def arm_profile(path):
+    """Profile the next profiled() block and dump its pstats to path."""
+    global _profile_path
+    with _profile_lock:
+        _profile_path = path
+
+
+@contextmanager
+def profiled():
+    """Run the block under cProfile if a capture is armed; otherwise do nothing."""
+    global _profile_path
+    with _profile_lock:
+        path, _profile_path = _profile_path, None
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Scan profile written to {path}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread; returns the server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_file_export(path, interval=15.0, registry=REGISTRY):
+    """Rewrite `path` every `interval` seconds from a daemon thread; returns its stop event."""
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                registry.write(path)
+            except OSError as e:
+                print(f"Writing metrics to {path} failed: {e}")
+
+    threading.Thread(target=run, name="metrics-file", daemon=True).start()
+    return stopped
+
+
+def start_exporters(registry=REGISTRY):
+    """
+    Start the exporters selected by environment variables.
+
+    FINGERPRINT_METRICS_FILE   path of a Prometheus text file rewritten every
+                               FINGERPRINT_METRICS_INTERVAL seconds (default 15)
+    FINGERPRINT_METRICS_PORT   serve http://127.0.0.1:<port>/metrics
+    FINGERPRINT_PROFILE_SCAN   dump a cProfile of the first scan to this path
+    """
+    path = os.environ.get("FINGERPRINT_METRICS_FILE")
+    if path:
+        start_file_export(path, float(os.environ.get("FINGERPRINT_METRICS_INTERVAL", "15")), registry)
+    port = os.environ.get("FINGERPRINT_METRICS_PORT")
+    if port:
+        start_http_server(int(port), registry=registry)
+    profile_path = os.environ.get("FINGERPRINT_PROFILE_SCAN")
+    if profile_path:
+        arm_profile(profile_path)
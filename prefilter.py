@@ -0,0 +1,89 @@
+"""
+Candidate pre-filter index for 1:N identification.
+
+Templates are bucketed by their FIR compatibility group and kept sorted by
+popcount within each bucket (see fir.template_key). For a probe, candidates
+are produced lazily: the probe's own bucket first, each bucket expanding
+outwards from the probe's popcount, so the most similar templates are tried
+first. Other buckets are still tried afterwards, since the SDK can convert
+between some formats.
+
+When the matcher can bound the bit distance of a possible match (the stand-in
+scorer can), candidates outside that popcount band cannot match and are
+skipped entirely, because |popcount(a) - popcount(b)| <= popcount(a ^ b).
+"""
+import threading
+from bisect import bisect_left, insort
+
+from fir import split_template_key, template_key
+
+
+class CandidateIndex:
+    """Popcount-ordered candidate index keyed by PRN."""
+
+    def __init__(self):
+        self.groups = {}
+        self.keys = {}
+        self.max_size = {}
+        self._lock = threading.Lock()
+
+    def add(self, prn, key):
+        """Index a PRN under its template_key, replacing any previous key."""
+        with self._lock:
+            self._discard(prn)
+            group, size, _, popcount = split_template_key(key)
+            self.keys[prn] = (group, size, popcount)
+            insort(self.groups.setdefault(group, []), (popcount, prn, size))
+            self.max_size[group] = max(self.max_size.get(group, 0), size)
+
+    def remove(self, prn):
+        with self._lock:
+            self._discard(prn)
+
+    def _discard(self, prn):
+        previous = self.keys.pop(prn, None)
+        if previous is None:
+            return
+        group, size, popcount = previous
+        entries = self.groups[group]
+        entries.pop(bisect_left(entries, (popcount, prn, size)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, probe, max_bits_per_byte=None):
+        """
+        Yield PRNs in most-likely-first order for a probe template.
+
+        Args:
+            probe: Serialized probe template.
+            max_bits_per_byte: If given, a match may differ from the probe in at
+                most this many bits per byte of the larger template, and
+                candidates outside the resulting popcount band are skipped.
+        """
+        probe_group, probe_size, _, probe_popcount = split_template_key(template_key(probe))
+        with self._lock:
+            groups = sorted(self.groups.items(), key=lambda item: item[0] != probe_group)
+            snapshot = [(list(entries), self.max_size[group]) for group, entries in groups]
+
+        for entries, max_size in snapshot:
+            group_bound = None
+            if max_bits_per_byte is not None:
+                group_bound = max_bits_per_byte * max(probe_size, max_size)
+            hi = bisect_left(entries, (probe_popcount,))
+            lo = hi - 1
+            while lo >= 0 or hi < len(entries):
+                lo_delta = probe_popcount - entries[lo][0] if lo >= 0 else None
+                hi_delta = entries[hi][0] - probe_popcount if hi < len(entries) else None
+                if hi_delta is None or (lo_delta is not None and lo_delta <= hi_delta):
+                    delta, (_, prn, size) = lo_delta, entries[lo]
+                    lo -= 1
+                else:
+                    delta, (_, prn, size) = hi_delta, entries[hi]
+                    hi += 1
+                if group_bound is not None:
+                    if delta > group_bound:
+                        break
+                    if delta > max_bits_per_byte * max(probe_size, size):
+                        continue
+                yield prn
@@ -0,0 +1,251 @@
+"""
+Headless kiosk logic: enrollment, identification and attendance on one database.
+
+A KioskService owns the Database, the matcher and the warm TemplateGallery
+that feeds it. The Tk front-end (test.py) and the HTTP daemon
+(kiosk_daemon.py) both drive one, so the scan and enrollment rules live in a
+single place. Methods block and are safe to call from worker threads.
+
+A student who taps again within the debounce window (FINGERPRINT_DEBOUNCE_SECONDS,
+default 120; 0 disables it) is matched but not recorded a second time. The
+PRNs seen in that window are also tried first when identifying, as a repeat
+tap is the most likely scan during a rush. After them come the kiosk's hot set
+(see hotset.py): the students it usually matches at this time of day.
+
+Matches carry the matcher's score, so front-ends can tell a certain match
+from a marginal one; search() lists the top K candidates for review.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from attendance import TIMESTAMP_FORMAT
+from db import DB_PATH, Database
+from gallery import DuplicateFingerprint, TemplateGallery
+from hotset import HotSet
+from matcher import create_matcher
+from metrics import (
+    CANDIDATES, COMPARISONS, DEBOUNCED_SCANS, ENROLLMENTS, MATCH_SCORES, REGISTRY, STAGE_SECONDS, ScanOutcomes,
+)
+
+ALREADY_EXISTS = "already exists"
+DEBOUNCE_SECONDS = 120.0
+
+# repeat is True when the match fell inside the debounce window; timestamp is
+# then the earlier, already recorded check-in. score is the matcher's score.
+CheckIn = namedtuple("CheckIn", "entry timestamp repeat score", defaults=(False, None))
+
+# A gallery.GalleryEntry and its matcher score
+ScoredEntry = namedtuple("ScoredEntry", "entry score")
+
+
+class RecentCheckIns:
+    """
+    Last recorded check-in per PRN, forgotten once it is older than the window.
+
+    Entries are kept oldest first, so expiry pops from the front and the
+    cache never holds more than the check-ins of one window.
+    """
+
+    def __init__(self, window=DEBOUNCE_SECONDS):
+        self.window = window
+        self._seen = OrderedDict()  # prn -> (monotonic time, timestamp)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._seen:
+            seen, _ = next(iter(self._seen.values()))
+            if now - seen < self.window:
+                return
+            self._seen.popitem(last=False)
+
+    def check_in(self, prn, record):
+        """
+        Record a check-in unless one is still inside the window.
+
+        Args:
+            record: Callable (prn) -> timestamp that writes the attendance event.
+
+        Returns:
+            (timestamp, repeat); for a repeat, the earlier timestamp and nothing is written.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            previous = self._seen.get(prn)
+            if previous is not None:
+                return previous[1], True
+            timestamp = record(prn)
+            self._seen[prn] = (now, timestamp)
+            return timestamp, False
+
+    def seed(self, check_ins):
+        """Load (prn, timestamp) pairs already in the database, e.g. after a restart."""
+        wall, now = datetime.now(), time.monotonic()
+        with self._lock:
+            for prn, timestamp in sorted(check_ins, key=lambda pair: pair[1]):
+                age = (wall - datetime.strptime(timestamp, TIMESTAMP_FORMAT)).total_seconds()
+                self._seen.pop(prn, None)
+                self._seen[prn] = (now - max(age, 0.0), timestamp)
+            self._expire(now)
+
+    def prns(self):
+        """PRNs checked in within the window, most recent first."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return list(reversed(self._seen))
+
+    def __len__(self):
+        return len(self._seen)
+
+
+def preferred_first(candidates, preferred):
+    """Move the PRNs in `preferred` that are among `candidates` to the front, in preferred order."""
+    if not preferred:
+        return candidates
+    preferred_set = set(preferred)
+    found = set()
+    rest = []
+    for prn in candidates:
+        if prn in preferred_set:
+            found.add(prn)
+        else:
+            rest.append(prn)
+    return [prn for prn in dict.fromkeys(preferred) if prn in found] + rest
+
+
+class KioskService:
+    """
+    Enrollment, identification and attendance for one database.
+
+    Args:
+        db: db.Database to read and write.
+        matcher: matcher.Matcher used for identification.
+        gallery: Loaded gallery.TemplateGallery mirroring the users table into the matcher.
+        debounce_window: Seconds during which a repeat match is not recorded again.
+            Defaults to FINGERPRINT_DEBOUNCE_SECONDS or DEBOUNCE_SECONDS.
+    """
+
+    def __init__(self, db, matcher, gallery, debounce_window=None):
+        self.db = db
+        self.matcher = matcher
+        self.gallery = gallery
+        self.outcomes = ScanOutcomes()
+        if debounce_window is None:
+            debounce_window = float(os.environ.get("FINGERPRINT_DEBOUNCE_SECONDS", DEBOUNCE_SECONDS))
+        self.recent = RecentCheckIns(debounce_window)
+        if debounce_window > 0:
+            # Check-ins made just before a restart still count
+            since = (datetime.now() - timedelta(seconds=debounce_window)).strftime(TIMESTAMP_FORMAT)
+            self.recent.seed(self.db.last_check_ins(since))
+        self.hot_set = HotSet(db.pool)
+        self.hot_set.load()
+
+    @classmethod
+    def open(cls, path=DB_PATH, backend=None, pool_size=4, gallery_dir=None):
+        """
+        Open or create a database, start the matcher and load every enrolled template.
+
+        gallery_dir defaults to FINGERPRINT_GALLERY_DIR; when set, the matcher
+        maps a gallery file kept there (see gallery_file.py).
+        """
+        db = Database(path, pool_size)
+        db.initialize()
+        matcher = create_matcher(backend)
+        gallery = TemplateGallery(db.pool, matcher, gallery_dir or os.environ.get("FINGERPRINT_GALLERY_DIR"))
+        gallery.load()
+        return cls(db, matcher, gallery)
+
+    def enroll(self, prn, name, template):
+        """
+        Enroll a user after a 1:N duplicate check against the cached gallery.
+
+        Returns:
+            ALREADY_EXISTS if the PRN is taken, otherwise None.
+
+        Raises:
+            DuplicateFingerprint: If the finger is already enrolled under another PRN.
+        """
+        with REGISTRY.timer(STAGE_SECONDS, stage="duplicate_check"):
+            self.gallery.refresh()
+            duplicate = self.gallery.find_duplicate(template)
+        if duplicate is not None:
+            REGISTRY.inc(ENROLLMENTS, result="duplicate_finger")
+            raise DuplicateFingerprint(duplicate)
+
+        # The template is kept only in the database; fingerprint_file is left empty
+        if not self.db.insert_user(prn, name, None, template):
+            REGISTRY.inc(ENROLLMENTS, result="duplicate_prn")
+            return ALREADY_EXISTS
+        REGISTRY.inc(ENROLLMENTS, result="enrolled")
+        self.gallery.refresh()
+        return None
+
+    def search(self, template, terminal=None, top_k=1):
+        """
+        Return up to top_k ScoredEntry matches for a template, best first, without recording attendance.
+
+        The matcher stops at the first certain match, so further candidates
+        are only listed when the best one is marginal.
+        """
+        # Pick up enrollments made since the last scan, then one round trip to the
+        # matcher with the pre-filtered candidates, most likely first
+        with REGISTRY.timer(STAGE_SECONDS, stage="gallery_refresh"):
+            self.gallery.refresh()
+        with REGISTRY.timer(STAGE_SECONDS, stage="candidates"):
+            preferred = self.recent.prns() + self.hot_set.ranked(terminal)
+            candidates = preferred_first(self.gallery.candidates(template), preferred)
+        REGISTRY.observe(CANDIDATES, len(candidates))
+        with REGISTRY.timer(STAGE_SECONDS, stage="identify"):
+            matches = self.matcher.search(template, candidates, top_k)
+        if self.matcher.last_comparisons is not None:
+            REGISTRY.observe(COMPARISONS, self.matcher.last_comparisons)
+        if matches:
+            REGISTRY.observe(MATCH_SCORES, matches[0].score)
+        # A PRN deleted since the gallery refresh has no entry any more
+        scored = (ScoredEntry(self.gallery.get(prn), score) for prn, score in matches)
+        return [match for match in scored if match.entry is not None]
+
+    def identify(self, template, terminal=None):
+        """Return the GalleryEntry best matching a template, or None, without recording attendance."""
+        matches = self.search(template, terminal)
+        return matches[0].entry if matches else None
+
+    def check_in(self, template, terminal=None):
+        """
+        Identify a template and record attendance for a match.
+
+        Args:
+            terminal: Optional terminal id, so retries and the hot set are tracked per kiosk.
+
+        Returns:
+            A CheckIn; entry and timestamp are None when nothing matched. A
+            match inside the debounce window writes nothing and is flagged repeat.
+        """
+        try:
+            matches = self.search(template, terminal)
+        except Exception:
+            self.outcomes.record("error", terminal)
+            raise
+        if not matches:
+            self.outcomes.record("no_match", terminal)
+            return CheckIn(None, None)
+        entry, score = matches[0]
+        self.outcomes.record("match", terminal)
+
+        # Append a single attendance event instead of rewriting the whole history,
+        # unless this student was already recorded within the debounce window
+        with REGISTRY.timer(STAGE_SECONDS, stage="record_attendance"):
+            timestamp, repeat = self.recent.check_in(entry.prn, self.db.record_attendance)
+        if repeat:
+            REGISTRY.inc(DEBOUNCED_SCANS)
+        else:
+            self.hot_set.record(entry.prn, terminal)
+        return CheckIn(entry, timestamp, repeat, score)
+
+    def close(self):
+        self.hot_set.save()
+        self.matcher.close()
+        self.db.close()
@@ -0,0 +1,533 @@
+"""
+Multi-site sync: kiosk databases ship deltas to a central store and receive gallery diffs.
+
+Each building's kiosk keeps writing its own fingerprint_data.db (its shard).
+SiteSync.push() packs the attendance events and enrollments added since the
+last push into a numbered batch. Events are selected by attendance_events.id
+and enrollments by users.template_version, so a batch costs what changed,
+not what is stored. CentralStore.merge() applies each site's batches in
+sequence and records the last one merged with the site's watermarks (the
+highest event id and template version merged) in the same transaction, so a
+batch delivered twice is skipped, and an event merged once is never merged
+again. A batch that skips a sequence number means an earlier one was lost;
+it is dropped, and once nothing is outstanding the site rewinds to the
+acknowledged sequence and watermarks and resends.
+
+CentralStore.publish() writes the users changed since its last publish as a
+gallery diff, and SiteSync.pull() applies the diffs past its version and
+refreshes the running gallery. When too many diffs accumulate, publish()
+writes a full snapshot and keeps only the newest diffs, so a site that has
+been offline for long pays for one snapshot rather than every diff.
+
+A PRN enrolled with different templates at two sites ends up with the one
+merged last. Users are never deleted by sync.
+
+Sites and the central store exchange files through a DirectoryTransport:
+
+    <remote>/sites/<site>/batches/<sequence>.batch    site -> central
+    <remote>/sites/<site>/ack.json                      central -> site
+    <remote>/gallery/<from>-<to>.diff                   central -> sites
+
+The remote can be a network share or, for tests, a local directory.
+
+    python sync.py site --db fingerprint_data.db --site north --remote /mnt/sync
+    python sync.py central --db central.db --remote /mnt/sync [--interval 60]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+from attendance import TIMESTAMP_FORMAT, insert_attendance_events
+from fir import template_key
+from metrics import DB_QUERY_SECONDS, REGISTRY, SYNC_BYTES
+
+MAGIC = b"FPSY"
+FORMAT_VERSION = 1
+# magic, format, compressed header length; the header is zlib-compressed JSON
+# and the templates it lists follow it uncompressed, back to back
+PACKET_HEADER = struct.Struct("<4sHI")
+
+SITE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Inserts a user or, when the row differs, replaces it with a new template_version
+# so gallery refresh picks it up; identical rows are left untouched
+UPSERT_USER = (
+    "INSERT INTO users (prn, name, fingerprint_data, isadmin, template_version, template_key) "
+    "VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(template_version), 0) + 1 FROM users), ?) "
+    "ON CONFLICT (prn) DO UPDATE SET name = excluded.name, fingerprint_data = excluded.fingerprint_data, "
+    "isadmin = excluded.isadmin, template_version = excluded.template_version, "
+    "template_key = excluded.template_key "
+    "WHERE fingerprint_data IS NOT excluded.fingerprint_data OR name IS NOT excluded.name "
+    "OR isadmin IS NOT excluded.isadmin"
+)
+
+
+class SyncError(Exception):
+    """Raised for a malformed batch or diff, or an invalid site id."""
+
+
+def create_sync_schema(conn):
+    """Create the sync_state (either side) and sync_sites (central store) tables if missing."""
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_sites (
+            site TEXT PRIMARY KEY,
+            sequence INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            last_merge TEXT NOT NULL
+        )
+    ''')
+
+
+def _get_state(conn, name, default=0):
+    row = conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return default if row is None else row[0]
+
+
+def _set_state(conn, name, value):
+    conn.execute(
+        "INSERT INTO sync_state (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+        (name, value)
+    )
+
+
+def acknowledged_events(conn):
+    """
+    Highest attendance event id the central store has acknowledged from this site.
+
+    Returns None when this database has never pushed, so nothing waits on the
+    central store. Events above the id may still have to be resent.
+    """
+    return _get_state(conn, "acknowledged_events", None)
+
+
+def pack_packet(header, templates):
+    """Serialize a header dict and the templates it refers to by position."""
+    compressed = zlib.compress(json.dumps(header, separators=(",", ":")).encode("utf-8"))
+    return b"".join([PACKET_HEADER.pack(MAGIC, FORMAT_VERSION, len(compressed)), compressed, *templates])
+
+
+def unpack_packet(data):
+    """Inverse of pack_packet: (header, templates) for a header with a "users" list of [..., template length]."""
+    if len(data) < PACKET_HEADER.size:
+        raise SyncError("Sync packet is truncated.")
+    magic, fmt, length = PACKET_HEADER.unpack_from(data)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise SyncError("Not a sync packet, or an unsupported format version.")
+    offset = PACKET_HEADER.size + length
+    try:
+        header = json.loads(zlib.decompress(data[PACKET_HEADER.size:offset]))
+    except (zlib.error, ValueError) as e:
+        raise SyncError(f"Malformed sync packet header: {e}") from None
+    templates = []
+    for user in header.get("users", []):
+        templates.append(data[offset:offset + user[-1]])
+        offset += user[-1]
+    if offset != len(data):
+        raise SyncError("Sync packet length does not match its header.")
+    return header, templates
+
+
+def _user_rows(header, templates):
+    # (prn, name, template, isadmin, key) in UPSERT_USER order
+    return [
+        (prn, name, template, isadmin, template_key(template))
+        for (prn, name, isadmin, _), template in zip(header["users"], templates)
+    ]
+
+
+def _fetch_users(conn, since):
+    rows = conn.execute(
+        "SELECT prn, name, isadmin, fingerprint_data, template_version FROM users "
+        "WHERE fingerprint_data IS NOT NULL AND template_version > ? ORDER BY template_version",
+        (since,)
+    ).fetchall()
+    users = [[prn, name, isadmin, len(template)] for prn, name, isadmin, template, _ in rows]
+    return users, [row[3] for row in rows], max((row[4] for row in rows), default=since)
+
+
+class DirectoryTransport:
+    """
+    Batches, acknowledgements and gallery diffs as files under one directory.
+
+    Every file is written under a temporary name and renamed into place, so a
+    reader never sees a partial file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _site_dir(self, site):
+        if not SITE_ID.match(site):
+            raise SyncError(f"Invalid site id {site!r}; use letters, digits, '-' and '_'.")
+        return os.path.join(self.root, "sites", site)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".partial", "wb") as file:
+            file.write(data)
+        os.replace(path + ".partial", path)
+
+    def _read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def put_batch(self, site, sequence, data):
+        self._write(os.path.join(self._site_dir(site), "batches", f"{sequence:012d}.batch"), data)
+
+    def batches(self, site=None):
+        """(site, sequence) pairs waiting to be merged, in order."""
+        if site is not None:
+            sites = [site]
+        else:
+            try:
+                sites = os.listdir(os.path.join(self.root, "sites"))
+            except FileNotFoundError:
+                return []
+        pending = []
+        for name in sites:
+            try:
+                files = os.listdir(os.path.join(self._site_dir(name), "batches"))
+            except FileNotFoundError:
+                continue
+            pending.extend((name, int(file[:-6])) for file in files if file.endswith(".batch"))
+        return sorted(pending)
+
+    def read_batch(self, site, sequence):
+        return self._read(os.path.join(self._site_dir(site), "batches", f"{sequence:012d}.batch"))
+
+    def remove_batch(self, site, sequence):
+        os.remove(os.path.join(self._site_dir(site), "batches", f"{sequence:012d}.batch"))
+
+    def put_ack(self, site, ack):
+        self._write(os.path.join(self._site_dir(site), "ack.json"), json.dumps(ack).encode("utf-8"))
+
+    def read_ack(self, site):
+        """The central store's watermarks for this site, or None before its first merge."""
+        try:
+            return json.loads(self._read(os.path.join(self._site_dir(site), "ack.json")))
+        except FileNotFoundError:
+            return None
+
+    def put_diff(self, start, end, data):
+        self._write(os.path.join(self.root, "gallery", f"{start:012d}-{end:012d}.diff"), data)
+
+    def diffs(self):
+        """(from, to) version ranges of the published gallery diffs."""
+        try:
+            files = os.listdir(os.path.join(self.root, "gallery"))
+        except FileNotFoundError:
+            return []
+        return sorted(tuple(int(part) for part in file[:-5].split("-")) for file in files if file.endswith(".diff"))
+
+    def read_diff(self, start, end):
+        return self._read(os.path.join(self.root, "gallery", f"{start:012d}-{end:012d}.diff"))
+
+    def remove_diff(self, start, end):
+        os.remove(os.path.join(self.root, "gallery", f"{start:012d}-{end:012d}.diff"))
+
+
+class SiteSync:
+    """
+    A kiosk's side of sync.
+
+    Args:
+        db: db.Database of this site.
+        transport: DirectoryTransport (or any object with the same methods).
+        site: This site's id.
+        gallery: Optional gallery.TemplateGallery refreshed after users arrive.
+        max_events: Events per batch.
+    """
+
+    def __init__(self, db, transport, site, gallery=None, max_events=50000):
+        if not SITE_ID.match(site):
+            raise SyncError(f"Invalid site id {site!r}; use letters, digits, '-' and '_'.")
+        self.db = db
+        self.transport = transport
+        self.site = site
+        self.gallery = gallery
+        self.max_events = max_events
+        self._lock = threading.Lock()
+
+    def push(self):
+        """Ship the events and enrollments added since the last push; returns counts."""
+        stats = {"batches": 0, "events": 0, "users": 0, "bytes": 0}
+        self.db.attendance_writer.flush()
+        with self._lock:
+            # With nothing outstanding, the acknowledgement is what the central store
+            # holds. If it is not our last batch, one was lost or dropped: resend
+            # from there (resent rows the central store already has are skipped)
+            if not self.transport.batches(self.site):
+                ack = self.transport.read_ack(self.site) or {"sequence": 0, "events": 0, "users": 0}
+                with self.db.pool.transaction() as conn:
+                    _set_state(conn, "acknowledged_events", ack["events"])
+                    if _get_state(conn, "batch_sequence") != ack["sequence"]:
+                        _set_state(conn, "batch_sequence", ack["sequence"])
+                        _set_state(conn, "shipped_events", ack["events"])
+                        _set_state(conn, "shipped_users", ack["users"])
+
+            while True:
+                with REGISTRY.timer(DB_QUERY_SECONDS, query="sync_push"), self.db.pool.connection() as conn:
+                    events_since = _get_state(conn, "shipped_events")
+                    users_since = _get_state(conn, "shipped_users")
+                    sequence = _get_state(conn, "batch_sequence") + 1
+                    events = conn.execute(
+                        "SELECT id, prn, ts FROM attendance_events WHERE id > ? ORDER BY id LIMIT ?",
+                        (events_since, self.max_events)
+                    ).fetchall()
+                    users, templates, users_until = _fetch_users(conn, users_since)
+                if not events and not users:
+                    return stats
+                header = {
+                    "site": self.site,
+                    "sequence": sequence,
+                    "events_since": events_since,
+                    "events_until": events[-1][0] if events else events_since,
+                    "users_since": users_since,
+                    "users_until": users_until,
+                    "users": users,
+                    "events": [list(event) for event in events],
+                }
+                data = pack_packet(header, templates)
+                self.transport.put_batch(self.site, sequence, data)
+                with self.db.pool.transaction() as conn:
+                    _set_state(conn, "shipped_events", header["events_until"])
+                    _set_state(conn, "shipped_users", users_until)
+                    _set_state(conn, "batch_sequence", sequence)
+                REGISTRY.inc(SYNC_BYTES, len(data), direction="push")
+                stats["batches"] += 1
+                stats["events"] += len(events)
+                stats["users"] += len(users)
+                stats["bytes"] += len(data)
+                if len(events) < self.max_events:
+                    return stats
+
+    def pull(self):
+        """Apply the gallery diffs published since this site's version; returns counts."""
+        stats = {"diffs": 0, "users": 0, "bytes": 0}
+        with self._lock:
+            with self.db.pool.connection() as conn:
+                version = _get_state(conn, "gallery_version")
+            while True:
+                # The most incremental diff that starts at or before our version
+                usable = [(start, end) for start, end in self.transport.diffs() if start <= version < end]
+                if not usable:
+                    break
+                start, end = max(usable)
+                data = self.transport.read_diff(start, end)
+                header, templates = unpack_packet(data)
+                with REGISTRY.timer(DB_QUERY_SECONDS, query="sync_pull"), self.db.pool.transaction() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    latest = conn.execute("SELECT COALESCE(MAX(template_version), 0) FROM users").fetchone()[0]
+                    changes = conn.total_changes
+                    conn.executemany(UPSERT_USER, _user_rows(header, templates))
+                    stats["users"] += conn.total_changes - changes
+                    # Rows written here came from the central store; unless local
+                    # enrollments are still waiting to be pushed, do not echo them back
+                    if _get_state(conn, "shipped_users") >= latest:
+                        _set_state(
+                            conn, "shipped_users",
+                            conn.execute("SELECT COALESCE(MAX(template_version), 0) FROM users").fetchone()[0]
+                        )
+                    _set_state(conn, "gallery_version", end)
+                version = end
+                REGISTRY.inc(SYNC_BYTES, len(data), direction="pull")
+                stats["diffs"] += 1
+                stats["bytes"] += len(data)
+        if stats["users"] and self.gallery is not None:
+            self.gallery.refresh()
+        return stats
+
+    def sync(self):
+        """push() then pull(); returns both counts."""
+        return {"push": self.push(), "pull": self.pull()}
+
+
+class CentralStore:
+    """
+    The central store's side of sync.
+
+    Args:
+        db: db.Database of the central store.
+        transport: DirectoryTransport shared with the sites.
+        max_diffs: Published diffs kept before a full snapshot replaces the older ones.
+    """
+
+    def __init__(self, db, transport, max_diffs=32):
+        self.db = db
+        self.transport = transport
+        self.max_diffs = max_diffs
+        self._lock = threading.Lock()
+
+    def _merge_batch(self, conn, site, header, templates, stats):
+        # Returns the acknowledgement for the site after this batch
+        row = conn.execute("SELECT sequence, events, users FROM sync_sites WHERE site = ?", (site,)).fetchone()
+        sequence, events_mark, users_mark = row if row is not None else (0, 0, 0)
+        if header["sequence"] != sequence + 1:
+            # Already merged, or an earlier batch is missing
+            stats["stale" if header["sequence"] <= sequence else "dropped"] += 1
+            return {"sequence": sequence, "events": events_mark, "users": users_mark}
+
+        changes = conn.total_changes
+        conn.executemany(UPSERT_USER, _user_rows(header, templates))
+        stats["users"] += conn.total_changes - changes
+        events = [(prn, ts) for event_id, prn, ts in header["events"] if event_id > events_mark]
+        if events:
+            insert_attendance_events(conn, events)
+        stats["events"] += len(events)
+        stats["duplicates"] += len(header["events"]) - len(events)
+
+        ack = {
+            "sequence": header["sequence"],
+            "events": max(events_mark, header["events_until"]),
+            "users": header["users_until"],
+        }
+        conn.execute(
+            "INSERT INTO sync_sites (site, sequence, events, users, last_merge) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (site) DO UPDATE SET sequence = excluded.sequence, events = excluded.events, "
+            "users = excluded.users, last_merge = excluded.last_merge",
+            (site, ack["sequence"], ack["events"], ack["users"], datetime.now().strftime(TIMESTAMP_FORMAT))
+        )
+        stats["batches"] += 1
+        return ack
+
+    def merge(self):
+        """Apply every waiting batch, oldest first per site; returns counts."""
+        stats = {"batches": 0, "events": 0, "duplicates": 0, "users": 0, "stale": 0, "dropped": 0, "bytes": 0}
+        with self._lock:
+            for site, sequence in self.transport.batches():
+                data = self.transport.read_batch(site, sequence)
+                header, templates = unpack_packet(data)
+                if header.get("site") != site:
+                    raise SyncError(f"Batch {sequence} in {site}'s directory is from site {header.get('site')!r}.")
+                with REGISTRY.timer(DB_QUERY_SECONDS, query="sync_merge"), self.db.pool.transaction() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    ack = self._merge_batch(conn, site, header, templates, stats)
+                # Acknowledged before the batch is removed, so the site never finds
+                # both missing; a crash in between only makes the batch stale next time
+                self.transport.put_ack(site, ack)
+                self.transport.remove_batch(site, sequence)
+                REGISTRY.inc(SYNC_BYTES, len(data), direction="merge")
+                stats["bytes"] += len(data)
+        return stats
+
+    def publish(self):
+        """Write the users changed since the last publish as a gallery diff; returns counts."""
+        stats = {"users": 0, "bytes": 0, "snapshot": False}
+        with self._lock:
+            with REGISTRY.timer(DB_QUERY_SECONDS, query="sync_publish"), self.db.pool.connection() as conn:
+                published = _get_state(conn, "published_version")
+                users, templates, version = _fetch_users(conn, published)
+            if not users:
+                return stats
+            data = pack_packet({"from": published, "to": version, "users": users}, templates)
+            self.transport.put_diff(published, version, data)
+            with self.db.pool.transaction() as conn:
+                _set_state(conn, "published_version", version)
+            stats["users"] = len(users)
+            stats["bytes"] = len(data)
+
+            diffs = [diff for diff in self.transport.diffs() if diff[0] > 0]
+            if len(diffs) > self.max_diffs:
+                stats["snapshot"] = True
+                stats["bytes"] += self._compact(diffs, version)
+        REGISTRY.inc(SYNC_BYTES, stats["bytes"], direction="publish")
+        return stats
+
+    def _compact(self, diffs, version):
+        # The snapshot goes in before anything is removed, so every version
+        # always has a way forward
+        with self.db.pool.connection() as conn:
+            users, templates, _ = _fetch_users(conn, 0)
+        data = pack_packet({"from": 0, "to": version, "users": users}, templates)
+        self.transport.put_diff(0, version, data)
+        keep_from = diffs[-(self.max_diffs // 2 or 1)][0]
+        for start, end in self.transport.diffs():
+            if (start, end) != (0, version) and start < keep_from:
+                self.transport.remove_diff(start, end)
+        return len(data)
+
+    def sites(self):
+        """(site, last batch merged, events watermark, users watermark, last merge) per site."""
+        with self.db.pool.connection() as conn:
+            return conn.execute("SELECT site, sequence, events, users, last_merge FROM sync_sites ORDER BY site").fetchall()
+
+    def sync(self):
+        """merge() then publish(); returns both counts."""
+        return {"merge": self.merge(), "publish": self.publish()}
+
+
+def start_periodic_sync(syncer, interval=60.0):
+    """Call syncer.sync() every `interval` seconds from a daemon thread; returns its stop event."""
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                syncer.sync()
+            except (OSError, sqlite3.Error, SyncError) as e:
+                print(f"Sync failed: {e}")
+
+    threading.Thread(target=run, name="sync", daemon=True).start()
+    return stopped
+
+
+def start_site_sync(db, gallery=None):
+    """
+    Start periodic sync for this kiosk if FINGERPRINT_SYNC_DIR and FINGERPRINT_SITE_ID are set.
+
+    FINGERPRINT_SYNC_INTERVAL sets the seconds between syncs (default 60).
+
+    Returns:
+        The stop event, or None when sync is not configured.
+    """
+    remote = os.environ.get("FINGERPRINT_SYNC_DIR")
+    site = os.environ.get("FINGERPRINT_SITE_ID")
+    if not remote or not site:
+        return None
+    syncer = SiteSync(db, DirectoryTransport(remote), site, gallery)
+    return start_periodic_sync(syncer, float(os.environ.get("FINGERPRINT_SYNC_INTERVAL", "60")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync kiosk databases with a central store.")
+    parser.add_argument("role", choices=("site", "central"), help="which side of sync to run")
+    parser.add_argument("--db", required=True, help="database file of this site or of the central store")
+    parser.add_argument("--remote", required=True, help="directory shared between the sites and the central store")
+    parser.add_argument("--site", help="this site's id (site role only)")
+    parser.add_argument("--interval", type=float, help="keep syncing every INTERVAL seconds instead of once")
+    args = parser.parse_args(argv)
+    if args.role == "site" and not args.site:
+        parser.error("--site is required for the site role")
+    if args.role == "site" and not SITE_ID.match(args.site):
+        parser.error(f"invalid site id {args.site!r}; use letters, digits, '-' and '_'")
+
+    from db import Database  # db imports create_sync_schema from here
+
+    db = Database(args.db, pool_size=1)
+    try:
+        db.initialize()
+        transport = DirectoryTransport(args.remote)
+        syncer = SiteSync(db, transport, args.site) if args.role == "site" else CentralStore(db, transport)
+        if args.interval is None:
+            print(json.dumps(syncer.sync()))
+            return 0
+        stopped = start_periodic_sync(syncer, args.interval)
+        try:
+            stopped.wait()
+        except KeyboardInterrupt:
+            stopped.set()
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+"""
+Background task executor for scanner work in the Tk UI.
+
+Capture and verification run on one worker thread that owns the scanner, so the
+device is never driven by two threads at once. Tasks wait in a bounded queue,
+and a second submission of a task that is already queued or running is
+rejected, which absorbs double-clicks. Results and errors are handed back to
+the Tk main thread through a queue polled with root.after, so callbacks may
+touch widgets and show message boxes.
+"""
+import queue
+import threading
+import time
+
+
+class TaskRejected(Exception):
+    """Raised by submit() when a task is already pending or the queue is full."""
+
+
+class TaskTimeout(Exception):
+    """Passed to on_error when a task runs longer than its timeout."""
+
+
+class _Task:
+    def __init__(self, name, func, args, on_success, on_error, timeout):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.on_success = on_success
+        self.on_error = on_error
+        self.timeout = timeout
+        self.started = None
+        self.abandoned = False
+
+
+class TaskExecutor:
+    """
+    Single-worker task queue whose callbacks run on the Tk thread.
+
+    Args:
+        root: The Tk root window used to schedule result polling.
+        max_pending: Maximum number of tasks waiting behind the running one.
+        poll_interval: Milliseconds between checks for finished tasks.
+        worker_name: Name of the worker thread.
+    """
+
+    def __init__(self, root, max_pending=2, poll_interval=50, worker_name="scanner-worker"):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._results = queue.Queue()
+        self._active = set()
+        self._current = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=worker_name, daemon=True)
+        self._worker.start()
+        self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, name, func, *args, on_success=None, on_error=None, timeout=None):
+        """
+        Queue func(*args) on the scanner worker.
+
+        Args:
+            name: Task name; a second task with the same name is rejected until
+                the first finishes.
+            on_success: Called on the Tk thread with the task's return value.
+            on_error: Called on the Tk thread with the raised exception, or with
+                TaskTimeout once the task exceeds `timeout` seconds.
+
+        Raises:
+            TaskRejected: If the task is already pending or the queue is full.
+        """
+        task = _Task(name, func, args, on_success, on_error, timeout)
+        with self._lock:
+            if self._stopped.is_set():
+                raise TaskRejected("The scanner is shutting down.")
+            if name in self._active:
+                raise TaskRejected(f"{name} is already in progress.")
+            try:
+                self._pending.put_nowait(task)
+            except queue.Full:
+                raise TaskRejected("The scanner is busy, please wait.") from None
+            self._active.add(name)
+
+    def is_active(self, name):
+        """Whether a task with this name is queued or running."""
+        with self._lock:
+            return name in self._active
+
+    def _run(self):
+        while True:
+            task = self._pending.get()
+            if task is None:
+                return
+            task.started = time.monotonic()
+            self._current = task
+            try:
+                self._results.put((task, True, task.func(*task.args)))
+            except Exception as e:
+                self._results.put((task, False, e))
+            finally:
+                self._current = None
+            # shutdown() could not queue its sentinel behind a full queue
+            if self._stopped.is_set() and self._pending.empty():
+                return
+
+    def _finish(self, task, callback, value):
+        with self._lock:
+            self._active.discard(task.name)
+        if callback is not None:
+            callback(value)
+
+    def _poll(self):
+        try:
+            current = self._current
+            if (current is not None and current.timeout is not None and not current.abandoned
+                    and time.monotonic() - current.started > current.timeout):
+                # The worker cannot be interrupted; report the timeout now and drop the late result
+                current.abandoned = True
+                self._finish(current, current.on_error, TaskTimeout(f"{current.name} timed out."))
+
+            while True:
+                try:
+                    task, succeeded, value = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if task.abandoned:
+                    continue
+                self._finish(task, task.on_success if succeeded else task.on_error, value)
+        finally:
+            self.root.after(self.poll_interval, self._poll)
+
+    def shutdown(self):
+        """
+        Stop the worker after the tasks already queued have run.
+
+        Never blocks, so exiting does not wait on a task that was abandoned
+        after timing out; the worker is a daemon thread.
+        """
+        self._stopped.set()
+        try:
+            self._pending.put_nowait(None)
+        except queue.Full:
+            pass  # The worker stops once it has drained the queue
+
+    def join(self, timeout=None):
+        """Wait up to `timeout` seconds for the worker to stop after shutdown(); returns whether it has."""
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
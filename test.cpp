@@ -1,10 +1,30 @@
 #include <iostream>
-#include <fstream>
-#include <ctime>
+#include <cstdio>
 #include <cstdlib>
+#include <cstring>
+#include <string>
+#include <vector>
+#include <fcntl.h>
+#include <io.h>
 #include <windows.h>
 #include "NBioAPI.h"
 
+// Captures one fingerprint and writes it to stdout as a u32 little-endian
+// length followed by the serialized FIR (Format, Header, Data). Progress
+// messages go to stderr, so stdout carries only the template.
+//
+// With --serve, the SDK is initialized and the device opened once, and
+// captures are requested over stdin/stdout with the matcher's framing
+// (1 byte opcode, u32 little-endian payload length, payload; see capture.py):
+//     'S' capture, payload = optional u32 timeout in milliseconds
+//         -> 'T' serialized FIR, 'N' no finger within the timeout, 'E' message
+//     'Q' quit
+// 'K' is sent once the device is open, or 'E' if it cannot be opened.
+
+typedef std::vector<unsigned char> Buffer;
+
+const NBioAPI_SINT32 DEFAULT_TIMEOUT_MS = 5000;
+
 void cleanup(NBioAPI_HANDLE handle, NBioAPI_FIR_HANDLE capturedFIR, NBioAPI_DEVICE_ID deviceID) {
     if (capturedFIR) {
         NBioAPI_FreeFIRHandle(handle, capturedFIR);
@@ -15,92 +35,179 @@ void cleanup(NBioAPI_HANDLE handle, NBioAPI_FIR_HANDLE capturedFIR, NBioAPI_DEVI
     if (handle) {
         NBioAPI_Terminate(handle);
     }
-    std::cout << "Resources cleaned up successfully." << std::endl;
+    std::clog << "Resources cleaned up successfully." << std::endl;
 }
 
-int main() {
-    NBioAPI_HANDLE handle = 0;
-    NBioAPI_FIR_HANDLE capturedFIR = 0;
-    NBioAPI_DEVICE_ID deviceID = 0;
-    NBioAPI_RETURN ret;
-
-    std::cout << "Initializing the device..." << std::endl;
-
-    // Initialize NBioAPI
-    ret = NBioAPI_Init(&handle);
+// Initialize NBioAPI and open the first available device
+bool OpenScanner(NBioAPI_HANDLE& handle, NBioAPI_DEVICE_ID& deviceID, std::string& error) {
+    std::clog << "Initializing the device..." << std::endl;
+    NBioAPI_RETURN ret = NBioAPI_Init(&handle);
     if (ret != NBioAPIERROR_NONE) {
-        std::cerr << "Failed to initialize: Error code " << ret << std::endl;
-        return -1;
+        handle = 0;
+        error = "Failed to initialize: Error code " + std::to_string(ret);
+        return false;
     }
-    std::cout << "Device initialized successfully!" << std::endl;
+    std::clog << "Device initialized successfully!" << std::endl;
 
-    // Enumerate and open the first available device
     NBioAPI_UINT32 numDevices = 0;
     NBioAPI_DEVICE_ID* deviceList = nullptr;
     ret = NBioAPI_EnumerateDevice(handle, &numDevices, &deviceList);
     if (ret != NBioAPIERROR_NONE || numDevices == 0) {
-        std::cerr << "No devices found! Error code: " << ret << std::endl;
-        cleanup(handle, capturedFIR, deviceID);
-        return -1;
+        error = "No devices found! Error code: " + std::to_string(ret);
+        return false;
     }
-    deviceID = deviceList[0];
-    ret = NBioAPI_OpenDevice(handle, deviceID);
+    ret = NBioAPI_OpenDevice(handle, deviceList[0]);
     if (ret != NBioAPIERROR_NONE) {
-        std::cerr << "Failed to open device! Error code: " << ret << std::endl;
-        cleanup(handle, capturedFIR, deviceID);
-        return -1;
+        error = "Failed to open device! Error code: " + std::to_string(ret);
+        return false;
     }
+    deviceID = deviceList[0];
+    return true;
+}
 
+// Capture one fingerprint as a serialized FIR. Returns NBioAPIERROR_NONE,
+// NBioAPIERROR_CAPTURE_TIMEOUT when no finger was placed, or another error
+// code with `error` set.
+NBioAPI_RETURN CaptureFIR(NBioAPI_HANDLE handle, NBioAPI_SINT32 timeout, Buffer& serialized, std::string& error) {
     // Set capture window options
     NBioAPI_WINDOW_OPTION windowOption = { 0 };
     windowOption.Length = sizeof(NBioAPI_WINDOW_OPTION);
     windowOption.WindowStyle = NBioAPI_WINDOW_STYLE_INVISIBLE;
 
-    // Capture fingerprint
-    ret = NBioAPI_Capture(handle, NBioAPI_FIR_PURPOSE_VERIFY, &capturedFIR, 5000, nullptr, &windowOption);
+    NBioAPI_FIR_HANDLE capturedFIR = 0;
+    NBioAPI_RETURN ret = NBioAPI_Capture(handle, NBioAPI_FIR_PURPOSE_VERIFY, &capturedFIR, timeout, nullptr, &windowOption);
     if (ret != NBioAPIERROR_NONE || capturedFIR == 0) {
-        std::cerr << "Failed to capture fingerprint. Error code: " << ret << std::endl;
-        cleanup(handle, capturedFIR, deviceID);
-        return -1;
+        if (capturedFIR) {
+            NBioAPI_FreeFIRHandle(handle, capturedFIR);
+        }
+        error = "Failed to capture fingerprint. Error code: " + std::to_string(ret);
+        return ret != NBioAPIERROR_NONE ? ret : NBioAPIERROR_FUNCTION_FAIL;
     }
-    std::cout << "Fingerprint captured successfully!" << std::endl;
 
-    // Retrieve FIR
     NBioAPI_FIR fir;
     ret = NBioAPI_GetFIRFromHandle(handle, capturedFIR, &fir);
+    NBioAPI_FreeFIRHandle(handle, capturedFIR);
     if (ret != NBioAPIERROR_NONE || fir.Data == nullptr) {
-        std::cerr << "Failed to retrieve FIR. Error code: " << ret << std::endl;
-        cleanup(handle, capturedFIR, deviceID);
+        error = "Failed to retrieve FIR. Error code: " + std::to_string(ret);
+        return ret != NBioAPIERROR_NONE ? ret : NBioAPIERROR_FUNCTION_FAIL;
+    }
+
+    serialized.resize(sizeof(fir.Format) + fir.Header.Length + fir.Header.DataLength);
+    memcpy(serialized.data(), &fir.Format, sizeof(fir.Format));
+    memcpy(serialized.data() + sizeof(fir.Format), &fir.Header, fir.Header.Length);
+    memcpy(serialized.data() + sizeof(fir.Format) + fir.Header.Length, fir.Data, fir.Header.DataLength);
+    NBioAPI_FreeFIR(handle, &fir);
+    return NBioAPIERROR_NONE;
+}
+
+bool ReadExact(void* dest, size_t size) {
+    return size == 0 || fread(dest, 1, size, stdin) == size;
+}
+
+void WriteFrame(char op, const void* payload, NBioAPI_UINT32 length) {
+    fwrite(&op, 1, 1, stdout);
+    fwrite(&length, sizeof(length), 1, stdout);
+    if (length > 0) {
+        fwrite(payload, 1, length, stdout);
+    }
+    fflush(stdout);
+}
+
+void WriteMessage(char op, const std::string& message) {
+    WriteFrame(op, message.data(), static_cast<NBioAPI_UINT32>(message.size()));
+}
+
+// Keep the device open and capture on request until 'Q' or end of input
+int Serve() {
+    _setmode(_fileno(stdin), _O_BINARY);
+    _setmode(_fileno(stdout), _O_BINARY);
+
+    NBioAPI_HANDLE handle = 0;
+    NBioAPI_DEVICE_ID deviceID = 0;
+    std::string error;
+    if (!OpenScanner(handle, deviceID, error)) {
+        std::cerr << error << std::endl;
+        WriteMessage('E', error);
+        cleanup(handle, 0, deviceID);
         return -1;
     }
+    WriteFrame('K', nullptr, 0);
 
-    // Save FIR data
-    time_t now = time(nullptr);
-    char timestamp[20];
-    strftime(timestamp, sizeof(timestamp), "%Y%m%d_%H%M%S", localtime(&now));
-    std::string filename = "fingerprint.fir";
+    char op = 0;
+    NBioAPI_UINT32 length = 0;
+    while (ReadExact(&op, 1) && ReadExact(&length, sizeof(length))) {
+        Buffer payload(length);
+        if (!ReadExact(payload.data(), length)) {
+            break;
+        }
+        if (op == 'Q') {
+            break;
+        } else if (op != 'S') {
+            WriteMessage('E', "Unknown opcode.");
+            continue;
+        }
 
-    std::ofstream outFile(filename, std::ios::binary);
-    if (outFile.is_open()) {
-        DWORD firLength = sizeof(fir.Format) + fir.Header.Length + fir.Header.DataLength;
-        BYTE* binaryStream = new BYTE[firLength];
+        NBioAPI_SINT32 timeout = DEFAULT_TIMEOUT_MS;
+        if (payload.size() >= sizeof(NBioAPI_UINT32)) {
+            NBioAPI_UINT32 requested = 0;
+            memcpy(&requested, payload.data(), sizeof(requested));
+            timeout = static_cast<NBioAPI_SINT32>(requested);
+        }
+        Buffer serialized;
+        NBioAPI_RETURN ret = CaptureFIR(handle, timeout, serialized, error);
+        if (ret == NBioAPIERROR_NONE) {
+            WriteFrame('T', serialized.data(), static_cast<NBioAPI_UINT32>(serialized.size()));
+        } else if (ret == NBioAPIERROR_CAPTURE_TIMEOUT) {
+            WriteFrame('N', nullptr, 0);
+        } else {
+            WriteMessage('E', error);
+        }
+    }
 
-        memcpy(binaryStream, &fir.Format, sizeof(fir.Format));
-        memcpy(binaryStream + sizeof(fir.Format), &fir.Header, fir.Header.Length);
-        memcpy(binaryStream + sizeof(fir.Format) + fir.Header.Length, fir.Data, fir.Header.DataLength);
+    cleanup(handle, 0, deviceID);
+    return 0;
+}
 
-        outFile.write(reinterpret_cast<char*>(binaryStream), firLength);
-        outFile.close();
-        delete[] binaryStream;
+int main(int argc, char* argv[]) {
+    if (argc > 1 && strcmp(argv[1], "--serve") == 0) {
+        return Serve();
+    }
 
-        std::cout << "Fingerprint data saved to " << filename << std::endl;
-    } else {
-        std::cerr << "Failed to save fingerprint data to file!" << std::endl;
+    NBioAPI_HANDLE handle = 0;
+    NBioAPI_DEVICE_ID deviceID = 0;
+    std::string error;
+    if (!OpenScanner(handle, deviceID, error)) {
+        std::cerr << error << std::endl;
+        cleanup(handle, 0, deviceID);
+        return -1;
+    }
+
+    // Capture fingerprint
+    Buffer serialized;
+    if (CaptureFIR(handle, DEFAULT_TIMEOUT_MS, serialized, error) != NBioAPIERROR_NONE) {
+        std::cerr << error << std::endl;
+        cleanup(handle, 0, deviceID);
+        return -1;
+    }
+    std::clog << "Fingerprint captured successfully!" << std::endl;
+
+    // Send the FIR to the caller
+    DWORD firLength = static_cast<DWORD>(serialized.size());
+    _setmode(_fileno(stdout), _O_BINARY);
+    bool sent = fwrite(&firLength, sizeof(firLength), 1, stdout) == 1
+        && fwrite(serialized.data(), 1, firLength, stdout) == firLength
+        && fflush(stdout) == 0;
+
+    if (!sent) {
+        std::cerr << "Failed to write fingerprint data to stdout!" << std::endl;
+        cleanup(handle, 0, deviceID);
+        return -1;
     }
+    std::clog << "Fingerprint data sent (" << firLength << " bytes)." << std::endl;
 
     // Cleanup and exit
-    cleanup(handle, capturedFIR, deviceID);
+    cleanup(handle, 0, deviceID);
 
-    std::cout << "Program completed. Exiting now..." << std::endl;
+    std::clog << "Program completed. Exiting now..." << std::endl;
     return 0;
 }
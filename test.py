@@ -1,91 +1,173 @@
+import time
+STARTUP_TIME = time.perf_counter()  # Taken before the heavy imports, for the startup timing below
+
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
 import subprocess
 import threading
+import queue
+import random
+import logging
 from datetime import datetime
-import sqlite3
 import os
-import json
 from tkinter import filedialog
-import csv
 from PIL import Image, ImageTk
+from matcher import MatcherError, create_matcher
+from capture import FINGER_TIMEOUT, CaptureError, CapturePipeline, create_capture_device
+from gallery import DuplicateFingerprint, TemplateGallery
+from service import ALREADY_EXISTS, KioskService
+from tasks import TaskExecutor, TaskRejected, TaskTimeout
+from db import Database
+from export import ExportCancelled, export_attendance
+from metrics import GALLERY_TEMPLATES, REGISTRY, STAGE_SECONDS, profiled, start_exporters
+from sync import start_site_sync
+from archive import start_retention
+
+logger = logging.getLogger("kiosk")
+
+# Shared data access layer, long-lived 1:N matcher and the in-memory template
+# gallery that feeds it, all started once in main() and driven through service
+db = None
+matcher = None
+gallery = None
+service = None
+
+# Scanner shared by single scans and continuous attendance, and the running
+# continuous attendance pipeline, if any
+capture_device = None
+pipeline = None
+
+# Single worker that owns the scanner; capture and verification run on it.
+# Long-running jobs such as exports get their own worker so scans never queue behind them.
+tasks = None
+background_tasks = None
+
+# Seconds before a scanner task is reported to the user as timed out
+TASK_TIMEOUT = 45
+
+# Rows per page in the attendance results window
+RECORDS_PAGE_SIZE = 200
 
 def initialize_database():
-    """Initialize the SQLite database and create the necessary table."""
-    conn = sqlite3.connect("fingerprint_data.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            prn TEXT PRIMARY KEY,
-            name TEXT,
-            fingerprint_file TEXT,
-            fingerprint_data BLOB,
-            verification_timestamps TEXT DEFAULT '[]',
-            isadmin INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_to_database(prn, name, fingerprint_file):
-    """Save user data and fingerprint file to the SQLite database."""
+    """Open the database and create or upgrade the necessary tables."""
+    global db
+    db = Database("fingerprint_data.db")
+    db.initialize()
+
+def start_matcher():
+    """Start the matcher backend and load all enrolled templates into it once."""
+    global matcher, gallery, service
+    if service is not None:
+        # The new service loads the hot set from the database
+        service.hot_set.save()
+    matcher = create_matcher()
+    # With FINGERPRINT_GALLERY_DIR set, the matcher maps a gallery file instead of
+    # receiving every template over its pipe
+    gallery = TemplateGallery(db.pool, matcher, os.environ.get("FINGERPRINT_GALLERY_DIR"))
     try:
-        # Read the fingerprint file as binary data
-        with open(fingerprint_file, "rb") as file:
-            fingerprint_data = file.read()
-
-        conn = sqlite3.connect("fingerprint_data.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO users (prn, name, fingerprint_file, fingerprint_data, isadmin) VALUES (?, ?, ?, ?, 0)",
-            (prn.upper(), name, fingerprint_file, fingerprint_data)
-        )
-        conn.commit()
-        conn.close()
-    except sqlite3.IntegrityError:
+        gallery.load()
+    except MatcherError as e:
+        matcher.close()
+        if os.environ.get("FINGERPRINT_MATCHER"):
+            messagebox.showerror("Matcher Error", f"The configured matcher could not be started.\n{e}")
+            raise SystemExit(1)
+        # matcher_server.exe is not installed: fall back to one verify.exe run per candidate
+        logger.warning("%s; falling back to the verify.exe matcher.", e)
+        matcher = create_matcher("subprocess")
+        gallery = TemplateGallery(db.pool, matcher, os.environ.get("FINGERPRINT_GALLERY_DIR"))
+        gallery.load()
+    service = KioskService(db, matcher, gallery)
+
+def simulated_scan():
+    """A random enrolled template, for FINGERPRINT_CAPTURE=simulated; None (no finger) if nobody is enrolled."""
+    templates = gallery.templates()
+    return random.choice(templates)[1] if templates else None
+
+def start_capture():
+    """Open the capture device selected by FINGERPRINT_CAPTURE."""
+    global capture_device
+    capture_device = create_capture_device(source=simulated_scan)
+
+def capture_template():
+    """
+    Capture one fingerprint on the shared capture device and return its FIR template.
+
+    Runs on the scanner worker; raises on capture errors.
+    """
+    template = capture_device.capture()
+    if template is None:
+        raise CaptureError("No finger was placed on the scanner.")
+    return template
+
+def save_to_database(prn, name, fingerprint_data):
+    """
+    Save user data and the captured template to the SQLite database.
+
+    Runs on the scanner worker, so it reports problems to the caller instead of
+    showing message boxes.
+
+    Returns:
+        "already exists" if the PRN is taken, otherwise None.
+
+    Raises:
+        DuplicateFingerprint: If the finger is already enrolled under another PRN.
+    """
+    return service.enroll(prn, name, fingerprint_data)
+
+def capture_fingerprint(prn, name):
+    """
+    Capture a fingerprint and enroll it under the given PRN and name.
+
+    Runs on the scanner worker; returns save_to_database's result and raises on
+    capture errors.
+    """
+    with REGISTRY.timer(STAGE_SECONDS, stage="enroll_capture"):
+        template = capture_template()
+    return save_to_database(prn, name, template)
+
+def show_capture_result(status_label, result):
+    """Report the outcome of capture_fingerprint on the Tk thread."""
+    if result == ALREADY_EXISTS:
         messagebox.showerror("Database Error", "A user with this PRN already exists.")
-        return "already exists"
-    except FileNotFoundError:
-        messagebox.showerror("File Error", f"The fingerprint file '{fingerprint_file}' was not found.")
-    except Exception as e:
-        messagebox.showerror("Database Error", f"An unexpected error occurred: {e}")
-    finally:
-        # Ensure the connection is closed properly
-        conn.close()
-
-def capture_fingerprint(prn, name, status_label):
-    """Run the C++ fingerprint capture executable with provided PRN and name."""
-    try:
-        status_label.config(text="Status: Capturing fingerprint, please wait...")
-        fingerprint_file = f"fingerprint.fir"
-        result = subprocess.run([
-            "fingerprint_app.exe",
-            prn,
-            name,
-            fingerprint_file
-        ], capture_output=True, text=True)
-
-        if result.returncode == 0:
-            if os.path.exists(fingerprint_file):
-                res = save_to_database(prn, name, fingerprint_file)
-                if res != "already exists":
-                    messagebox.showinfo("Success", "Fingerprint captured and saved successfully!")
-                    status_label.config(text="Status: Fingerprint captured successfully.")
-                else:
-                    status_label.config(text="Status: User with PRN already exists.")
-            else:
-                raise FileNotFoundError(f"Expected fingerprint file not found: {fingerprint_file}")
-        else:
-            messagebox.showerror("Error", f"Error occurred: {result.stderr}")
-            status_label.config(text="Status: Error occurred during capture.")
-    except FileNotFoundError as e:
-        messagebox.showerror("Error", str(e))
-        status_label.config(text="Status: File not found.")
-    except Exception as e:
-        messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+        status_label.config(text="Status: User with PRN already exists.")
+    else:
+        messagebox.showinfo("Success", "Fingerprint captured and saved successfully!")
+        status_label.config(text="Status: Fingerprint captured successfully.")
+
+def show_task_error(status_label, error):
+    """Report a failed or timed-out scanner task on the Tk thread."""
+    if isinstance(error, (TaskTimeout, subprocess.TimeoutExpired)):
+        messagebox.showerror("Timeout", "The scanner did not respond in time. Please try again.")
+        status_label.config(text="Status: Scanner timed out.")
+    elif isinstance(error, DuplicateFingerprint):
+        messagebox.showerror("Duplicate Fingerprint", str(error))
+        status_label.config(text=f"Status: Fingerprint already enrolled for PRN: {error.entry.prn}.")
+    elif isinstance(error, CaptureError):
+        messagebox.showerror("Scanner Error", str(error))
+        status_label.config(text="Status: Scanner error.")
+    elif isinstance(error, FileNotFoundError):
+        messagebox.showerror("Error", str(error))
+        status_label.config(text="Status: Capture or matcher program not found.")
+    else:
+        messagebox.showerror("Error", f"An unexpected error occurred: {error}")
         status_label.config(text="Status: Unexpected error occurred.")
 
+def submit_scanner_task(status_label, name, func, *args, on_success):
+    """Queue scanner work; a double-click or a full queue only updates the status line."""
+    if pipeline is not None:
+        status_label.config(text="Status: Stop continuous attendance to use the scanner.")
+        return
+    try:
+        tasks.submit(
+            name, func, *args,
+            on_success=on_success,
+            on_error=lambda error: show_task_error(status_label, error),
+            timeout=TASK_TIMEOUT
+        )
+    except TaskRejected as e:
+        status_label.config(text=f"Status: {e}")
+
 def open_capture_dialog(status_label):
     """Open a dialog to get PRN and name before capturing the fingerprint."""
     dialog = tk.Toplevel()
@@ -115,7 +197,11 @@ def open_capture_dialog(status_label):
             messagebox.showwarning("Input Error", "Please enter both PRN and Name.")
             return
         dialog.destroy()
-        threading.Thread(target=capture_fingerprint, args=(prn, name, status_label)).start()
+        status_label.config(text="Status: Capturing fingerprint, please wait...")
+        submit_scanner_task(
+            status_label, "Capture", capture_fingerprint, prn, name,
+            on_success=lambda result: show_capture_result(status_label, result)
+        )
 
     scan_button = tk.Button(
         content_frame,
@@ -135,54 +221,79 @@ def check_admin(status_label):
     """
     Verify fingerprint and check if the user has admin privileges.
     If admin, show attendance dialog; if not, show appropriate message.
-    
+
+    The scan runs on the scanner worker so the UI stays responsive.
+
     Args:
         status_label: tkinter Label widget for displaying status messages
     """
-    try:
-        status_label.config(text="Status: Verifying fingerprint, please wait...")
-        isadmin = verify_fingerprint_in_db(status_label)
-        
-        if isadmin:
+    def on_verified(check_in):
+        if show_verification_result(status_label, check_in):
             show_attendance_dialog()
         else:
             messagebox.showinfo("Access Denied", "You need administrator privileges to view attendance records.")
-            
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred during verification: {str(e)}")
-        status_label.config(text="Status: Verification error occurred.")
-        
-def set_background(root, image_path):
+
+    status_label.config(text="Status: Verifying fingerprint, please wait...")
+    submit_scanner_task(status_label, "Verification", verify_fingerprint_in_db, on_success=on_verified)
+
+def load_background_image(image_path, screen_width, screen_height, opacity=0.3):
     """
-    Set a background image to the tkinter root window, maintaining aspect ratio.
+    Return the logo resized to fit the screen with the given opacity applied.
 
-    Args:
-        root: The tkinter root window.
-        image_path: Path to the image file.
+    The processed RGBA pixels are cached as raw bytes in background_cache/, keyed
+    by the source file's mtime and the screen size, so later launches skip the
+    pixel decode and the LANCZOS resize.
     """
-    # Load the image with Pillow
+    # Opening only reads the header; pixels are decoded on first use
     image = Image.open(image_path)
 
-    # Get the screen dimensions
-    screen_width = root.winfo_screenwidth()
-    screen_height = root.winfo_screenheight()
-
     # Calculate the scale to fit the screen while maintaining the aspect ratio
     img_width, img_height = image.size
     scale = min(screen_width / img_width, screen_height / img_height)
     new_width = int(img_width * scale)
     new_height = int(img_height * scale)
 
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(image_path)), "background_cache")
+    source_name = os.path.basename(image_path)
+    cache_file = os.path.join(
+        cache_dir,
+        f"{source_name}.{os.stat(image_path).st_mtime_ns}.{screen_width}x{screen_height}.{opacity}.rgba"
+    )
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as file:
+            return Image.frombytes("RGBA", (new_width, new_height), file.read())
+
     # Resize the image
     image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-    # Apply transparency (opacity)
+    # Apply transparency (opacity) to every pixel in one call
     image = image.convert("RGBA")
-    alpha = int(0.3 * 255)  # Convert opacity to alpha (0-255 scale)
-    for x in range(image.width):
-        for y in range(image.height):
-            r, g, b, a = image.getpixel((x, y))
-            image.putpixel((x, y), (r, g, b, alpha))
+    image.putalpha(int(opacity * 255))  # Convert opacity to alpha (0-255 scale)
+
+    # Replace stale entries for this logo (old mtime or screen size) with the new one
+    os.makedirs(cache_dir, exist_ok=True)
+    for cached in os.listdir(cache_dir):
+        if cached.startswith(source_name + "."):
+            os.remove(os.path.join(cache_dir, cached))
+    with open(cache_file + ".tmp", "wb") as file:
+        file.write(image.tobytes())
+    os.replace(cache_file + ".tmp", cache_file)
+    return image
+
+def set_background(root, image_path):
+    """
+    Set a background image to the tkinter root window, maintaining aspect ratio.
+
+    Args:
+        root: The tkinter root window.
+        image_path: Path to the image file.
+    """
+    # Get the screen dimensions
+    screen_width = root.winfo_screenwidth()
+    screen_height = root.winfo_screenheight()
+
+    image = load_background_image(image_path, screen_width, screen_height)
+    new_width, new_height = image.size
 
     # Convert the processed image to ImageTk format
     background_image = ImageTk.PhotoImage(image)
@@ -201,119 +312,192 @@ def set_background(root, image_path):
     return canvas
 
         
-def verify_fingerprint_in_db(status_label):
-    """Capture a fingerprint and verify it against stored fingerprints in the database."""
+def verify_fingerprint_in_db():
+    """
+    Capture a fingerprint and verify it against stored fingerprints in the database.
+
+    Runs on the scanner worker. Records attendance for a match.
+
+    Returns:
+        A service.CheckIn; its entry is None if no fingerprint matched.
+    """
+    with profiled(), REGISTRY.timer(STAGE_SECONDS, stage="scan_total"):
+        return identify_and_record()
+
+def identify_and_record():
+    """The body of verify_fingerprint_in_db: capture, then check in through the service."""
+    logger.info("Running fingerprint capture...")
     try:
-        status_label.config(text="Status: Verifying fingerprint, please wait...")
-        captured_file = "fingerprint.fir"  # This file should be captured by the capture program
-
-        print("Running fingerprint capture...")
-        result = subprocess.run([
-            "fingerprint_app.exe", "capture", captured_file  # Adjust the executable name as needed
-        ], capture_output=True, text=True)
-
-        if result.returncode != 0:
-            print(f"Error: {result.stderr}")
-            raise FileNotFoundError("Failed to capture fingerprint.")
-
-        if not os.path.exists(captured_file):
-            print(f"Captured file not found: {captured_file}")
-            raise FileNotFoundError(f"Failed to capture fingerprint, file not found: {captured_file}")
-
-        # Read the captured fingerprint as binary data
-        with open(captured_file, "rb") as file:
-            captured_data = file.read()
-
-        conn = sqlite3.connect("fingerprint_data.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT prn, name, fingerprint_data, verification_timestamps, isadmin FROM users")
-        users = cursor.fetchall()
-
-        match_found = False
-        isadmin = False
-
-        for user in users:
-            stored_prn, stored_name, stored_fingerprint_data, timestamps_json, stored_admin_status = user
-            timestamps = json.loads(timestamps_json) if timestamps_json else []
-
-            # Convert the stored BLOB to a FIR file for comparison
-            stored_fingerprint_file = f"dataFingerprint.fir"
-            with open(stored_fingerprint_file, "wb") as f:
-                f.write(stored_fingerprint_data)
-
-            # Call verify.exe to compare the two FIR files
-            print(f"Comparing captured fingerprint with stored fingerprint for {stored_name}...")
-
-            verify_result = subprocess.run([
-                "verify.exe"
-            ], capture_output=True, text=True)
-
-            if verify_result.returncode == 0:
-                # Append the current timestamp to the verification timestamps
-                current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                timestamps.append(current_timestamp)
-
-                # Update the timestamps in the database
-                cursor.execute(
-                    "UPDATE users SET verification_timestamps = ? WHERE prn = ?",
-                    (json.dumps(timestamps), stored_prn)
-                )
-                conn.commit()
-                messagebox.showinfo("Verification Success", f"Fingerprint for {stored_name} (PRN: {stored_prn}) matched!")
-                status_label.config(text=f"Status: Fingerprint matched for PRN: {stored_prn}.")
-                match_found = True
-                if stored_admin_status == 1:
-                    isadmin = True
-                    return True
-                break  # Exit the loop when a match is found
+        with REGISTRY.timer(STAGE_SECONDS, stage="capture"):
+            captured_data = capture_template()
+    except Exception:
+        service.outcomes.record("error")
+        raise
+    return service.check_in(captured_data)
+
+def show_verification_result(status_label, check_in):
+    """Report a verification outcome on the Tk thread; returns whether the user is an admin."""
+    entry = check_in.entry
+    if entry is None:
+        messagebox.showerror("Verification Failed", "No matching fingerprint found in the database.")
+        status_label.config(text="Status: No matching fingerprint found.")
+        return False
+
+    if check_in.repeat:
+        # A repeat tap inside the debounce window; nothing new was recorded
+        messagebox.showinfo(
+            "Already Recorded", f"Attendance for {entry.name} (PRN: {entry.prn}) was already recorded at {check_in.timestamp}."
+        )
+        status_label.config(text=f"Status: Attendance already recorded for PRN: {entry.prn}.")
+        return entry.isadmin == 1
+    messagebox.showinfo("Verification Success", f"Fingerprint for {entry.name} (PRN: {entry.prn}) matched!")
+    score = f" (score {check_in.score:.2f})" if check_in.score is not None else ""
+    status_label.config(text=f"Status: Fingerprint matched for PRN: {entry.prn}{score}.")
+    return entry.isadmin == 1
+
+def mark_attendance(status_label):
+    """Queue a scan that records attendance for the matched user."""
+    status_label.config(text="Status: Verifying fingerprint, please wait...")
+    submit_scanner_task(
+        status_label, "Verification", verify_fingerprint_in_db,
+        on_success=lambda check_in: show_verification_result(status_label, check_in)
+    )
+
+def show_pipeline_result(status_label, check_in):
+    """Report one continuous attendance scan on the status line; message boxes would stall the queue."""
+    entry = check_in.entry
+    if entry is None:
+        status_label.config(text="Status: No matching fingerprint found.")
+    elif check_in.repeat:
+        status_label.config(text=f"Status: Attendance already recorded for {entry.name} (PRN: {entry.prn}).")
+    else:
+        status_label.config(text=f"Status: Attendance recorded for {entry.name} (PRN: {entry.prn}).")
+
+def toggle_continuous_attendance(root, status_label, button):
+    """
+    Start or stop continuous attendance.
+
+    The scanner captures the next finger while the previous one is being
+    identified, so a queue of students is not held up by matching. Results
+    reach the Tk thread through a queue polled with root.after.
+    """
+    global pipeline
+    if pipeline is not None:
+        pipeline.stop()
+        status_label.config(text="Status: Stopping continuous attendance...")
+        return
+    if tasks.is_active("Verification") or tasks.is_active("Capture"):
+        status_label.config(text="Status: The scanner is busy, please wait.")
+        return
+
+    results = queue.Queue()
+    pipeline = CapturePipeline(
+        capture_device, service.check_in,
+        on_result=lambda check_in: results.put((True, check_in)),
+        on_error=lambda error: results.put((False, error))
+    )
+    pipeline.start()
+    button.config(text="Stop Continuous Attendance")
+    status_label.config(text="Status: Continuous attendance running, place a finger on the scanner.")
+
+    def poll():
+        global pipeline
+        running = pipeline.running
+        while True:
+            try:
+                succeeded, value = results.get_nowait()
+            except queue.Empty:
+                break
+            if succeeded:
+                show_pipeline_result(status_label, value)
             else:
-                print(f"Error during verification: {verify_result.stderr}")
+                status_label.config(text=f"Status: Scanner error: {value}")
+        if running:
+            root.after(100, poll)
+            return
+        pipeline = None
+        button.config(text="Start Continuous Attendance")
+        status_label.config(text="Status: Continuous attendance stopped.")
 
-        if not match_found:
-            # If no match was found in the database
-            messagebox.showerror("Verification Failed", "No matching fingerprint found in the database.")
-            status_label.config(text="Status: No matching fingerprint found.")
-        
-        conn.close()
-
-    except FileNotFoundError as e:
-        print(f"Error: {str(e)}")
-        messagebox.showerror("Error", str(e))
-        status_label.config(text="Status: Capture or stored file not found.")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        messagebox.showerror("Error", f"An unexpected error occurred: {e}")
-        status_label.config(text="Status: Unexpected error occurred.")
+    root.after(100, poll)
 
 def show_attendance_dialog():
     """Open a dialog to input start and end dates for filtering attendance."""
     from tkcalendar import DateEntry
-    from datetime import datetime
     
-    def export_to_csv(records):
-        """Export the attendance records to a CSV file."""
+    def export_to_csv(start, end):
+        """Export the attendance records in a range to a CSV file, streaming on a background worker."""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension='.csv',
+            filetypes=[("CSV files", '*.csv'), ("Compressed CSV files", '*.csv.gz')],
+            title="Export Attendance Records"
+        )
+        if not file_path:
+            return
+
+        progress_window = tk.Toplevel()
+        progress_window.title("Exporting Records")
+        progress_window.geometry("400x150")
+
+        progress_label = ttk.Label(progress_window, text="Starting export...", font=("Arial", 11))
+        progress_label.pack(pady=(20, 10))
+
+        progress_bar = ttk.Progressbar(progress_window, length=340, maximum=100)
+        progress_bar.pack(pady=5)
+
+        cancel_event = threading.Event()
+        ttk.Button(progress_window, text="Cancel", command=cancel_event.set).pack(pady=10)
+
+        # Written by the export worker, read by the Tk thread below
+        progress = {"written": 0, "total": 0}
+
+        def on_progress(written, total):
+            progress.update(written=written, total=total)
+
+        def refresh_progress():
+            if not progress_window.winfo_exists():
+                return
+            if progress["total"]:
+                progress_bar["value"] = 100 * progress["written"] / progress["total"]
+                progress_label.config(text=f"Exported {progress['written']} of {progress['total']} records")
+            progress_window.after(100, refresh_progress)
+
+        def on_done(written):
+            progress_window.destroy()
+            messagebox.showinfo("Success", f"{written} records exported successfully!")
+
+        def on_error(error):
+            progress_window.destroy()
+            if isinstance(error, ExportCancelled):
+                messagebox.showinfo("Export Cancelled", "The export was cancelled.")
+            else:
+                messagebox.showerror("Export Error", f"Failed to export records: {str(error)}")
+
         try:
-            file_path = tk.filedialog.asksaveasfilename(
-                defaultextension='.csv',
-                filetypes=[("CSV files", '*.csv')],
-                title="Export Attendance Records"
+            background_tasks.submit(
+                "Export", export_attendance, db, start, end, file_path, None, 5000, on_progress, cancel_event,
+                on_success=on_done, on_error=on_error
             )
-            
-            if file_path:
-                with open(file_path, 'w', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(["PRN", "Name", "Timestamp"])  # Header
-                    writer.writerows(records)
-                messagebox.showinfo("Success", "Records exported successfully!")
-        except Exception as e:
-            messagebox.showerror("Export Error", f"Failed to export records: {str(e)}")
+        except TaskRejected as e:
+            progress_window.destroy()
+            messagebox.showwarning("Export", f"{e} Please wait for the current export to finish.")
+            return
+        refresh_progress()
 
-    def display_records(records):
-        """Display attendance records in a new window with sorting and export capabilities."""
+    def display_records(start, end, total):
+        """
+        Display attendance records in a new window with sorting and export capabilities.
+
+        Only one page of rows is materialized at a time; sorting and paging run
+        as ORDER BY/LIMIT queries in SQLite.
+        """
         records_window = tk.Toplevel()
         records_window.title("Attendance Records")
         records_window.state('zoomed')
 
+        # Paging state: current sort, and the sort key each visited page started after
+        view = {"sort": "Timestamp", "descending": False, "page_starts": [None], "next_start": None}
+
         # Create main container
         main_frame = ttk.Frame(records_window, padding="20")
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -325,7 +509,7 @@ def show_attendance_dialog():
         # Title
         title_label = ttk.Label(
             header_frame,
-            text=f"Attendance Records ({len(records)} entries found)",
+            text=f"Attendance Records ({total} entries found)",
             font=("Arial", 16, "bold")
         )
         title_label.pack(side=tk.LEFT)
@@ -334,12 +518,25 @@ def show_attendance_dialog():
         export_button = ttk.Button(
             header_frame,
             text="Export to CSV",
-            command=lambda: export_to_csv(records),
+            command=lambda: export_to_csv(start, end),
             style="Action.TButton",
             padding=10
         )
         export_button.pack(side=tk.RIGHT)
 
+        # Paging controls
+        paging_frame = ttk.Frame(main_frame)
+        paging_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(10, 0))
+
+        prev_button = ttk.Button(paging_frame, text="< Previous", command=lambda: show_previous_page())
+        prev_button.pack(side=tk.LEFT)
+
+        page_label = ttk.Label(paging_frame, font=("Arial", 11))
+        page_label.pack(side=tk.LEFT, expand=True)
+
+        next_button = ttk.Button(paging_frame, text="Next >", command=lambda: show_next_page())
+        next_button.pack(side=tk.RIGHT)
+
         # Create tree view with scrollbars
         tree_frame = ttk.Frame(main_frame)
         tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -367,27 +564,143 @@ def show_attendance_dialog():
 
         # Configure column headings
         for col in columns:
-            tree.heading(col, text=col, command=lambda c=col: sort_treeview(tree, c, False))
+            tree.heading(col, text=col, command=lambda c=col: sort_treeview(c))
             tree.column(col, minwidth=100, width=200)
 
-        # Insert records
-        for record in records:
-            tree.insert("", tk.END, values=record)
-
         tree.pack(fill=tk.BOTH, expand=True)
 
+        def load_page():
+            """Replace the visible rows with the page starting after the current page key."""
+            rows, view["next_start"] = db.attendance_page(
+                start, end, view["sort"], view["descending"],
+                after=view["page_starts"][-1], limit=RECORDS_PAGE_SIZE
+            )
+            tree.delete(*tree.get_children(''))
+            for record in rows:
+                tree.insert("", tk.END, values=record)
+
+            page = len(view["page_starts"])
+            pages = max(1, -(-total // RECORDS_PAGE_SIZE))
+            page_label.config(text=f"Page {page} of {pages}")
+            prev_button.state(["!disabled"] if page > 1 else ["disabled"])
+            next_button.state(["!disabled"] if page < pages and len(rows) == RECORDS_PAGE_SIZE else ["disabled"])
+
+        def show_next_page():
+            view["page_starts"].append(view["next_start"])
+            load_page()
+
+        def show_previous_page():
+            if len(view["page_starts"]) > 1:
+                view["page_starts"].pop()
+                load_page()
+
         # Sorting function
-        def sort_treeview(tree, col, reverse):
-            """Sort treeview by column."""
-            l = [(tree.set(k, col), k) for k in tree.get_children('')]
-            l.sort(reverse=reverse)
+        def sort_treeview(col):
+            """Sort by column in SQLite, toggling direction on repeated clicks, and go back to page 1."""
+            if view["sort"] == col:
+                view["descending"] = not view["descending"]
+            else:
+                view["sort"], view["descending"] = col, False
+            view["page_starts"] = [None]
+            load_page()
+
+        load_page()
+
+    def build_table(parent, columns, widths):
+        """A headings-only Treeview with scrollbars packed into parent."""
+        table_frame = ttk.Frame(parent)
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        y_scrollbar = ttk.Scrollbar(table_frame)
+        y_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        table = ttk.Treeview(table_frame, columns=columns, show="headings", yscrollcommand=y_scrollbar.set)
+        y_scrollbar.config(command=table.yview)
+        for col, width in zip(columns, widths):
+            table.heading(col, text=col, command=lambda c=col: sort_table(table, c))
+            table.column(col, minwidth=80, width=width)
+        table.pack(fill=tk.BOTH, expand=True)
+        return table
+
+    def sort_table(table, col):
+        """Sort a small, fully loaded table in place, toggling direction on repeated clicks."""
+        descending = getattr(table, "sorted_by", None) == (col, False)
+        rows = [(table.set(item, col), item) for item in table.get_children('')]
+        rows.sort(key=lambda row: (0, int(row[0]), "") if row[0].isdigit() else (1, 0, row[0]), reverse=descending)
+        for index, (_, item) in enumerate(rows):
+            table.move(item, '', index)
+        table.sorted_by = (col, descending)
+
+    def display_student_days(prn, name, start_day, end_day):
+        """Show first-in/last-out for each day one student was present."""
+        days_window = tk.Toplevel()
+        days_window.title(f"Attendance of {prn}")
+        days_window.geometry("600x500")
+        frame = ttk.Frame(days_window, padding="20")
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text=f"{name or prn} ({prn})", font=("Arial", 14, "bold")).pack(anchor=tk.W, pady=(0, 10))
+        table = build_table(frame, ("Date", "Scans", "First In", "Last Out"), (140, 80, 120, 120))
+        for day, scans, first_in, last_out in db.student_days(prn, start_day, end_day):
+            table.insert("", tk.END, values=(day, scans, first_in[11:], last_out[11:]))
+
+    def display_summary(start_day, end_day):
+        """
+        Show per-student and per-day presence for whole days in a range.
+
+        Both views read the attendance_daily rollup, one row per student per
+        day, so a semester costs a few thousand rows rather than every scan.
+        """
+        students = db.attendance_summary(start_day, end_day)
+        if not students:
+            messagebox.showinfo("No Records", "No attendance records found for the specified dates.")
+            return
 
-            # Rearrange items in sorted positions
-            for index, (val, k) in enumerate(l):
-                tree.move(k, '', index)
+        summary_window = tk.Toplevel()
+        summary_window.title("Attendance Summary")
+        summary_window.geometry("900x600")
+        frame = ttk.Frame(summary_window, padding="20")
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(
+            frame,
+            text=f"Attendance Summary, {start_day} to {end_day} ({len(students)} students)",
+            font=("Arial", 16, "bold")
+        ).pack(anchor=tk.W, pady=(0, 10))
+
+        notebook = ttk.Notebook(frame)
+        notebook.pack(fill=tk.BOTH, expand=True)
+
+        student_tab = ttk.Frame(notebook, padding="10")
+        notebook.add(student_tab, text="By Student")
+        ttk.Label(student_tab, text="Double-click a student for daily first-in and last-out times.").pack(anchor=tk.W)
+        student_table = build_table(
+            student_tab, ("PRN", "Name", "Days Present", "Scans", "First Day", "Last Day"), (120, 200, 110, 80, 110, 110)
+        )
+        for row in students:
+            student_table.insert("", tk.END, values=row)
 
-            # Reverse sort next time
-            tree.heading(col, command=lambda: sort_treeview(tree, col, not reverse))
+        def open_student(event):
+            item = student_table.identify_row(event.y)
+            if item:
+                prn, name = student_table.item(item, "values")[:2]
+                display_student_days(prn, name, start_day, end_day)
+
+        student_table.bind("<Double-1>", open_student)
+
+        day_tab = ttk.Frame(notebook, padding="10")
+        notebook.add(day_tab, text="By Day")
+        day_table = build_table(day_tab, ("Date", "Students Present", "Scans"), (140, 140, 100))
+        for row in db.daily_totals(start_day, end_day):
+            day_table.insert("", tk.END, values=row)
+
+    def fetch_summary():
+        """Open the summary view for the selected dates; times are ignored, as the rollup is per day."""
+        try:
+            start_day = start_date_cal.get_date().strftime("%Y-%m-%d")
+            end_day = end_date_cal.get_date().strftime("%Y-%m-%d")
+            if start_day > end_day:
+                messagebox.showerror("Date Error", "Start date must be before or equal to end date.")
+                return
+            display_summary(start_day, end_day)
+        except Exception as e:
+            messagebox.showerror("Error", f"An unexpected error occurred: {e}")
 
     def fetch_attendance():
         """Fetch and display attendance records based on the date and time range."""
@@ -412,23 +725,13 @@ def show_attendance_dialog():
                 messagebox.showerror("Date-Time Error", "Start date-time must be before or equal to end date-time.")
                 return
 
-            conn = sqlite3.connect("fingerprint_data.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT prn, name, verification_timestamps FROM users")
-            users = cursor.fetchall()
-            conn.close()
-
-            records = []
-            for user in users:
-                prn, name, timestamps_json = user
-                timestamps = json.loads(timestamps_json)
-                for ts in timestamps:
-                    ts_datetime = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-                    if start_datetime_obj <= ts_datetime <= end_datetime_obj:
-                        records.append((prn, name, ts))
-
-            if records:
-                display_records(records)
+            # Range filter runs in SQLite on the attendance_events timestamp index
+            start = start_datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
+            end = end_datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
+            total = db.attendance_count(start, end)
+
+            if total:
+                display_records(start, end, total)
             else:
                 messagebox.showinfo("No Records", "No attendance records found for the specified date-time range.")
                 
@@ -526,15 +829,27 @@ def show_attendance_dialog():
     end_second.set("59")
     end_second.pack(side=tk.LEFT)
     
-    # Fetch button
+    # Fetch and summary buttons
+    button_frame = ttk.Frame(main_frame)
+    button_frame.pack(pady=20)
+
     fetch_button = ttk.Button(
-        main_frame,
+        button_frame,
         text="Search Records",
         command=fetch_attendance,
         style="Accent.TButton",
         padding=10
     )
-    fetch_button.pack(pady=20)
+    fetch_button.pack(side=tk.LEFT, padx=10)
+
+    summary_button = ttk.Button(
+        button_frame,
+        text="Summary Report",
+        command=fetch_summary,
+        style="Accent.TButton",
+        padding=10
+    )
+    summary_button.pack(side=tk.LEFT, padx=10)
     
     # Create custom style for the button
     style = ttk.Style()
@@ -548,12 +863,25 @@ def show_attendance_dialog():
     )
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     initialize_database()
+    start_matcher()
+    start_capture()
+    REGISTRY.add_collector(lambda registry: registry.set(GALLERY_TEMPLATES, len(gallery)))
+    start_exporters()
+    # Ships this kiosk's attendance to the central store when FINGERPRINT_SYNC_DIR is set
+    sync_stopped = start_site_sync(db, gallery)
+    # Archives attendance older than FINGERPRINT_RETENTION_DAYS, when set
+    retention_stopped = start_retention(db)
 
     root = tk.Tk()
     root.title("Fingerprint Scanner")
     root.state('zoomed')  # Make the main window fullscreen
 
+    global tasks, background_tasks
+    tasks = TaskExecutor(root)
+    background_tasks = TaskExecutor(root, max_pending=1, worker_name="background-worker")
+
     # Set the background image
     canvas = set_background(root, "logo.png")
 
@@ -584,7 +912,7 @@ def main():
     verify_button = tk.Button(
         content_frame,
         text="Mark Attendance",
-        command=lambda: threading.Thread(target=verify_fingerprint_in_db, args=(status_label,)).start(),
+        command=lambda: mark_attendance(status_label),
         font=("Arial", 16),
         bg="#2196f3",
         fg="white",
@@ -595,6 +923,20 @@ def main():
     )
     verify_button.grid(row=3, column=0, padx=10, pady=20)
 
+    continuous_button = tk.Button(
+        content_frame,
+        text="Start Continuous Attendance",
+        command=lambda: toggle_continuous_attendance(root, status_label, continuous_button),
+        font=("Arial", 16),
+        bg="#3f51b5",
+        fg="white",
+        activebackground="#3949ab",
+        activeforeground="white",
+        width=30,
+        height=2
+    )
+    continuous_button.grid(row=4, column=0, padx=10, pady=20)
+
     view_button = tk.Button(
         content_frame,
         text="View Attendance",
@@ -607,8 +949,32 @@ def main():
         width=30,
         height=2
     )
-    view_button.grid(row=4, column=0, padx=10, pady=20)
+    view_button.grid(row=5, column=0, padx=10, pady=20)
 
-    root.mainloop()
+    # Report process start to first paint once the window has been drawn
+    root.after_idle(lambda: root.after(0, lambda: print(
+        f"Startup: first paint after {(time.perf_counter() - STARTUP_TIME) * 1000:.0f} ms"
+    )))
 
-main()
\ No newline at end of file
+    root.mainloop()
+    if pipeline is not None:
+        pipeline.stop()
+        pipeline.join(FINGER_TIMEOUT + 1)
+    tasks.shutdown()
+    background_tasks.shutdown()
+    if sync_stopped is not None:
+        sync_stopped.set()
+    if retention_stopped is not None:
+        retention_stopped.set()
+    # A scan or export still running uses the scanner, matcher and database, so
+    # they are only closed once both workers have drained
+    if tasks.join(FINGER_TIMEOUT + 1) and background_tasks.join(FINGER_TIMEOUT + 1):
+        capture_device.close()
+        # Saves the hot set, then closes the matcher and the database
+        service.close()
+    else:
+        logger.warning("A scanner or export task is still running; exiting without closing the scanner.")
+        service.hot_set.save()
+
+if __name__ == "__main__":
+    main()
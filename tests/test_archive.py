@@ -0,0 +1,170 @@
+"""
+Tests for moving old attendance events to monthly archive files, and for the
+range, count and page queries reading across the live table and the files.
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archive import archive_attendance, compact_database  # noqa: E402
+from attendance import SORT_PLANS, insert_attendance_events  # noqa: E402
+from db import Database  # noqa: E402
+from sync import _set_state  # noqa: E402
+
+# With a 60 day horizon, January to March 2024 are archived and April onwards stays live
+TODAY = date(2024, 6, 20)
+DAYS = 60
+RANGES = (
+    ("2024-01-01 00:00:00", "2024-06-30 23:59:59"),
+    ("2024-02-10 12:00:00", "2024-04-05 12:00:00"),
+    ("2024-03-01 00:00:00", "2024-03-31 23:59:59"),
+    ("2024-05-01 00:00:00", "2024-06-30 23:59:59"),
+)
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = os.path.join(directory.name, "archive")
+        self.db = Database(os.path.join(directory.name, "fingerprint_data.db"), pool_size=1)
+        self.addCleanup(self.db.close)
+        self.db.initialize()
+        for prn in ("P1", "P2", "P3"):
+            self.db.insert_user(prn, f"Student {prn}", None, prn.encode() * 64)
+
+    def add_events(self, first, days):
+        # Oldest first, so ids follow timestamps; P4 is not enrolled
+        rng = random.Random(first.toordinal())
+        events = []
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            for prn in ("P1", "P2", "P3", "P4"):
+                if rng.random() < 0.7:
+                    events.append((prn, f"{day} {rng.randint(7, 18):02d}:{rng.randint(0, 59):02d}:00"))
+        events.sort(key=lambda event: event[1])
+        with self.db.pool.transaction() as conn:
+            insert_attendance_events(conn, events)
+
+    def archive(self):
+        return archive_attendance(self.db, DAYS, self.archive_dir, today=TODAY)
+
+    def live(self):
+        with self.db.pool.connection() as conn:
+            return conn.execute("SELECT id, prn, ts FROM attendance_events ORDER BY id").fetchall()
+
+    def partitions(self):
+        with self.db.pool.connection() as conn:
+            return conn.execute(
+                "SELECT month, events, first_ts, last_ts FROM attendance_archive ORDER BY month"
+            ).fetchall()
+
+    def partition_events(self, month):
+        conn = sqlite3.connect(os.path.join(self.archive_dir, f"attendance-{month}.db"))
+        try:
+            return conn.execute("SELECT id, prn, ts FROM attendance_events ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+    def all_pages(self, start, end, sort, descending):
+        rows, after = [], None
+        while True:
+            page, after = self.db.attendance_page(start, end, sort, descending, after, limit=50)
+            rows.extend(page)
+            if len(page) < 50:
+                return rows
+
+    def snapshot(self):
+        results = []
+        for start, end in RANGES:
+            results.append(self.db.attendance_count(start, end))
+            results.append(list(self.db.attendance_range(start, end)))
+            for sort in SORT_PLANS:
+                for descending in (False, True):
+                    results.append(self.all_pages(start, end, sort, descending))
+            results.append(self.db.attendance_summary(start[:10], end[:10]))
+        return results
+
+    def test_old_months_move_to_partitions(self):
+        self.add_events(date(2024, 1, 1), 170)
+        events = self.live()
+        before = self.snapshot()
+
+        stats = self.archive()
+        archived = [event for event in events if event[2] < "2024-04-01"]
+        self.assertEqual(stats, {"months": 3, "events": len(archived)})
+        self.assertEqual(sorted(os.listdir(self.archive_dir)), [
+            "attendance-2024-01.db", "attendance-2024-02.db", "attendance-2024-03.db",
+        ])
+        self.assertEqual(self.live(), [event for event in events if event[2] >= "2024-04-01"])
+        for month, count, first_ts, last_ts in self.partitions():
+            in_month = [event for event in archived if event[2].startswith(month)]
+            self.assertEqual(self.partition_events(month), in_month)
+            self.assertEqual((count, first_ts, last_ts), (len(in_month), in_month[0][2], in_month[-1][2]))
+
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(self.archive(), {"months": 0, "events": 0})
+
+    def test_back_dated_event_is_merged_into_its_partition(self):
+        self.add_events(date(2024, 1, 1), 170)
+        self.archive()
+        february = self.partitions()[1]
+
+        # A central store merges a late batch: one February event, and newer ones after it
+        self.db.record_attendance("P4", "2024-02-10 06:00:00")
+        self.db.record_attendance("P1", "2024-06-19 09:00:00")
+        before = self.snapshot()
+        self.assertIn(("P4", None, "2024-02-10 06:00:00"), before[1])
+
+        self.assertEqual(self.archive(), {"months": 1, "events": 1})
+        self.assertEqual(self.partitions()[1], ("2024-02", february[1] + 1, february[2], february[3]))
+        self.assertIn("2024-02-10 06:00:00", [ts for _, _, ts in self.partition_events("2024-02")])
+        self.assertNotIn("2024-02-10 06:00:00", [ts for _, _, ts in self.live()])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_newest_event_stays_live(self):
+        self.add_events(date(2024, 1, 1), 31)
+        events = self.live()
+        before = self.snapshot()
+        self.assertEqual(self.archive(), {"months": 1, "events": len(events) - 1})
+        self.assertEqual(self.live(), events[-1:])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_unacknowledged_events_stay_live(self):
+        self.add_events(date(2024, 1, 1), 170)
+        events = self.live()
+        acknowledged = events[len(events) // 5][0]  # in February
+        with self.db.pool.transaction() as conn:
+            _set_state(conn, "acknowledged_events", acknowledged)
+        before = self.snapshot()
+
+        self.archive()
+        live = self.live()
+        self.assertEqual(live, [event for event in events if event[0] > acknowledged or event[2] >= "2024-04-01"])
+        self.assertLess(live[0][2], "2024-03-01")
+        self.assertEqual(self.snapshot(), before)
+
+    def test_compact_after_archiving(self):
+        self.add_events(date(2024, 1, 1), 170)
+        self.archive()
+        stats = compact_database(self.db)
+        self.assertLessEqual(stats["bytes_after"], stats["bytes_before"])
+        with self.db.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        # Now in incremental mode, the next compaction is incremental
+        self.assertLessEqual(compact_database(self.db)["bytes_after"], stats["bytes_after"])
+        self.assertEqual(self.snapshot()[0], len(self.live()) + sum(row[1] for row in self.partitions()))
+
+
+if __name__ == "__main__":
+    unittest.main()
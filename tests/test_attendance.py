@@ -0,0 +1,242 @@
+"""
+Tests for the attendance event store: the legacy timestamp migration, range
+counts and pages, and the rollups behind the summary report, which must
+always agree with the raw events.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from attendance import SORT_PLANS, insert_attendance_events  # noqa: E402
+from db import Database  # noqa: E402
+
+# users as created before template_version, template_key and attendance_events existed
+LEGACY_USERS = '''
+    CREATE TABLE users (
+        prn TEXT PRIMARY KEY,
+        name TEXT,
+        fingerprint_file TEXT,
+        fingerprint_data BLOB,
+        verification_timestamps TEXT DEFAULT '[]',
+        isadmin INTEGER
+    )
+'''
+
+
+class DatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "fingerprint_data.db")
+
+    def open_database(self):
+        db = Database(self.path, pool_size=1)
+        self.addCleanup(db.close)
+        db.initialize()
+        return db
+
+    def events(self, db):
+        with db.pool.connection() as conn:
+            return sorted(conn.execute("SELECT prn, ts FROM attendance_events").fetchall())
+
+
+class MigrateVerificationTimestampsTest(DatabaseTestCase):
+
+    LEGACY = {
+        "P1": json.dumps(["2024-01-05 09:00:00", "2024-01-06 09:30:00", "2024-02-01 08:15:00"]),
+        "P2": json.dumps(["2024-01-05 10:00:00"]),
+        "P3": "[]",
+        "P4": "",
+        "P5": None,
+        "P6": "[\"2024-01-05 11:00:00\", ",
+        "P7": json.dumps({"2024-01-05": 1}),
+    }
+
+    def setUp(self):
+        super().setUp()
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(LEGACY_USERS)
+            conn.executemany(
+                "INSERT INTO users (prn, name, verification_timestamps, isadmin) VALUES (?, ?, ?, 0)",
+                [(prn, f"Student {prn}", value) for prn, value in self.LEGACY.items()]
+            )
+        conn.close()
+
+    def column(self, db):
+        with db.pool.connection() as conn:
+            return dict(conn.execute("SELECT prn, verification_timestamps FROM users"))
+
+    def test_migrates_once(self):
+        expected = sorted(
+            [("P1", ts) for ts in json.loads(self.LEGACY["P1"])] + [("P2", "2024-01-05 10:00:00")]
+        )
+        db = self.open_database()
+        self.assertEqual(self.events(db), expected)
+        db.close()
+
+        db = self.open_database()
+        self.assertEqual(self.events(db), expected)
+        self.assertEqual(db.attendance_count("2024-01-01 00:00:00", "2024-12-31 23:59:59"), 4)
+        with db.pool.connection() as conn:
+            daily = conn.execute("SELECT prn, day, scans FROM attendance_daily ORDER BY prn, day").fetchall()
+        self.assertEqual(daily, [
+            ("P1", "2024-01-05", 1), ("P1", "2024-01-06", 1), ("P1", "2024-02-01", 1), ("P2", "2024-01-05", 1),
+        ])
+
+    def test_clears_only_migrated_arrays(self):
+        column = self.column(self.open_database())
+        for prn in ("P1", "P2", "P3", "P4"):
+            self.assertEqual(column[prn], "[]")
+        self.assertIsNone(column["P5"])
+        # Unreadable values are kept for someone to look at
+        self.assertEqual(column["P6"], self.LEGACY["P6"])
+        self.assertEqual(column["P7"], self.LEGACY["P7"])
+
+
+class AttendancePageTest(DatabaseTestCase):
+
+    START, END = "2024-03-01 00:00:00", "2024-03-31 23:59:59"
+
+    def setUp(self):
+        super().setUp()
+        self.db = self.open_database()
+        for prn, name in (("P1", "Carol"), ("P2", "alice"), ("P3", "Bob"), ("P4", "Bob")):
+            self.db.insert_user(prn, name, None, prn.encode() * 64)
+        # P9 and P0 check in at a kiosk whose enrollment has not reached this database
+        for day in range(1, 32):
+            for hour, prn in enumerate(("P1", "P2", "P3", "P4", "P9", "P0")):
+                if (day + hour) % 3:
+                    self.db.record_attendance(prn, f"2024-03-{day:02d} {8 + hour:02d}:00:00")
+        self.db.record_attendance("P1", "2024-04-01 08:00:00")
+
+    def all_pages(self, sort, descending):
+        rows, after = [], None
+        while True:
+            page, after = self.db.attendance_page(self.START, self.END, sort, descending, after, limit=7)
+            rows.extend(page)
+            if len(page) < 7:
+                return rows
+
+    def test_every_order_lists_what_count_counts(self):
+        count = self.db.attendance_count(self.START, self.END)
+        expected = sorted(self.db.attendance_range(self.START, self.END), key=lambda row: (row[0], row[2]))
+        self.assertEqual(len(expected), count)
+        for sort in SORT_PLANS:
+            for descending in (False, True):
+                with self.subTest(sort=sort, descending=descending):
+                    rows = self.all_pages(sort, descending)
+                    self.assertEqual(sorted(rows, key=lambda row: (row[0], row[2])), expected)
+
+    def test_orders(self):
+        rows = self.all_pages("PRN", False)
+        self.assertEqual([prn for prn, _, _ in rows], sorted(prn for prn, _, _ in rows))
+        rows = self.all_pages("Name", False)
+        # Unenrolled PRNs have no name and come first, then names in index order
+        names = [name for _, name, _ in rows]
+        self.assertEqual(names[:names.count(None)], [None] * names.count(None))
+        self.assertEqual(names[names.count(None):], sorted(name for name in names if name is not None))
+        timestamps = [ts for _, _, ts in self.all_pages("Timestamp", True)]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+
+    def test_enrolling_a_prn_moves_its_events_to_the_enrolled_arm(self):
+        self.db.insert_user("P9", "Dana", None, b"P9" * 64)
+        rows = self.all_pages("Name", False)
+        self.assertTrue(all(name == "Dana" for prn, name, _ in rows if prn == "P9"))
+        self.assertEqual(len(rows), self.db.attendance_count(self.START, self.END))
+        with self.db.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT prn FROM attendance_unenrolled").fetchall(), [("P0",)])
+
+
+class RollupTest(DatabaseTestCase):
+
+    PRNS = ("P1", "P2", "P3", "P4", "P5")
+    RANGES = (
+        ("2024-01-20", "2024-03-10"),
+        ("2024-01-25", "2024-03-05"),
+        ("2024-02-01", "2024-02-29"),
+        ("2024-01-31", "2024-02-01"),
+        ("2024-02-29", "2024-02-29"),
+    )
+
+    def make_events(self, seed, first=20, days=51):
+        # Scans from 20 January into March 2024, across the leap day, in random order
+        rng = random.Random(seed)
+        events = []
+        for offset in range(days):
+            day = date(2024, 1, first) + timedelta(days=offset)
+            for prn in self.PRNS:
+                for _ in range(rng.choice((0, 0, 1, 1, 2, 3))):
+                    events.append((prn, f"{day} {rng.randint(7, 18):02d}:{rng.randint(0, 59):02d}:00"))
+        rng.shuffle(events)
+        return events
+
+    def enroll(self, db):
+        for prn in self.PRNS[:-1]:  # P5 is not enrolled here
+            db.insert_user(prn, f"Student {prn}", None, prn.encode() * 64)
+
+    def raw(self, db, sql, params):
+        with db.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def assert_rollups_match_events(self, db):
+        for start_day, end_day in self.RANGES:
+            with self.subTest(start=start_day, end=end_day):
+                bounds = (f"{start_day} 00:00:00", f"{end_day} 23:59:59")
+                self.assertEqual(db.attendance_summary(start_day, end_day), self.raw(db, (
+                    "SELECT e.prn, u.name, COUNT(DISTINCT substr(e.ts, 1, 10)), COUNT(*), "
+                    "MIN(substr(e.ts, 1, 10)), MAX(substr(e.ts, 1, 10)) "
+                    "FROM attendance_events e LEFT JOIN users u ON u.prn = e.prn "
+                    "WHERE e.ts BETWEEN ? AND ? GROUP BY e.prn ORDER BY e.prn"
+                ), bounds))
+                self.assertEqual(db.daily_totals(start_day, end_day), self.raw(db, (
+                    "SELECT substr(ts, 1, 10) AS day, COUNT(DISTINCT prn), COUNT(*) FROM attendance_events "
+                    "WHERE ts BETWEEN ? AND ? GROUP BY day ORDER BY day"
+                ), bounds))
+                for prn in self.PRNS:
+                    self.assertEqual(db.student_days(prn, start_day, end_day), self.raw(db, (
+                        "SELECT substr(ts, 1, 10) AS day, COUNT(*), MIN(ts), MAX(ts) FROM attendance_events "
+                        "WHERE prn = ? AND ts BETWEEN ? AND ? GROUP BY day ORDER BY day"
+                    ), (prn, *bounds)))
+
+    def test_batched_inserts(self):
+        db = self.open_database()
+        self.enroll(db)
+        events = self.make_events(seed=7)
+        for prn, ts in events[:len(events) // 2]:
+            db.record_attendance(prn, ts)  # Through the batch writer, 100 rows a commit
+        with db.pool.transaction() as conn:
+            insert_attendance_events(conn, events[len(events) // 2:])
+        self.assert_rollups_match_events(db)
+
+    def test_backfill_of_existing_events(self):
+        # A database from before the rollups: users and raw events only
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(LEGACY_USERS)
+            conn.execute("CREATE TABLE attendance_events (id INTEGER PRIMARY KEY, prn TEXT NOT NULL, ts TEXT NOT NULL)")
+            conn.executemany("INSERT INTO attendance_events (prn, ts) VALUES (?, ?)", self.make_events(seed=8))
+        conn.close()
+
+        db = self.open_database()
+        self.enroll(db)
+        self.assert_rollups_match_events(db)
+        # The triggers take over from the backfill
+        for prn, ts in self.make_events(seed=9, first=28, days=10):
+            db.record_attendance(prn, ts)
+        self.assert_rollups_match_events(db)
+
+
+if __name__ == "__main__":
+    unittest.main()
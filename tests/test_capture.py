@@ -0,0 +1,140 @@
+"""
+Tests for the capture pipeline, driven by the simulated scanner.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from capture import CaptureError, CapturePipeline, SimulatedCapture  # noqa: E402
+
+
+def scripted(*steps):
+    """SimulatedCapture source that returns each step in turn, raising the ones that are exceptions."""
+    steps = iter(steps)
+
+    def capture():
+        step = next(steps)
+        if isinstance(step, Exception):
+            raise step
+        return step
+    return capture
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class CapturePipelineTest(unittest.TestCase):
+
+    def pipeline(self, source, identify=lambda template: template, **kwargs):
+        self.results, self.errors = [], []
+        device = SimulatedCapture(source)
+        self.addCleanup(device.close)
+        pipeline = CapturePipeline(
+            device, identify, on_result=self.results.append, on_error=self.errors.append, retry_delay=0, **kwargs
+        )
+        self.addCleanup(pipeline.join, 5)
+        self.addCleanup(pipeline.stop)
+        return pipeline
+
+    def test_results_in_capture_order(self):
+        templates = [b"T%d" % i for i in range(20)]
+        pipeline = self.pipeline(templates).start()
+        self.assertTrue(pipeline.join(5))
+        self.assertFalse(pipeline.running)
+        self.assertEqual(self.results, templates)
+        stats = pipeline.statistics()
+        self.assertEqual((stats["captured"], stats["identified"], stats["queued"]), (20, 20, 0))
+
+    def test_next_capture_overlaps_identification(self):
+        second_captured = threading.Event()
+        overlapped = []
+
+        def source():
+            source.calls += 1
+            if source.calls == 2:
+                second_captured.set()
+            if source.calls > 3:
+                raise StopIteration
+            return b"T%d" % source.calls
+        source.calls = 0
+
+        def identify(template):
+            # The first match only finishes once the scanner has taken the next finger
+            if template == b"T1":
+                overlapped.append(second_captured.wait(5))
+            return template
+
+        pipeline = self.pipeline(source, identify).start()
+        self.assertTrue(pipeline.join(10))
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(self.results, [b"T1", b"T2", b"T3"])
+
+    def test_no_finger_and_errors(self):
+        busy = CaptureError("Scanner busy")
+        source = scripted(b"A", None, busy, b"BAD", None, b"B")
+
+        def identify(template):
+            if template == b"BAD":
+                raise ValueError("Unreadable template")
+            return template
+
+        pipeline = self.pipeline(source, identify).start()
+        self.assertTrue(pipeline.join(5))
+        self.assertEqual(self.results, [b"A", b"B"])
+        self.assertIs(self.errors[0], busy)
+        self.assertIsInstance(self.errors[1], ValueError)
+        self.assertEqual(len(self.errors), 2)
+        self.assertEqual(pipeline.statistics(), {
+            "captured": 3, "no_finger": 2, "capture_errors": 1, "identified": 2, "identify_errors": 1, "queued": 0,
+        })
+
+    def test_stop_drains_the_bounded_queue(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+
+        def source():
+            source.calls += 1
+            return b"T%d" % source.calls
+        source.calls = 0
+
+        def identify(template):
+            gate.wait(10)
+            return template
+
+        pipeline = self.pipeline(source, identify, depth=2).start()
+        # One template is being identified, two wait in the queue and the scanner holds a fourth
+        self.assertTrue(wait_for(lambda: pipeline.statistics()["captured"] == 4))
+        time.sleep(0.2)
+        stats = pipeline.statistics()
+        self.assertEqual((stats["captured"], stats["queued"]), (4, 2))
+
+        pipeline.stop()
+        gate.set()
+        self.assertTrue(pipeline.join(5))
+        self.assertEqual(self.results[:3], [b"T1", b"T2", b"T3"])
+        self.assertLessEqual(len(self.results), 4)
+        stats = pipeline.statistics()
+        self.assertEqual(stats["captured"], 4)
+        self.assertEqual((stats["identified"], stats["queued"]), (len(self.results), 0))
+
+    def test_start_twice(self):
+        pipeline = self.pipeline([b"A"]).start()
+        with self.assertRaises(RuntimeError):
+            pipeline.start()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Tests for the buffered attendance writer.
+
+    python -m unittest discover tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import BatchWriter, ConnectionPool  # noqa: E402
+from metrics import BATCH_WRITE_FAILURES, REGISTRY  # noqa: E402
+
+
+class FlakyBatch:
+    """write_batch that raises SQLITE_BUSY for the first `failures` calls."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    def __call__(self, conn, rows):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.written.extend(rows)
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pool = ConnectionPool(os.path.join(directory.name, "test.db"), 1)
+        self.addCleanup(self.pool.close)
+
+    def writer(self, write_batch, **kwargs):
+        # A long interval keeps the background thread out of the way
+        writer = BatchWriter(self.pool, write_batch, flush_interval=kwargs.pop("flush_interval", 60), **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_failed_commit_keeps_rows_in_order(self):
+        batch = FlakyBatch(failures=1)
+        writer = self.writer(batch)
+        writer.write(1)
+        writer.write(2)
+        with self.assertRaises(sqlite3.OperationalError):
+            writer.flush()
+        writer.write(3)
+        self.assertEqual(writer.pending(), 3)
+        writer.flush()
+        self.assertEqual(batch.written, [1, 2, 3])
+        self.assertEqual(writer.pending(), 0)
+
+    def test_full_batch_is_not_lost_when_the_commit_fails(self):
+        batch = FlakyBatch(failures=1)
+        writer = self.writer(batch, batch_size=2)
+        writer.write(1)
+        writer.write(2)  # Fills the batch; the inline commit fails but write() does not raise
+        writer.write(3)
+        self.assertEqual(batch.written, [])
+        writer.flush()
+        self.assertEqual(batch.written, [1, 2, 3])
+
+    def test_background_thread_retries_and_counts_failures(self):
+        before = REGISTRY.value(BATCH_WRITE_FAILURES)
+        batch = FlakyBatch(failures=2)
+        writer = self.writer(batch, flush_interval=0.01)
+        writer.write(1)
+        deadline = time.monotonic() + 5
+        while not batch.written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(batch.written, [1])
+        self.assertEqual(REGISTRY.value(BATCH_WRITE_FAILURES) - before, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Tests for the hot set's candidate order and its hit accounting.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import Database  # noqa: E402
+from hotset import HotSet  # noqa: E402
+
+MORNING = datetime(2024, 3, 4, 9, 15)
+
+
+class HotSetTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = Database(os.path.join(directory.name, "fingerprint_data.db"), pool_size=1)
+        self.addCleanup(self.db.close)
+        self.db.initialize()
+
+    def hot_set(self, **kwargs):
+        return HotSet(self.db.pool, save_interval=3600, **kwargs)
+
+    def record(self, hot_set, prn, times):
+        for _ in range(times):
+            hot_set.record(prn, "gate-1", MORNING)
+
+    def test_ranked_orders_by_score_and_stops_at_prefix(self):
+        hot_set = self.hot_set(prefix=2)
+        self.record(hot_set, "P1", 1)
+        self.record(hot_set, "P2", 3)
+        self.record(hot_set, "P3", 2)
+        self.assertEqual(hot_set.ranked("gate-1", MORNING), ["P2", "P3"])
+        self.assertEqual(hot_set.ranked("gate-2", MORNING), [])
+
+    def test_hit_means_ranked_ahead_of_the_gallery(self):
+        hot_set = self.hot_set(prefix=2)
+        self.record(hot_set, "P1", 3)
+        self.record(hot_set, "P2", 2)
+        self.record(hot_set, "P3", 1)
+        stats = hot_set.statistics()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 3))
+
+        # P3 is in the tables but below the prefix, so ranked() did not try it first
+        self.assertNotIn("P3", hot_set.ranked("gate-1", MORNING))
+        hot_set.record("P3", "gate-1", MORNING)
+        stats = hot_set.statistics()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 4))
+
+        self.assertIn("P1", hot_set.ranked("gate-1", MORNING))
+        hot_set.record("P1", "gate-1", MORNING)
+        self.assertEqual(hot_set.statistics()["hits"], 4)
+
+    def test_save_and_load(self):
+        hot_set = self.hot_set()
+        self.record(hot_set, "P1", 2)
+        self.record(hot_set, "P2", 1)
+        hot_set.save()
+        restored = self.hot_set()
+        self.assertEqual(restored.load(), 4)
+        self.assertEqual(restored.ranked("gate-1", MORNING), ["P1", "P2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+"""
+Tests for the kiosk daemon over HTTP on localhost, with the stand-in matcher.
+
+    python -m unittest discover tests
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_gallery, make_probe  # noqa: E402
+from kiosk_daemon import KioskClient, KioskError, KioskServer  # noqa: E402
+from service import KioskService  # noqa: E402
+
+
+class Gate:
+    """Wraps a service method so calls block until the test opens the gate."""
+
+    def __init__(self, func):
+        self.func = func
+        self.opened = threading.Event()
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        self.opened.wait(10)
+        return self.func(*args)
+
+
+class KioskDaemonTestCase(unittest.TestCase):
+
+    server_options = {}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.service = KioskService.open(os.path.join(directory.name, "kiosk.db"), backend="standin", pool_size=2)
+        self.addCleanup(self.service.close)
+        self.gallery = make_gallery(4, seed=5)
+        self.rng = random.Random(5)
+
+        self.loop = asyncio.new_event_loop()
+        self.server = KioskServer(self.service, **self.server_options)
+        self.port = self.loop.run_until_complete(self.server.start("127.0.0.1", 0))
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.stop_server, thread)
+
+    def stop_server(self, thread):
+        async def close():
+            await self.server.close()
+            # Connections still waiting for their next keep-alive request
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in handlers:
+                task.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        thread.join(10)
+        self.loop.close()
+
+    def client(self, terminal=None):
+        client = KioskClient(port=self.port, terminal=terminal, timeout=10)
+        self.addCleanup(client.close)
+        return client
+
+
+class KioskDaemonTest(KioskDaemonTestCase):
+
+    def test_enroll_then_identify(self):
+        client = self.client(terminal="gate-1")
+        for prn, template in self.gallery:
+            self.assertEqual(client.enroll(prn, f"Student {prn}", template), {"prn": prn, "name": f"Student {prn}"})
+
+        prn, template = self.gallery[2]
+        result = client.identify(make_probe(template, self.rng))
+        self.assertTrue(result["match"])
+        self.assertEqual(result["prn"], prn)
+        self.assertFalse(result["repeat"])
+        self.assertIsNotNone(result["timestamp"])
+        self.assertEqual(client.identify(make_probe(template, self.rng))["repeat"], True)
+
+        (_, stranger), = make_gallery(1, seed=6)
+        self.assertEqual(client.identify(stranger), {"match": False})
+        day = result["timestamp"][:10]
+        self.assertEqual(client.attendance_count(f"{day} 00:00:00", f"{day} 23:59:59"), 1)
+
+    def test_identify_without_recording(self):
+        client = self.client()
+        for prn, template in self.gallery:
+            client.enroll(prn, prn, template)
+        prn, template = self.gallery[0]
+        result = client.identify(make_probe(template, self.rng), top_k=3)
+        self.assertEqual(result["prn"], prn)
+        self.assertIsNone(result["timestamp"])
+        self.assertEqual(result["candidates"][0]["prn"], prn)
+        self.assertEqual(client.health()["pending_matches"], 0)
+        with self.service.db.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM attendance_events").fetchone()[0], 0)
+
+    def test_enroll_conflicts(self):
+        client = self.client()
+        prn, template = self.gallery[0]
+        client.enroll(prn, "First", template)
+        with self.assertRaises(KioskError) as raised:
+            client.enroll(prn, "Again", self.gallery[1][1])
+        self.assertEqual(raised.exception.status, 409)
+        with self.assertRaises(KioskError) as raised:
+            client.enroll("OTHER", "Same finger", make_probe(template, self.rng))
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(raised.exception.payload["duplicate_of"], prn)
+
+    def test_bad_requests(self):
+        client = self.client()
+        for call in (
+            lambda: client.identify(b""),
+            lambda: client.identify(b"x", top_k=0),
+            lambda: client.enroll("", "No PRN", b"x"),
+            lambda: client._request("GET", "/attendance?start=yesterday&end=today"),
+        ):
+            with self.assertRaises(KioskError) as raised:
+                call()
+            self.assertEqual(raised.exception.status, 400)
+        with self.assertRaises(KioskError) as raised:
+            client._request("GET", "/nowhere")
+        self.assertEqual(raised.exception.status, 404)
+        with self.assertRaises(KioskError) as raised:
+            client._request("GET", "/identify")
+        self.assertEqual(raised.exception.status, 405)
+
+    def test_keep_alive(self):
+        client = self.client()
+        client.health()
+        sock = client._connection.sock
+        self.assertIsNotNone(sock)
+        prn, template = self.gallery[0]
+        client.enroll(prn, "Kept alive", template)
+        client.identify(template, record=False)
+        self.assertIs(client._connection.sock, sock)
+
+    def test_connection_close(self):
+        client = self.client()
+        payload = client._request("GET", "/health", headers={"Connection": "close"})
+        self.assertEqual(payload["status"], "ok")
+        self.assertIsNone(client._connection.sock)
+
+
+class KioskDaemonAdmissionTest(KioskDaemonTestCase):
+
+    server_options = {"max_pending": 1, "match_timeout": 0.3}
+
+    def test_busy_and_timed_out_matches(self):
+        prn, template = self.gallery[0]
+        self.service.enroll(prn, prn, template)
+        gate = Gate(self.service.check_in)
+        self.service.check_in = gate
+        self.addCleanup(gate.opened.set)
+
+        with self.assertRaises(KioskError) as raised:
+            self.client("slow").identify(template)
+        self.assertEqual(raised.exception.status, 504)
+        self.assertEqual(gate.calls, 1)
+
+        # The timed-out match still holds the only slot, so the next one is refused at once
+        client = self.client("fast")
+        with self.assertRaises(KioskError) as raised:
+            client.identify(template)
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(gate.calls, 1)
+        self.assertEqual(client.health()["pending_matches"], 1)
+
+        gate.opened.set()
+        for _ in range(100):
+            if client.health()["pending_matches"] == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(client.identify(template)["prn"], prn)
+
+
+if __name__ == "__main__":
+    unittest.main()
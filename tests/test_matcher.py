@@ -0,0 +1,164 @@
+"""
+Tests for the verify.exe framing, the one-shot subprocess matcher and the
+long-lived worker matcher.
+
+matcher_worker.py stands in for matcher_server.exe, and with --verify for
+verify.exe, with the same stdin/stdout contracts, so these run without the
+NBioBSP SDK:
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_gallery, make_probe  # noqa: E402
+from gallery_file import write_gallery_file  # noqa: E402
+from matcher import (  # noqa: E402
+    MatcherError, Match, SubprocessMatcher, WorkerMatcher, pack_buffers, run_verify, unpack_buffers,
+)
+
+WORKER_COMMAND = [sys.executable, os.path.join(ROOT, "matcher_worker.py")]
+VERIFY_COMMAND = WORKER_COMMAND + ["--verify"]
+
+
+def forwarding_verifier(expression):
+    """Command that passes `expression` of its stdin (bound to `data`) on to the verifier."""
+    return [sys.executable, "-c", (
+        "import subprocess, sys; "
+        "data = sys.stdin.buffer.read(); "
+        f"sys.exit(subprocess.run({VERIFY_COMMAND!r}, input={expression}).returncode)"
+    )]
+
+
+class BufferFramingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        buffers = [b"", b"\x00", bytes(range(256)) * 3, bytearray(b"fir")]
+        self.assertEqual(unpack_buffers(pack_buffers(*buffers)), [bytes(buffer) for buffer in buffers])
+
+    def test_empty_payload(self):
+        self.assertEqual(pack_buffers(), b"")
+        self.assertEqual(unpack_buffers(b""), [])
+
+    def test_length_prefix(self):
+        self.assertEqual(pack_buffers(b"abc"), struct.pack("<I", 3) + b"abc")
+
+    def test_truncated_length_prefix(self):
+        with self.assertRaises(MatcherError):
+            unpack_buffers(pack_buffers(b"abc") + b"\x01\x00")
+
+    def test_truncated_buffer(self):
+        with self.assertRaises(MatcherError):
+            unpack_buffers(pack_buffers(b"abcdef")[:-1])
+
+    def test_oversized_length_prefix(self):
+        with self.assertRaises(MatcherError):
+            unpack_buffers(struct.pack("<I", 0xFFFFFFFF) + b"abc")
+
+
+class RunVerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        (_, self.template), (_, self.other) = make_gallery(2, seed=1)
+        self.probe = make_probe(self.template, rng)
+
+    def test_match_exits_0(self):
+        self.assertTrue(run_verify(VERIFY_COMMAND, self.probe, self.template))
+
+    def test_no_match_exits_1(self):
+        self.assertFalse(run_verify(VERIFY_COMMAND, self.probe, self.other))
+
+    def test_single_template_exits_2(self):
+        # Both buffers are the probe, so half the input is the probe alone
+        with self.assertRaises(MatcherError) as raised:
+            run_verify(forwarding_verifier("data[:len(data) // 2]"), self.probe, self.probe)
+        self.assertIn("Expected two", str(raised.exception))
+
+    def test_truncated_input_exits_2(self):
+        with self.assertRaises(MatcherError):
+            run_verify(forwarding_verifier("data[:-1]"), self.probe, self.template)
+
+
+class SubprocessMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gallery = make_gallery(6, seed=2)
+        self.rng = random.Random(2)
+        self.matcher = SubprocessMatcher(VERIFY_COMMAND)
+        self.matcher.load(self.gallery)
+
+    def test_finds_enrolled_finger(self):
+        prn, template = self.gallery[3]
+        self.assertEqual(self.matcher.search(make_probe(template, self.rng)), [Match(prn, 1.0)])
+        # verify.exe only answers match or no match, so the first match ends the scan
+        self.assertEqual(self.matcher.last_comparisons, 4)
+
+    def test_unknown_finger(self):
+        (_, stranger), = make_gallery(1, seed=3)
+        self.assertEqual(self.matcher.search(make_probe(stranger, self.rng)), [])
+        self.assertEqual(self.matcher.last_comparisons, len(self.gallery))
+
+    def test_candidates_restrict_and_order_the_scan(self):
+        prn, template = self.gallery[4]
+        probe = make_probe(template, self.rng)
+        self.assertEqual(self.matcher.search(probe, candidates=[prn, self.gallery[0][0]]), [Match(prn, 1.0)])
+        self.assertEqual(self.matcher.last_comparisons, 1)
+        self.assertEqual(self.matcher.search(probe, candidates=[self.gallery[0][0], "UNKNOWN"]), [])
+
+    def test_identify_and_remove(self):
+        prn, template = self.gallery[1]
+        probe = make_probe(template, self.rng)
+        self.assertEqual(self.matcher.identify(probe), prn)
+        self.matcher.remove(prn)
+        self.assertIsNone(self.matcher.identify(probe))
+
+
+class WorkerMatcherRestartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gallery = make_gallery(5, seed=4)
+        self.rng = random.Random(4)
+        self.matcher = WorkerMatcher(WORKER_COMMAND)
+        self.addCleanup(self.matcher.close)
+
+    def kill_worker(self):
+        self.matcher._process.kill()
+        self.matcher._process.wait()
+
+    def probe(self, index):
+        return make_probe(self.gallery[index][1], self.rng)
+
+    def test_restarted_worker_gets_the_gallery_back(self):
+        self.matcher.load(self.gallery[:3])
+        self.matcher.add(*self.gallery[3])
+        self.matcher.remove(self.gallery[0][0])
+        self.kill_worker()
+
+        self.assertEqual(self.matcher.identify(self.probe(1)), self.gallery[1][0])
+        self.assertEqual(self.matcher.restarts, 1)
+        self.assertEqual(self.matcher.identify(self.probe(3)), self.gallery[3][0])
+        self.assertIsNone(self.matcher.identify(self.probe(0)))
+
+    def test_restarted_worker_maps_the_gallery_file_again(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "gallery.bin")
+        write_gallery_file(path, self.gallery[:4], 1)
+        self.matcher.load_file(path)
+        self.matcher.add(*self.gallery[4])
+        self.kill_worker()
+
+        self.assertEqual(self.matcher.identify(self.probe(2)), self.gallery[2][0])
+        self.assertEqual(self.matcher.identify(self.probe(4)), self.gallery[4][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
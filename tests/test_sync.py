@@ -0,0 +1,155 @@
+"""
+Tests for multi-site sync: two site databases and a central store exchanging
+batches and gallery diffs through a DirectoryTransport in a temporary directory.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_gallery  # noqa: E402
+from db import Database  # noqa: E402
+from sync import CentralStore, DirectoryTransport, SiteSync, acknowledged_events  # noqa: E402
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.transport = DirectoryTransport(os.path.join(directory.name, "remote"))
+        self.central = CentralStore(self.open_database(directory.name, "central.db"), self.transport)
+        self.north = SiteSync(self.open_database(directory.name, "north.db"), self.transport, "north")
+        self.south = SiteSync(self.open_database(directory.name, "south.db"), self.transport, "south")
+        self.gallery = make_gallery(4, seed=11)
+        self.day = 0
+
+    def open_database(self, directory, name):
+        db = Database(os.path.join(directory, name), pool_size=1)
+        self.addCleanup(db.close)
+        db.initialize()
+        return db
+
+    def enroll(self, site, index):
+        prn, template = self.gallery[index]
+        site.db.insert_user(prn, f"Student {prn}", None, template)
+        return prn
+
+    def check_in(self, site, prn, count=1):
+        # Distinct timestamps, so every event is its own row wherever it lands
+        for _ in range(count):
+            self.day += 1
+            site.db.record_attendance(prn, f"2024-05-{1 + self.day // 24:02d} {self.day % 24:02d}:00:00")
+
+    def events(self, db):
+        with db.pool.connection() as conn:
+            return sorted(conn.execute("SELECT prn, ts FROM attendance_events").fetchall())
+
+    def users(self, db):
+        with db.pool.connection() as conn:
+            return dict(conn.execute("SELECT prn, fingerprint_data FROM users"))
+
+    def test_events_and_enrollments_reach_every_site(self):
+        north_prn = self.enroll(self.north, 0)
+        south_prn = self.enroll(self.south, 1)
+        self.check_in(self.north, north_prn, 3)
+        self.check_in(self.south, south_prn, 2)
+        stats = self.north.push()
+        self.assertEqual((stats["batches"], stats["events"], stats["users"]), (1, 3, 1))
+        self.assertEqual(stats["bytes"], len(self.transport.read_batch("north", 1)))
+        self.assertEqual(self.south.push()["events"], 2)
+
+        stats = self.central.merge()
+        self.assertEqual((stats["batches"], stats["events"], stats["users"]), (2, 5, 2))
+        self.assertEqual(self.events(self.central.db), sorted(self.events(self.north.db) + self.events(self.south.db)))
+        self.assertEqual([site[:4] for site in self.central.sites()], [("north", 1, 3, 1), ("south", 1, 2, 1)])
+
+        self.assertEqual(self.central.publish()["users"], 2)
+        self.assertEqual(self.north.pull()["users"], 1)
+        self.assertEqual(self.south.pull()["users"], 1)
+        expected = dict(self.gallery[:2])
+        self.assertEqual(self.users(self.north.db), expected)
+        self.assertEqual(self.users(self.south.db), expected)
+
+    def test_pulled_users_are_not_echoed_back(self):
+        self.enroll(self.south, 1)
+        self.south.push()
+        self.central.sync()
+        self.assertEqual(self.north.pull()["users"], 1)
+        self.assertEqual(self.north.push(), {"batches": 0, "events": 0, "users": 0, "bytes": 0})
+
+        # An enrollment made after the pull is still shipped, alone
+        prn = self.enroll(self.north, 2)
+        self.assertEqual(self.north.push()["users"], 1)
+        self.assertEqual(self.central.merge()["users"], 1)
+        self.assertEqual(set(self.users(self.central.db)), {self.gallery[1][0], prn})
+
+    def test_resent_batch_is_merged_once(self):
+        prn = self.enroll(self.north, 0)
+        self.check_in(self.north, prn, 4)
+        self.north.push()
+        data = self.transport.read_batch("north", 1)
+        self.assertEqual(self.central.merge()["events"], 4)
+
+        # The same batch delivered again, e.g. by a retried copy to the share
+        self.transport.put_batch("north", 1, data)
+        stats = self.central.merge()
+        self.assertEqual((stats["batches"], stats["events"], stats["stale"]), (0, 0, 1))
+        self.assertEqual(self.transport.batches("north"), [])
+        self.assertEqual(self.events(self.central.db), self.events(self.north.db))
+
+        # Nothing new: the next push finds the acknowledgement and ships nothing
+        self.assertEqual(self.north.push()["batches"], 0)
+        with self.north.db.pool.connection() as conn:
+            self.assertEqual(acknowledged_events(conn), 4)
+
+    def test_lost_acknowledgement_resends_without_duplicates(self):
+        prn = self.enroll(self.north, 0)
+        self.check_in(self.north, prn, 3)
+        self.north.push()
+        self.central.merge()
+        os.remove(os.path.join(self.transport.root, "sites", "north", "ack.json"))
+
+        # The site cannot tell the batch arrived, so it rewinds and sends it again
+        self.assertEqual(self.north.push()["events"], 3)
+        self.assertEqual(self.central.merge()["stale"], 1)
+        self.assertEqual(self.events(self.central.db), self.events(self.north.db))
+        self.check_in(self.north, prn)
+        self.assertEqual(self.north.push()["events"], 1)
+        self.assertEqual(self.central.merge()["events"], 1)
+        self.assertEqual(self.events(self.central.db), self.events(self.north.db))
+
+    def test_gap_makes_the_site_rewind(self):
+        prn = self.enroll(self.north, 0)
+        self.check_in(self.north, prn, 2)
+        self.north.push()
+        self.central.merge()
+        self.check_in(self.north, prn, 3)
+        self.north.push()
+        self.check_in(self.north, prn, 1)
+        self.north.push()
+        self.assertEqual(self.transport.batches("north"), [("north", 2), ("north", 3)])
+
+        # Batch 2 never arrives, so batch 3 cannot be merged
+        self.transport.remove_batch("north", 2)
+        stats = self.central.merge()
+        self.assertEqual((stats["batches"], stats["dropped"]), (0, 1))
+        self.assertEqual(len(self.events(self.central.db)), 2)
+
+        # With nothing outstanding the site resumes from the acknowledged batch 1
+        stats = self.north.push()
+        self.assertEqual((stats["batches"], stats["events"], stats["users"]), (1, 4, 0))
+        self.assertEqual(self.transport.batches("north"), [("north", 2)])
+        stats = self.central.merge()
+        self.assertEqual((stats["events"], stats["duplicates"]), (4, 0))
+        self.assertEqual(self.events(self.central.db), self.events(self.north.db))
+        self.assertEqual(self.central.sites()[0][:4], ("north", 2, 6, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,126 +1,73 @@
-#include <fstream>
-#include <stdexcept>
+#include <cstdio>
+#include <cstring>
+#include <fcntl.h>
+#include <io.h>
+#include <vector>
 #include "NBioAPI.h"
-#include <iostream>
-#include <ctime> // for time and date in log
 
-// Function to load an FIR from a file
-NBioAPI_RETURN LoadFIRFromFile(const std::string& filePath, NBioAPI_FIR& fir) {
-    std::ifstream file(filePath, std::ios::binary);
-    if (!file.is_open()) {
-        throw std::runtime_error("Failed to open FIR file: " + filePath);
-    }
-
-    // Read FIR format
-    file.read(reinterpret_cast<char*>(&fir.Format), sizeof(fir.Format));
+// One-shot 1:1 verification. Reads the captured and the stored template from
+// stdin, each as a u32 little-endian length followed by the serialized FIR, and
+// prints "match" or "no match" on stdout. No files are read or written.
+// Exit codes: 0 = match, 1 = no match, 2 = bad input or SDK error.
 
-    // Read FIR header
-    file.read(reinterpret_cast<char*>(&fir.Header), sizeof(fir.Header));
+typedef std::vector<unsigned char> Buffer;
 
-    // Allocate memory for FIR data
-    fir.Data = new NBioAPI_UINT8[fir.Header.DataLength];
-    if (!fir.Data) {
-        throw std::runtime_error("Failed to allocate memory for FIR data.");
+// Read one u32 length-prefixed buffer from stdin
+bool ReadBuffer(Buffer& buffer) {
+    NBioAPI_UINT32 length = 0;
+    if (fread(&length, sizeof(length), 1, stdin) != 1) {
+        return false;
     }
-
-    // Read FIR data
-    file.read(reinterpret_cast<char*>(fir.Data), fir.Header.DataLength);
-    file.close();
-
-    return NBioAPIERROR_NONE;
+    buffer.resize(length);
+    return length == 0 || fread(buffer.data(), 1, length, stdin) == length;
 }
 
-// Function to free FIR memory
-void FreeFIR(NBioAPI_FIR& fir) {
-    delete[] fir.Data;
-    fir.Data = nullptr;
-}
-
-// Function to log the result of the fingerprint verification
-void LogResult(bool isMatch, const std::string& logFilePath) {
-    std::ofstream logFile(logFilePath, std::ios::app); // Append mode
-    if (logFile.is_open()) {
-        // Get current time for logging timestamp
-        std::time_t currentTime = std::time(nullptr);
-        char timeBuffer[100];
-        std::strftime(timeBuffer, sizeof(timeBuffer), "%Y-%m-%d %H:%M:%S", std::localtime(&currentTime));
-
-        // Write the result to the log
-        logFile << "[" << timeBuffer << "] Match result: " << (isMatch ? "Success" : "Failure") << std::endl;
-        logFile.close();
+// Point an NBioAPI_FIR at a serialized FIR (Format, Header, Data) without copying
+bool ViewFIR(const Buffer& buffer, NBioAPI_FIR& fir) {
+    if (buffer.size() < sizeof(fir.Format) + sizeof(fir.Header)) {
+        return false;
     }
+    memcpy(&fir.Format, buffer.data(), sizeof(fir.Format));
+    memcpy(&fir.Header, buffer.data() + sizeof(fir.Format), sizeof(fir.Header));
+    size_t dataOffset = sizeof(fir.Format) + sizeof(fir.Header);
+    if (dataOffset + fir.Header.DataLength > buffer.size()) {
+        return false;
+    }
+    fir.Data = const_cast<NBioAPI_UINT8*>(buffer.data() + dataOffset);
+    return true;
 }
 
 int main() {
-    NBioAPI_RETURN ret;
-    NBioAPI_HANDLE g_hBSP = 0;
-    NBioAPI_FIR_HANDLE capturedFIR = 0;
-    NBioAPI_DEVICE_ID deviceID = NBioAPI_DEVICE_ID_AUTO;
-    NBioAPI_FIR existingFIR, capturedFIRData;
-    NBioAPI_BOOL matchResult = NBioAPI_FALSE;
-    NBioAPI_INPUT_FIR inputFIRStored, inputFIRCaptured;
-
-    try {
-        // Initialize the SDK
-        ret = NBioAPI_Init(&g_hBSP);
-        if (ret != NBioAPIERROR_NONE) {
-            LogResult(false, "fingerprint_verification_log.txt");
-            return 1; // Failure
-        }
-
-        // Load the first FIR (fingerprint.fir)
-        ret = LoadFIRFromFile("fingerprint.fir", existingFIR);
-        if (ret != NBioAPIERROR_NONE) {
-            NBioAPI_Terminate(g_hBSP);
-            LogResult(false, "fingerprint_verification_log.txt");
-            return 1; // Failure
-        }
-
-        // Load the second FIR (dataFingerprint.fir)
-        ret = LoadFIRFromFile("dataFingerprint.fir", capturedFIRData);
-        if (ret != NBioAPIERROR_NONE) {
-            FreeFIR(existingFIR);
-            NBioAPI_Terminate(g_hBSP);
-            LogResult(false, "fingerprint_verification_log.txt");
-            return 1; // Failure
-        }
-
-        // Prepare inputs for matching
-        inputFIRStored.Form = NBioAPI_FIR_FORM_FULLFIR;
-        inputFIRStored.InputFIR.FIR = &existingFIR;
-
-        inputFIRCaptured.Form = NBioAPI_FIR_FORM_FULLFIR;
-        inputFIRCaptured.InputFIR.FIR = &capturedFIRData;
-
-        // Perform matching
-        ret = NBioAPI_VerifyMatch(g_hBSP, &inputFIRStored, &inputFIRCaptured, &matchResult, nullptr);
-        if (ret == NBioAPIERROR_NONE) {
-            // Log the match result (Success or Failure)
-            LogResult(matchResult == NBioAPI_TRUE, "fingerprint_verification_log.txt");
+    _setmode(_fileno(stdin), _O_BINARY);
+
+    Buffer captured, stored;
+    NBioAPI_FIR capturedFIR, storedFIR;
+    if (!ReadBuffer(captured) || !ReadBuffer(stored)
+            || !ViewFIR(captured, capturedFIR) || !ViewFIR(stored, storedFIR)) {
+        fprintf(stderr, "Expected two length-prefixed FIR templates on stdin.\n");
+        return 2;
+    }
 
-            if (matchResult == NBioAPI_TRUE) {
-                return 0; // Match found
-            } else {
-                return 1; // No match found
-            }
-        } else {
-            LogResult(false, "fingerprint_verification_log.txt");
-            return 1; // Failure in verification
-        }
+    NBioAPI_HANDLE hBSP = 0;
+    if (NBioAPI_Init(&hBSP) != NBioAPIERROR_NONE) {
+        fprintf(stderr, "Failed to initialize the NBioBSP SDK.\n");
+        return 2;
+    }
 
-        // Free FIR resources
-        FreeFIR(existingFIR);
-        FreeFIR(capturedFIRData);
+    NBioAPI_INPUT_FIR inputCaptured, inputStored;
+    inputCaptured.Form = NBioAPI_FIR_FORM_FULLFIR;
+    inputCaptured.InputFIR.FIR = &capturedFIR;
+    inputStored.Form = NBioAPI_FIR_FORM_FULLFIR;
+    inputStored.InputFIR.FIR = &storedFIR;
 
-        // Cleanup and terminate
-        NBioAPI_Terminate(g_hBSP);
+    NBioAPI_BOOL matchResult = NBioAPI_FALSE;
+    NBioAPI_RETURN ret = NBioAPI_VerifyMatch(hBSP, &inputCaptured, &inputStored, &matchResult, nullptr);
+    NBioAPI_Terminate(hBSP);
 
-        return 1; // Unexpected case
-    } catch (const std::exception& e) {
-        FreeFIR(existingFIR);
-        FreeFIR(capturedFIRData);
-        NBioAPI_Terminate(g_hBSP);
-        LogResult(false, "fingerprint_verification_log.txt");
-        return 1; // Failure
+    if (ret != NBioAPIERROR_NONE) {
+        fprintf(stderr, "Verification failed: error code %u\n", static_cast<unsigned>(ret));
+        return 2;
     }
+    printf(matchResult == NBioAPI_TRUE ? "match\n" : "no match\n");
+    return matchResult == NBioAPI_TRUE ? 0 : 1;
 }